@@ -0,0 +1,90 @@
+import sys
+import cv2
+import time
+import argparse
+import numpy as np
+from is_wire.core import Logger
+from is_msgs.image_pb2 import ObjectAnnotations
+from utils import load_options, make_pb_image, fit_frame, scale_annotations
+from requester import AsyncRequester
+
+parser = argparse.ArgumentParser(
+    description='Compares request payloads of full resolution frames against downscaled ones')
+parser.add_argument('--video', '-v', type=str, required=True, help='Video used as frame source')
+parser.add_argument(
+    '--frames', '-n', type=int, default=100, help='Number of frames read from the video')
+parser.add_argument(
+    '--size',
+    '-s',
+    type=int,
+    nargs=2,
+    default=[656, 368],
+    metavar=('WIDTH', 'HEIGHT'),
+    help='Size frames are downscaled to fit')
+parser.add_argument(
+    '--quality', '-q', type=float, default=0.8, help='JPEG quality of the downscaled frames')
+parser.add_argument(
+    '--link-mbps',
+    type=float,
+    default=100.0,
+    help='Link bandwidth used to estimate the transfer bound request rate')
+parser.add_argument(
+    '--topics',
+    '-t',
+    nargs='+',
+    help='If set, frames are also sent to these detector topics to measure throughput')
+parser.add_argument('--max-requests', type=int, default=10, help='Requests kept in flight')
+args = parser.parse_args()
+
+log = Logger(name='BenchmarkPayload')
+
+cap = cv2.VideoCapture(args.video)
+frames = []
+while len(frames) < args.frames:
+    ok, frame = cap.read()
+    if not ok:
+        break
+    frames.append(frame)
+if len(frames) == 0:
+    log.critical("Can't read frames from '{}'", args.video)
+    sys.exit(-1)
+
+configurations = [('baseline', None, 0.9), ('downscaled', args.size, args.quality)]
+for name, size, quality in configurations:
+    t0 = time.time()
+    payloads = []
+    for frame in frames:
+        fx, fy = 1.0, 1.0
+        if size is not None:
+            frame, fx, fy = fit_frame(frame, size)
+        payloads.append((make_pb_image(frame, compression_level=quality), fx, fy))
+    encode_time = time.time() - t0
+
+    sizes = np.array([len(pb_image.data) for pb_image, _, _ in payloads])
+    link_rate = args.link_mbps * 1e6 / 8.0 / sizes.mean()
+    log.info('{:>10s} | {:.1f} KB/frame (max {:.1f} KB) | encode {:.1f} fps | '
+             'link bound {:.1f} requests/s', name,
+             sizes.mean() / 1024.0, sizes.max() / 1024.0, len(frames) / encode_time, link_rate)
+
+    if args.topics is None:
+        continue
+
+    replies = {}
+    resolution = (frames[0].shape[1], frames[0].shape[0])
+
+    def on_reply(key, annotations):
+        _, fx, fy = payloads[key]
+        replies[key] = scale_annotations(annotations, fx, fy, resolution)
+
+    requester = AsyncRequester(
+        broker_uri=load_options(print_options=False).broker_uri,
+        topics=args.topics,
+        reply_type=ObjectAnnotations,
+        max_requests=args.max_requests,
+        name='BenchmarkPayload')
+    t0 = time.time()
+    requester.run(((n, payload[0]) for n, payload in enumerate(payloads)), on_reply)
+    elapsed = time.time() - t0
+    log.info('{:>10s} | {} replies in {:.2f}s | {:.1f} requests/s | {:.2f} MB/s sent', name,
+             len(replies), elapsed,
+             len(replies) / elapsed, sizes.sum() / elapsed / 1e6)
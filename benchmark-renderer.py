@@ -0,0 +1,90 @@
+import sys
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+from is_wire.core import Logger
+from is_msgs.image_pb2 import ObjectAnnotations
+from google.protobuf.json_format import ParseDict
+from skeletons_renderer import SkeletonsRenderer, SkeletonsView3D, LINKS, COLORS
+
+parser = argparse.ArgumentParser(
+    description='Measures the frames per second of skeletons rendering, comparing the '
+    'renderer of keypoint arrays against parsing and drawing each link of every frame')
+parser.add_argument(
+    'annotations', type=str, help="2D annotations file, e.g. 'p001g01c00_2d.json'")
+parser.add_argument('--video', '-v', type=str, help='Video used as frame source')
+parser.add_argument(
+    '--resolution',
+    '-r',
+    type=int,
+    nargs=2,
+    default=[1288, 728],
+    metavar=('WIDTH', 'HEIGHT'),
+    help='Resolution of blank frames, when there is no video')
+parser.add_argument(
+    '--localizations', '-l', type=str, help="If set, 3D localizations drawn by the 3D view")
+parser.add_argument(
+    '--scale', '-s', type=float, default=0.5, help='Scale of the views skeletons are drawn on')
+parser.add_argument(
+    '--repeat', '-n', type=int, default=3, help='Times all frames of the sequence are drawn')
+args = parser.parse_args()
+
+log = Logger(name='BenchmarkRenderer')
+
+with open(args.annotations, 'r') as f:
+    annotations = json.load(f)['annotations']
+n_frames = len(annotations)
+if n_frames == 0:
+    log.critical("There are no annotations on '{}'", args.annotations)
+    sys.exit(-1)
+
+if args.video is not None:
+    ok, frame = cv2.VideoCapture(args.video).read()
+    if not ok:
+        log.critical("Can't read frames from '{}'", args.video)
+        sys.exit(-1)
+else:
+    frame = np.zeros((args.resolution[1], args.resolution[0], 3), dtype=np.uint8)
+dsize = (int(frame.shape[1] * args.scale), int(frame.shape[0] * args.scale))
+
+
+def draw_links(image, it):
+    # per frame parsing and drawing, as the viewers used to do
+    skeletons = ParseDict(annotations[it], ObjectAnnotations())
+    for ob in skeletons.objects:
+        parts = {}
+        for part in ob.keypoints:
+            parts[part.id] = (int(part.position.x), int(part.position.y))
+        for (begin, end), color in zip(LINKS, COLORS):
+            if begin in parts and end in parts:
+                cv2.line(image, parts[begin], parts[end], color=color, thickness=4)
+        for _, center in parts.items():
+            cv2.circle(image, center=center, radius=4, color=(255, 255, 255), thickness=-1)
+    return cv2.resize(image, dsize=dsize)
+
+
+t0 = time.time()
+renderer = SkeletonsRenderer(args.annotations)
+log.info('{} frames converted to keypoint arrays in {:.2f}s', n_frames, time.time() - t0)
+
+n_skeletons = np.array([len(a['objects']) for a in annotations])
+log.info('{:.1f} skeletons per frame (max {})', n_skeletons.mean(), n_skeletons.max())
+
+configurations = [
+    ('links', lambda it: draw_links(frame.copy(), it)),
+    ('arrays', lambda it: renderer.draw(cv2.resize(frame, dsize=dsize), it, args.scale)),
+    ('resize', lambda it: cv2.resize(frame, dsize=dsize)),
+]
+if args.localizations is not None:
+    view = SkeletonsView3D(args.localizations)
+    configurations.append(('3d', view.draw))
+for name, render in configurations:
+    t0 = time.time()
+    for _ in range(args.repeat):
+        for it in range(n_frames):
+            render(it)
+    elapsed = time.time() - t0
+    log.info('{:>6s} | {:.1f} fps | {:.2f} ms/frame', name, args.repeat * n_frames / elapsed,
+             1000.0 * elapsed / (args.repeat * n_frames))
@@ -12,7 +12,9 @@ import cv2
 import numpy as np
 from utils import load_options
 from is_msgs.image_pb2 import Image
-from is_wire.core import Channel, Subscription, Message, Logger
+from is_wire.core import Subscription, Message, Logger
+from local_broker import make_channel
+from mosaic import Mosaic, camera_resolutions
 
 
 def get_id(topic):
@@ -24,14 +26,6 @@ def get_id(topic):
         return int(match.group(1))
 
 
-def place_images(output_image, images):
-    w, h = images[0].shape[1], images[0].shape[0]
-    output_image[0:h, 0:w, :] = images[0]
-    output_image[0:h, w:2 * w, :] = images[1]
-    output_image[h:2 * h, 0:w, :] = images[2]
-    output_image[h:2 * h, w:2 * w, :] = images[3]
-
-
 def draw_info_bar(image,
                   text,
                   x,
@@ -119,14 +113,12 @@ if os.path.exists(sequence_folder):
 
 os.makedirs(sequence_folder)
 
-channel = Channel(options.broker_uri)
+channel = make_channel(options.broker_uri)
 subscription = Subscription(channel)
 for camera in options.cameras:
     subscription.subscribe('CameraGateway.{}.Frame'.format(camera.id))
 
-size = (2 * options.cameras[0].config.image.resolution.height,
-        2 * options.cameras[0].config.image.resolution.width, 3)
-full_image = np.zeros(size, dtype=np.uint8)
+mosaic = Mosaic(camera_resolutions(options), scale=0.5)
 
 images_data = {}
 current_timestamps = {}
@@ -166,12 +158,12 @@ while True:
 
         # display images
         if n_sample % display_rate == 0:
-            images = [
-                cv2.imdecode(data, cv2.IMREAD_COLOR)
-                for _, data in images_data.items()
-            ]
-            place_images(full_image, images)
-            display_image = cv2.resize(full_image, (0, 0), fx=0.5, fy=0.5)
+            images = {
+                camera: cv2.imdecode(data, cv2.IMREAD_COLOR)
+                for camera, data in images_data.items()
+            }
+            mosaic.compose(images)
+            display_image = mosaic.image
             # put recording message
             draw_info_bar(
                 display_image,
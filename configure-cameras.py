@@ -1,10 +1,11 @@
-from is_wire.core import Channel, Subscription, Message, Logger
+from is_wire.core import Subscription, Message, Logger
+from local_broker import make_channel
 from utils import load_options
 
 log = Logger(name='ConfigureCameras')
 
 options = load_options()
-c = Channel(options.broker_uri)
+c = make_channel(options.broker_uri)
 sb = Subscription(c)
 
 cids = {}
@@ -0,0 +1,55 @@
+import os
+import re
+import sys
+import argparse
+from is_wire.core import Logger
+from utils import load_options
+from skeletons_store import SkeletonsStore, from_json, store_filename
+
+parser = argparse.ArgumentParser(
+    description='Converts 2D/3D annotation JSON files of the dataset to columnar stores')
+parser.add_argument(
+    '--force', '-f', action='store_true', help='If set, converts files already converted.')
+parser.add_argument(
+    '--verify',
+    '-v',
+    action='store_true',
+    help='If set, checks that every frame read back from the store matches the JSON file.')
+args = parser.parse_args()
+
+log = Logger(name='ConvertAnnotations')
+options = load_options(print_options=False)
+
+if not os.path.exists(options.folder):
+    log.critical("Folder '{}' doesn't exist", options.folder)
+    sys.exit(-1)
+
+files = next(os.walk(options.folder))[2]  # only files from first folder level
+json_files = sorted(filter(lambda x: re.search(r'p[0-9]{3}g[0-9]{2}.*_[23]d.json$', x), files))
+
+json_bytes, store_bytes = 0, 0
+for json_file in json_files:
+    json_path = os.path.join(options.folder, json_file)
+    store_path = store_filename(json_path)
+    if not args.force and os.path.exists(store_path) and \
+            os.path.getmtime(store_path) >= os.path.getmtime(json_path):
+        continue
+
+    writer, data = from_json(json_path)
+    writer.save(store_path, created_at=data.get('created_at', ''))
+    json_bytes += os.path.getsize(json_path)
+    store_bytes += os.path.getsize(store_path)
+
+    if args.verify:
+        store = SkeletonsStore(store_path)
+        originals = data[store.key]
+        mismatches = [it for it in range(len(store)) if store.to_dict(it) != originals[it]]
+        if len(store) != len(originals) or len(mismatches) > 0:
+            log.error("'{}' differs from its JSON file on {} frames", store_path,
+                      len(mismatches) + abs(len(store) - len(originals)))
+            continue
+    log.info("'{}' converted ({} frames)", json_file, len(writer))
+
+if json_bytes > 0:
+    log.info('{:.1f} MB of JSON stored in {:.1f} MB ({:.1f}x smaller)', json_bytes / 1e6,
+             store_bytes / 1e6, json_bytes / store_bytes)
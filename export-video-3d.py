@@ -9,79 +9,13 @@ import numpy as np
 from utils import load_options
 from utils import to_labels_array, to_labels_dict
 from video_loader import MultipleVideoLoader
+from skeletons_renderer import SkeletonsView3D, load_renderers, render_skeletons
+from mosaic import Mosaic, camera_resolutions
 from is_wire.core import Logger
 from collections import defaultdict, OrderedDict
 
-from is_msgs.image_pb2 import ObjectAnnotations
-from is_msgs.image_pb2 import HumanKeypoints as HKP
-from google.protobuf.json_format import ParseDict
-from itertools import permutations
-
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-
-colors = list(permutations([0, 255, 85, 170], 3))
-links = [(HKP.Value('HEAD'), HKP.Value('NECK')), (HKP.Value('NECK'), HKP.Value('CHEST')),
-         (HKP.Value('CHEST'), HKP.Value('RIGHT_HIP')), (HKP.Value('CHEST'), HKP.Value('LEFT_HIP')),
-         (HKP.Value('NECK'), HKP.Value('LEFT_SHOULDER')),
-         (HKP.Value('LEFT_SHOULDER'), HKP.Value('LEFT_ELBOW')),
-         (HKP.Value('LEFT_ELBOW'), HKP.Value('LEFT_WRIST')),
-         (HKP.Value('NECK'), HKP.Value('LEFT_HIP')), (HKP.Value('LEFT_HIP'),
-                                                      HKP.Value('LEFT_KNEE')),
-         (HKP.Value('LEFT_KNEE'), HKP.Value('LEFT_ANKLE')),
-         (HKP.Value('NECK'), HKP.Value('RIGHT_SHOULDER')),
-         (HKP.Value('RIGHT_SHOULDER'), HKP.Value('RIGHT_ELBOW')),
-         (HKP.Value('RIGHT_ELBOW'), HKP.Value('RIGHT_WRIST')),
-         (HKP.Value('NECK'), HKP.Value('RIGHT_HIP')),
-         (HKP.Value('RIGHT_HIP'), HKP.Value('RIGHT_KNEE')),
-         (HKP.Value('RIGHT_KNEE'), HKP.Value('RIGHT_ANKLE')),
-         (HKP.Value('NOSE'), HKP.Value('LEFT_EYE')), (HKP.Value('LEFT_EYE'),
-                                                      HKP.Value('LEFT_EAR')),
-         (HKP.Value('NOSE'), HKP.Value('RIGHT_EYE')),
-         (HKP.Value('RIGHT_EYE'), HKP.Value('RIGHT_EAR'))]
-
-
-def render_skeletons(images, annotations, it, links, colors):
-    for cam_id, image in images.items():
-        skeletons = ParseDict(annotations[cam_id][it], ObjectAnnotations())
-        for ob in skeletons.objects:
-            parts = {}
-            for part in ob.keypoints:
-                parts[part.id] = (int(part.position.x), int(part.position.y))
-            for link_parts, color in zip(links, colors):
-                begin, end = link_parts
-                if begin in parts and end in parts:
-                    cv2.line(image, parts[begin], parts[end], color=color, thickness=4)
-            for _, center in parts.items():
-                cv2.circle(image, center=center, radius=4, color=(255, 255, 255), thickness=-1)
-
-
-def render_skeletons_3d(ax, skeletons, links, colors):
-    skeletons_pb = ParseDict(skeletons, ObjectAnnotations())
-    for skeleton in skeletons_pb.objects:
-        parts = {}
-        for part in skeleton.keypoints:
-            parts[part.id] = (part.position.x, part.position.y, part.position.z)
-        for link_parts, color in zip(links, colors):
-            begin, end = link_parts
-            if begin in parts and end in parts:
-                x_pair = [parts[begin][0], parts[end][0]]
-                y_pair = [parts[begin][1], parts[end][1]]
-                z_pair = [parts[begin][2], parts[end][2]]
-                ax.plot(
-                    x_pair,
-                    y_pair,
-                    zs=z_pair,
-                    linewidth=3,
-                    color='#{:02X}{:02X}{:02X}'.format(*reversed(color)))
-
-
-def place_images(output_image, images, x_offset=0, y_offset=0):
-    w, h = images[0].shape[1], images[0].shape[0]
-    output_image[0 + y_offset:h + y_offset, 0 + x_offset:w + x_offset, :] = images[0]
-    output_image[0 + y_offset:h + y_offset, w + x_offset:2 * w + x_offset, :] = images[1]
-    output_image[h + y_offset:2 * h + y_offset, 0 + x_offset:w + x_offset, :] = images[2]
-    output_image[h + y_offset:2 * h + y_offset, w + x_offset:2 * w + x_offset, :] = images[3]
+DISPLAY_SCALE = 0.5
+VIEW_3D_SIZE = 500
 
 
 log = Logger(name='WatchVideos')
@@ -133,23 +67,19 @@ if not all(
     log.critical('Missing one of video or annotations files from PERSON_ID {} and GESTURE_ID {}',
                  person_id, gesture_id)
 
-size = (2 * options.cameras[0].config.image.resolution.height,
-        2 * options.cameras[0].config.image.resolution.width, 3)
-full_image = np.zeros(size, dtype=np.uint8)
+mosaic = Mosaic(camera_resolutions(options, cameras), scale=DISPLAY_SCALE)
+hd, wd, _ = mosaic.shape
+hv = wv = min(VIEW_3D_SIZE, hd)
+# cameras mosaic and 3D view are drawn in place, on slices of the displayed image
+display_image = np.full((hd, wd + wv, 3), 255, dtype=np.uint8)
+full_image = display_image[:, :wd]
+full_image[:] = 0
+view_3d = display_image[(hd - hv) // 2:(hd + hv) // 2, wd:]
 
 video_loader = MultipleVideoLoader(video_files)
-# load annotations
-annotations = {}
-for cam_id, filename in json_files.items():
-    with open(filename, 'r') as f:
-        annotations[cam_id] = json.load(f)['annotations']
-#load localizations
-with open(json_locaizations_file, 'r') as f:
-    localizations = json.load(f)['localizations']
-
-plt.ioff()
-fig = plt.figure(figsize=(5, 5))
-ax = Axes3D(fig)
+# annotations are converted to keypoint arrays once, when the renderers are created
+renderers = load_renderers(json_files)
+view = SkeletonsView3D(json_locaizations_file, size=(wv, hv), azim=28, elev=32)
 
 update_image = True
 output_file = 'p{:03d}g{:02d}_output.mp4'.format(person_id, gesture_id)
@@ -160,33 +90,9 @@ for it_frames in range(video_loader.n_frames()):
 
     frames = video_loader[it_frames]
     if frames is not None:
-        render_skeletons(frames, annotations, it_frames, links, colors)
-        frames_list = [frames[cam] for cam in sorted(frames.keys())]
-        place_images(full_image, frames_list)
-
-    ax.clear()
-    ax.view_init(azim=28, elev=32)
-    ax.set_xlim(-1.5, 1.5)
-    ax.set_xticks(np.arange(-1.5, 2.0, 0.5))
-    ax.set_ylim(-1.5, 1.5)
-    ax.set_yticks(np.arange(-1.5, 2.0, 0.5))
-    ax.set_zlim(-0.25, 1.5)
-    ax.set_zticks(np.arange(0, 1.75, 0.5))
-    ax.set_xlabel('X', labelpad=20)
-    ax.set_ylabel('Y', labelpad=10)
-    ax.set_zlabel('Z', labelpad=5)
-    render_skeletons_3d(ax, localizations[it_frames], links, colors)
-
-    fig.canvas.draw()
-    data = np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep='')
-    view_3d = data.reshape(fig.canvas.get_width_height()[::-1] + (3, ))
-
-    display_image = cv2.resize(full_image, dsize=(0, 0), fx=0.5, fy=0.5)
-    hd, wd, _ = display_image.shape
-    hv, wv, _ = view_3d.shape
-
-    display_image = np.hstack([display_image, 255 * np.ones(shape=(hd, wv, 3), dtype=np.uint8)])
-    display_image[int((hd - hv) / 2):int((hd + hv) / 2), wd:, :] = view_3d
+        render_skeletons(mosaic.compose(frames, out=full_image), renderers, it_frames)
+
+    view.draw(it_frames, out=view_3d)
 
     if it_frames == 0:
         video_writer.open(
@@ -0,0 +1,224 @@
+import os
+import re
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from collections import defaultdict, deque
+from is_wire.core import Logger
+from utils import load_options
+from skeletons_store import store_filename, fresh_store, from_json
+from skeletons_renderer import SkeletonsView3D, load_renderers, render_skeletons
+from mosaic import Mosaic, camera_resolutions
+from video_writer import fourcc
+
+DISPLAY_SCALE = 0.5
+VIEW_3D_SIZE = 500
+OUTPUT_FILE = 'p{:03d}g{:02d}_output.mp4'
+
+
+def sequence_files(folder, person_id, gesture_id, cameras):
+    prefix = os.path.join(folder, 'p{:03d}g{:02d}'.format(person_id, gesture_id))
+    videos = {camera: '{}c{:02d}.mp4'.format(prefix, camera) for camera in cameras}
+    annotations = {camera: '{}c{:02d}_2d.json'.format(prefix, camera) for camera in cameras}
+    return videos, annotations, '{}_3d.json'.format(prefix)
+
+
+def is_up_to_date(output_file, inputs):
+    if not os.path.exists(output_file):
+        return False
+    return os.path.getmtime(output_file) >= max(os.path.getmtime(f) for f in inputs)
+
+
+class SequenceRenderer:
+    """ Renders the frames of a sequence as export-video-3d.py does, keeping the video
+    captures open so consecutive chunks given to a worker are decoded without seeking. """
+
+    def __init__(self, videos, annotations, localizations, resolutions):
+        self._captures = {camera: cv2.VideoCapture(f) for camera, f in videos.items()}
+        self._position = 0
+        self._renderers = load_renderers(annotations)
+        self._mosaic = Mosaic(resolutions, scale=DISPLAY_SCALE)
+        hd, wd, _ = self._mosaic.shape
+        hv = wv = min(VIEW_3D_SIZE, hd)
+        self._view = SkeletonsView3D(localizations, size=(wv, hv), azim=28, elev=32)
+        self._display = np.full((hd, wd + wv, 3), 255, dtype=np.uint8)
+        self._mosaic_image = self._display[:, :wd]
+        self._mosaic_image[:] = 0
+        self._view_3d = self._display[(hd - hv) // 2:(hd + hv) // 2, wd:]
+
+    def render(self, begin, end):
+        if begin != self._position:
+            for capture in self._captures.values():
+                capture.set(cv2.CAP_PROP_POS_FRAMES, begin)
+        rendered = []
+        for it in range(begin, end):
+            frames = {}
+            for camera, capture in self._captures.items():
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                frames[camera] = frame
+            if len(frames) < len(self._captures):
+                break
+            tiles = self._mosaic.compose(frames, out=self._mosaic_image)
+            render_skeletons(tiles, self._renderers, it)
+            self._view.draw(it, out=self._view_3d)
+            rendered.append(self._display.copy())
+        self._position = begin + len(rendered)
+        return rendered
+
+
+worker_sequence = None
+
+
+def init_worker():
+    # workers are already one per core, OpenCV threads would only compete with them
+    cv2.setNumThreads(1)
+
+
+def render_chunk(task):
+    global worker_sequence
+    key, begin, end, files, resolutions = task
+    if worker_sequence is None or worker_sequence[0] != key:
+        worker_sequence = (key, SequenceRenderer(*files, resolutions=resolutions))
+    t0 = time.time()
+    frames = worker_sequence[1].render(begin, end)
+    return os.getpid(), time.time() - t0, frames
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Exports the videos of every sequence on the dataset folder, with 2D '
+        'skeletons drawn over the cameras and the 3D skeletons view')
+    parser.add_argument(
+        '--workers', '-w', type=int, default=cpu_count(), help='Processes rendering frames')
+    parser.add_argument(
+        '--chunk-size', '-c', type=int, default=25, help='Frames rendered by each task')
+    parser.add_argument(
+        '--max-pending',
+        type=int,
+        default=2,
+        help='Tasks given to each worker ahead of the writer, bounding the frames in memory')
+    parser.add_argument(
+        '--output-folder',
+        '-o',
+        type=str,
+        help='Where videos are saved. Defaults to the folder on options')
+    parser.add_argument(
+        '--force', '-f', action='store_true', help='If set, exports even up to date videos')
+    parser.add_argument(
+        '--report-every', type=float, default=5.0, help='Seconds between progress reports')
+    args = parser.parse_args()
+
+    log = Logger(name='ExportVideos')
+    options = load_options(print_options=False)
+    if not os.path.exists(options.folder):
+        log.critical("Folder '{}' doesn't exist", options.folder)
+        sys.exit(-1)
+    output_folder = args.output_folder or options.folder
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    cameras = [int(camera.id) for camera in options.cameras]
+    resolutions = camera_resolutions(options, cameras)
+    fps = options.cameras[0].config.sampling.frequency.value or 10.0
+
+    sequences = set()
+    for filename in os.listdir(options.folder):
+        matches = re.search(r'^p([0-9]{3})g([0-9]{2})_3d.json$', filename)
+        if matches is not None:
+            sequences.add((int(matches.group(1)), int(matches.group(2))))
+
+    pending, up_to_date = [], 0
+    for person_id, gesture_id in sorted(sequences):
+        videos, annotations, localizations = sequence_files(options.folder, person_id,
+                                                            gesture_id, cameras)
+        inputs = list(videos.values()) + list(annotations.values()) + [localizations]
+        if not all(map(os.path.exists, inputs)):
+            log.warn('Missing video or annotations files of PERSON_ID {} GESTURE_ID {}',
+                     person_id, gesture_id)
+            continue
+        output_file = os.path.join(output_folder, OUTPUT_FILE.format(person_id, gesture_id))
+        if not args.force and is_up_to_date(output_file, inputs):
+            up_to_date += 1
+            continue
+        # workers memory map columnar stores instead of parsing JSON files each of them
+        for filename in list(annotations.values()) + [localizations]:
+            if fresh_store(filename) is None:
+                writer, data = from_json(filename)
+                writer.save(store_filename(filename), created_at=data.get('created_at', ''))
+        n_frames = min(
+            int(cv2.VideoCapture(f).get(cv2.CAP_PROP_FRAME_COUNT)) for f in videos.values())
+        pending.append(((person_id, gesture_id), (videos, annotations, localizations),
+                        output_file, n_frames))
+    log.info('{} sequences to export, {} up to date', len(pending), up_to_date)
+
+    def tasks():
+        for key, files, _, n_frames in pending:
+            for begin in range(0, n_frames, args.chunk_size):
+                yield key, begin, min(begin + args.chunk_size, n_frames), files, resolutions
+
+    busy, rendered = defaultdict(float), defaultdict(int)
+    started_at = reported_at = time.time()
+    written, reported = 0, 0
+    pool = Pool(processes=args.workers, initializer=init_worker)
+    try:
+        # results are taken in the order tasks were given, so frames go straight to the
+        # writers, and only a few tasks per worker are given ahead of them
+        all_tasks = tasks()
+        in_flight = deque()
+
+        def next_frames():
+            for task in all_tasks:
+                in_flight.append(pool.apply_async(render_chunk, (task, )))
+                if len(in_flight) >= args.workers * args.max_pending:
+                    break
+            pid, elapsed, frames = in_flight.popleft().get()
+            busy[pid] += elapsed
+            rendered[pid] += len(frames)
+            return frames
+
+        for (person_id, gesture_id), _, output_file, n_frames in pending:
+            tmp_file = '{}.tmp.mp4'.format(os.path.splitext(output_file)[0])
+            writer = None
+            for _ in range(0, n_frames, args.chunk_size):
+                frames = next_frames()
+                for frame in frames:
+                    if writer is None:
+                        writer = cv2.VideoWriter(
+                            filename=tmp_file,
+                            fourcc=fourcc,
+                            fps=fps,
+                            frameSize=(frame.shape[1], frame.shape[0]))
+                        if not writer.isOpened():
+                            log.critical("Unable to write '{}'", tmp_file)
+                            sys.exit(-1)
+                    writer.write(frame)
+                written += len(frames)
+
+                now = time.time()
+                if now - reported_at >= args.report_every:
+                    workers = ' '.join('{:.1f}'.format(rendered[pid] / busy[pid])
+                                       for pid in sorted(busy) if busy[pid] > 0)
+                    log.info('{} frames written | {:.1f} fps | per worker fps: {}', written,
+                             (written - reported) / (now - reported_at), workers)
+                    reported_at, reported = now, written
+            if writer is None:
+                log.warn("No frames to export on '{}'", output_file)
+                continue
+            writer.release()
+            os.replace(tmp_file, output_file)
+            log.info("'{}' exported", output_file)
+    finally:
+        pool.terminate()
+
+    elapsed = time.time() - started_at
+    log.info('{} frames of {} sequences in {:.1f}s, {:.1f} fps', written, len(pending), elapsed,
+             written / max(elapsed, 1e-9))
+
+
+if __name__ == '__main__':
+    main()
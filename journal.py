@@ -0,0 +1,43 @@
+import os
+import json
+
+
+class Journal:
+    """ Append-only file of JSON lines. Every line is flushed once appended, so it survives
+    the process being killed; a last line cut short by a crash is dropped when reopened. """
+
+    def __init__(self, filename):
+        self._filename = filename
+        valid_size = 0
+        if os.path.exists(filename):
+            for line, size in self._lines():
+                valid_size += size
+        self._file = open(filename, 'ab')
+        self._file.truncate(valid_size)
+
+    def _lines(self):
+        with open(self._filename, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    return
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    return
+                yield entry, len(line)
+
+    def entries(self):
+        self._file.flush()
+        for entry, _ in self._lines():
+            yield entry
+
+    def append(self, entry):
+        self._file.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        self._file.close()
+        os.remove(self._filename)
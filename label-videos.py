@@ -3,52 +3,20 @@ import re
 import sys
 import cv2
 import json
+import time
 import argparse
 import numpy as np
 from utils import load_options
-from utils import to_labels_array, to_labels_dict
-from video_loader import MultipleVideoLoader
+from spots import Spots, PENDING_BEGIN
+from spot_suggestions import load_suggestions
+from video_loader import VideoPrefetcher
+from proxies import proxy_videos
+from mosaic import Mosaic, camera_resolutions
+from timeline import Timeline
 from is_wire.core import Logger
 from collections import defaultdict, OrderedDict
-import time
-
 
-def place_images(output_image, images, x_offset=0, y_offset=0):
-    w, h = images[0].shape[1], images[0].shape[0]
-    output_image[0 + y_offset:h + y_offset, 0 + x_offset:w + x_offset, :] = images[0]
-    output_image[0 + y_offset:h + y_offset, w + x_offset:2 * w + x_offset, :] = images[1]
-    output_image[h + y_offset:2 * h + y_offset, 0 + x_offset:w + x_offset, :] = images[2]
-    output_image[h + y_offset:2 * h + y_offset, w + x_offset:2 * w + x_offset, :] = images[3]
-
-
-def draw_labels(output_image, y_offset, labels, current_pos, n_loaded_frames=None):
-    w, h = output_image.shape[1], output_image.shape[0]
-    scale = w / len(labels)
-    output_image[h - y_offset:, :, :] = 0
-
-    def draw_rect(x, width, color):
-        pt1 = (int(x - width / 2), int(h - y_offset))
-        pt2 = (int(x + width / 2), int(h))
-        cv2.rectangle(img=output_image, pt1=pt1, pt2=pt2, color=color, thickness=cv2.FILLED)
-
-    maybe_begins = scale * np.where(labels == 2)[0]
-    begins = scale * np.where(labels == 1)[0]
-    gestures = scale * np.where(labels == 3)[0]
-    ends = scale * np.where(labels == -1)[0]
-    for p in maybe_begins:
-        draw_rect(p, scale, (0, 255, 0))
-    for p in begins:
-        draw_rect(p, scale, (255, 0, 0))
-    for p in gestures:
-        draw_rect(p, scale, (127, 127, 127))
-    for p in ends:
-        draw_rect(p, scale, (0, 0, 255))
-    draw_rect(scale * current_pos, scale, (0, 255, 255))
-    if param.n_loaded_frames is not None:
-        not_loaded = len(labels) - param.n_loaded_frames
-        x = scale * (not_loaded / 2 + param.n_loaded_frames)
-        width = scale * not_loaded
-        draw_rect(x, width, (255, 255, 255))
+DISPLAY_SCALE = 0.5
 
 
 def put_text(image, text, x, y, color=(255, 255, 255), font_scale=1.5, thickness=2):
@@ -66,6 +34,17 @@ parser = argparse.ArgumentParser(
     description='Utility to capture a sequence of images from multiples cameras')
 parser.add_argument(
     '--skip-labeled', '-s', action='store_true', help='If set, skips videos already labeled.')
+parser.add_argument(
+    '--frames-scale',
+    type=float,
+    default=1.0,
+    help='Scale frames are kept in memory, e.g. {} keeps them at display size'.format(
+        DISPLAY_SCALE))
+parser.add_argument(
+    '--prefetch-memory',
+    type=float,
+    default=1024,
+    help='Megabytes of frames of the next sequence loaded while labeling the current one')
 args = parser.parse_args()
 
 log = Logger(name='LabelVideos')
@@ -84,11 +63,8 @@ with open('gestures.json', 'r') as f:
     gestures_labels = json.load(f)
     gestures_labels = OrderedDict(sorted(gestures_labels.items(), key=lambda kv: int(kv[0])))
 
-bottom_bar_h = 50
-top_bar_h = 75
-height = 2 * options.cameras[0].config.image.resolution.height
-width = 2 * options.cameras[0].config.image.resolution.width
-size = (height + bottom_bar_h + top_bar_h, width, 3)
+bottom_bar_h = int(50 * DISPLAY_SCALE)
+top_bar_h = int(75 * DISPLAY_SCALE)
 
 files = next(os.walk(options.folder))[2]  # only files from first folder level
 video_files = list(filter(lambda x: x.endswith('.mp4'), files))
@@ -104,6 +80,32 @@ for video_file in video_files:
     captures[person_id][gesture_id].add(camera)
 
 
+def labels_filename(person_id, gesture_id):
+    return os.path.join(options.folder, 'p{:03d}g{:02d}_spots.json'.format(
+        person_id, gesture_id))
+
+
+sequences = []
+for person_id, gestures in sorted(captures.items()):
+    for gesture_id, cameras in sorted(gestures.items()):
+        if args.skip_labeled and os.path.exists(labels_filename(person_id, gesture_id)):
+            continue
+        sequences.append((person_id, gesture_id, cameras))
+
+
+def prefetch(n):
+    person_id, gesture_id, cameras = sequences[n]
+    video_files = {
+        camera: os.path.join(options.folder, 'p{:03d}g{:02d}c{:02d}.mp4'.format(
+            person_id, gesture_id, camera))
+        for camera in sorted(cameras)
+    }
+    # proxies made by make-proxies.py are used when up to date, as they load much faster
+    video_files, _ = proxy_videos(video_files)
+    return VideoPrefetcher(
+        video_files, scale=args.frames_scale, max_bytes=int(args.prefetch_memory * (1 << 20)))
+
+
 class LabelingParameters:
     def __init__(self):
         self.it_frames = 0
@@ -128,135 +130,169 @@ def mouse_events(event, x, y, flags, param):
 
 cv2.namedWindow('')
 cv2.setMouseCallback('', mouse_events, param)
-for person_id, gestures in captures.items():
-    for gesture_id, cameras in gestures.items():
-
-        cameras_str = '[' + ', '.join(map(str, cameras)) + ']'
-        log.info('Loading PERSON_ID: {:03d} GESTURE_ID: {:02d} CAMERAS: {:s}', person_id,
-                 gesture_id, cameras_str)
-        video_files = {
-            camera: os.path.join(options.folder, 'p{:03d}g{:02d}c{:02d}.mp4'.format(
-                person_id, gesture_id, camera))
-            for camera in sorted(cameras)
-        }
-        video_loader = MultipleVideoLoader(video_files)
-        labels = np.zeros(video_loader.n_frames(), dtype=np.int8)
-
-        # check if label file already exists
-        labels_file = os.path.join(options.folder, 'p{:03d}g{:02d}_spots.json'.format(
-            person_id, gesture_id))
-        if os.path.exists(labels_file):
-            if args.skip_labeled:
-                continue
-            with open(labels_file, 'r') as f:
-                labels = to_labels_array(json.load(f))
-
-        full_image = np.zeros(size, dtype=np.uint8)
-        put_text(
-            full_image,
-            'PERSON_ID: {:03d} GESTURE_ID: {:02d} ({:s})'.format(person_id, gesture_id,
-                                                                 gestures_labels[str(gesture_id)]),
-            x=20,
-            y=0.8 * top_bar_h)
-        original_labels = np.copy(labels)
-        param.it_frames = 0
-        param.update_image, waiting_end, current_begin, current_images = True, False, 0, []
-        while True:
-            if video_loader.n_loaded_frames() < video_loader.n_frames():
-                param.update_image = True
-            param.n_loaded_frames = video_loader.load_next()
-
-            if param.update_image:
-                frames = video_loader[param.it_frames]
-                if frames is not None:
-                    frames_list = [frames[cam] for cam in sorted(frames.keys())]
-                    place_images(full_image, frames_list, y_offset=top_bar_h)
-                    draw_labels(full_image, top_bar_h, labels, param.it_frames, param.n_loaded_frames)
-                cv2.imshow('', cv2.resize(full_image, dsize=(0, 0), fx=0.5, fy=0.5))
-                param.update_image = False
-
-            key = cv2.waitKey(1)
-            if key == -1:
-                continue
-
-            if key == ord(keymap['next_frames']):
-                param.it_frames += keymap['big_step']
-                param.it_frames = param.it_frames if param.it_frames < param.n_loaded_frames else 0
-                param.update_image = True
+prefetcher = None
+for n, (person_id, gesture_id, cameras) in enumerate(sequences):
+
+    cameras_str = '[' + ', '.join(map(str, cameras)) + ']'
+    log.info('Loading PERSON_ID: {:03d} GESTURE_ID: {:02d} CAMERAS: {:s}', person_id,
+             gesture_id, cameras_str)
+    # frames of the sequence may have been loaded while the previous one was labeled
+    video_loader = (prefetcher if prefetcher is not None else prefetch(n)).get()
+    prefetcher = None
+    spots = Spots(video_loader.n_frames())
+
+    labels_file = labels_filename(person_id, gesture_id)
+    if os.path.exists(labels_file):
+        with open(labels_file, 'r') as f:
+            try:
+                spots = Spots.from_dict(json.load(f))
+            except ValueError as ex:
+                log.critical("Invalid spots on '{}': {}", labels_file, ex)
+                sys.exit(-1)
+
+    mosaic = Mosaic(camera_resolutions(options, cameras), scale=DISPLAY_SCALE)
+    height, width, _ = mosaic.shape
+    full_image = np.zeros((height + bottom_bar_h + top_bar_h, width, 3), dtype=np.uint8)
+    mosaic_image = full_image[top_bar_h:top_bar_h + height]
+    timeline_image = full_image[top_bar_h + height:]
+    timeline = Timeline(spots.to_array(), width, bottom_bar_h)
+
+    # spots suggested where the arms move, when there are 3D localizations of the sequence
+    suggestions = Spots(spots.n_samples)
+    localizations_file = os.path.join(options.folder, 'p{:03d}g{:02d}_3d.json'.format(
+        person_id, gesture_id))
+    if os.path.exists(localizations_file):
+        t0 = time.time()
+        suggestions = Spots(spots.n_samples, [
+            suggestion for suggestion in load_suggestions(localizations_file, spots.n_samples)
+            if not spots.overlaps(*suggestion)
+        ])
+        timeline.set_suggestions(suggestions)
+        log.info('{} spots suggested in {:.1f}ms', len(suggestions), 1000 * (time.time() - t0))
+    put_text(
+        full_image,
+        'PERSON_ID: {:03d} GESTURE_ID: {:02d} ({:s})'.format(person_id, gesture_id,
+                                                             gestures_labels[str(gesture_id)]),
+        x=20 * DISPLAY_SCALE,
+        y=0.8 * top_bar_h,
+        font_scale=1.5 * DISPLAY_SCALE,
+        thickness=1)
+    saved_spots = spots.copy()
+    param.it_frames = 0
+    param.update_image, waiting_end, current_begin, current_images = True, False, 0, []
+    while True:
+        if video_loader.n_loaded_frames() < video_loader.n_frames():
+            param.update_image = True
+        elif prefetcher is None and n + 1 < len(sequences):
+            # only after the current sequence is loaded, to not slow it down
+            prefetcher = prefetch(n + 1)
+        param.n_loaded_frames = video_loader.load_next()
+
+        if param.update_image:
+            frames = video_loader[param.it_frames]
+            if frames is not None:
+                mosaic.compose(frames, out=mosaic_image)
+                labels = spots.to_array()
+                if waiting_end:
+                    labels[current_begin] = PENDING_BEGIN
+                timeline.update(labels)
+                timeline.draw(timeline_image, param.it_frames, param.n_loaded_frames)
+            cv2.imshow('', full_image)
+            param.update_image = False
+
+        key = cv2.waitKey(1)
+        if key == -1:
+            continue
+
+        if key == ord(keymap['next_frames']):
+            param.it_frames += keymap['big_step']
+            param.it_frames = param.it_frames if param.it_frames < param.n_loaded_frames else 0
+            param.update_image = True
 
-            if key == ord(keymap['next_frame']):
-                param.it_frames += 1
-                param.it_frames = param.it_frames if param.it_frames < param.n_loaded_frames else 0
-                param.update_image = True
+        if key == ord(keymap['next_frame']):
+            param.it_frames += 1
+            param.it_frames = param.it_frames if param.it_frames < param.n_loaded_frames else 0
+            param.update_image = True
 
-            if key == ord(keymap['previous_frames']):
-                param.it_frames -= keymap['big_step']
-                param.it_frames = param.n_loaded_frames - 1 if param.it_frames < 0 else param.it_frames
-                param.update_image = True
+        if key == ord(keymap['previous_frames']):
+            param.it_frames -= keymap['big_step']
+            param.it_frames = param.n_loaded_frames - 1 if param.it_frames < 0 else param.it_frames
+            param.update_image = True
 
-            if key == ord(keymap['previous_frame']):
-                param.it_frames -= 1
-                param.it_frames = param.n_loaded_frames - 1 if param.it_frames < 0 else param.it_frames
-                param.update_image = True
+        if key == ord(keymap['previous_frame']):
+            param.it_frames -= 1
+            param.it_frames = param.n_loaded_frames - 1 if param.it_frames < 0 else param.it_frames
+            param.update_image = True
 
-            if key == ord(keymap['begin_label']):
-                if labels[param.it_frames] == 0 and not waiting_end:
-                    labels[param.it_frames] = 2
-                    current_begin = param.it_frames
-                    waiting_end = True
-                    param.update_image = True
-                elif param.it_frames == current_begin and waiting_end:
-                    labels[param.it_frames] = 0
-                    waiting_end = False
-                    param.update_image = True
-                elif (labels[param.it_frames] == -1 or labels[param.it_frames] == 3) and not waiting_end:
-                    previous_begin = np.where(labels[:param.it_frames] == 1)[0][-1]
-                    param.it_frames = previous_begin
-                    param.update_image = True
+        spot = spots.enclosing(param.it_frames)
+        if key == ord(keymap['begin_label']):
+            if spot is None and not waiting_end:
+                current_begin = param.it_frames
+                waiting_end = True
+                param.update_image = True
+            elif param.it_frames == current_begin and waiting_end:
+                waiting_end = False
+                param.update_image = True
+            elif spot is not None and param.it_frames != spot[0] and not waiting_end:
+                param.it_frames = spot[0]
+                param.update_image = True
 
-            if key == ord(keymap['end_label']):
-                if labels[param.it_frames] == 0 and waiting_end:
-                    if param.it_frames > current_begin:
-                        labels[current_begin] = 1
-                        labels[param.it_frames] = -1
-                        labels[current_begin + 1:param.it_frames] = 3
+        if key == ord(keymap['end_label']):
+            if spot is None and waiting_end:
+                if param.it_frames > current_begin:
+                    if spots.overlaps(current_begin, param.it_frames):
+                        log.warn("Spots can't overlap each other")
+                    else:
+                        spots.add(current_begin, param.it_frames)
                         waiting_end = False
                         param.update_image = True
-                elif labels[param.it_frames] == -1:
-                    labels[param.it_frames] = 0
-                    current_begin = np.where(labels[:param.it_frames] == 1)[0][-1]
-                    labels[current_begin] = 2
-                    labels[current_begin + 1:param.it_frames] = 0
-                    waiting_end = True
-                    param.update_image = True
-                elif (labels[param.it_frames] == 1 or labels[param.it_frames] == 3) and not waiting_end:
-                    next_end = np.where(labels[param.it_frames:] == -1)[0][0] + param.it_frames
-                    param.it_frames = next_end
-                    param.update_image = True
+            elif spot is not None and param.it_frames == spot[1] and not waiting_end:
+                current_begin, _ = spots.remove(param.it_frames)
+                waiting_end = True
+                param.update_image = True
+            elif spot is not None and param.it_frames != spot[1] and not waiting_end:
+                param.it_frames = spot[1]
+                param.update_image = True
 
-            if key == ord(keymap['delete_label']):
-                if labels[param.it_frames] == 3 and not waiting_end:
-                    begin = np.where(labels[:param.it_frames] == 1)[0][-1]
-                    end = np.where(labels[param.it_frames:] == -1)[0][0] + param.it_frames
-                    labels[begin:end + 1] = 0
-                    param.update_image = True
+        if key == ord(keymap['delete_label']):
+            if spot is not None and spot[0] < param.it_frames < spot[1] and not waiting_end:
+                spots.remove(param.it_frames)
+                param.update_image = True
 
-            if key == ord(keymap['save_labels']):
-                indexes, counts = np.unique(labels, return_counts=True)
-                counts_dict = dict(zip(indexes, counts))
-                if not waiting_end and counts_dict[-1] == counts_dict[1]:
-                    with open(labels_file, 'w') as f:
-                        json.dump(to_labels_dict(labels), f, indent=2)
-                        log.info("File '{}' saved", labels_file)
-                    original_labels = labels
-
-            if key == ord(keymap['next_sequence']):
-                if np.all(labels == original_labels):
-                    break
+        to_next_suggestion = key == ord(keymap['next_suggestion'])
+        if key == ord(keymap['accept_suggestion']):
+            suggestion = suggestions.enclosing(param.it_frames)
+            if suggestion is not None and not waiting_end:
+                if spots.overlaps(*suggestion):
+                    log.warn("Spots can't overlap each other")
                 else:
-                    log.warn('You have unsaved changes! Save before move to next sequence.')
+                    spots.add(*suggestion)
+                    suggestions.remove(param.it_frames)
+                    timeline.set_suggestions(suggestions)
+                    to_next_suggestion = True
+                    param.update_image = True
+
+        if to_next_suggestion:
+            # to the next suggestion, or back to the first one
+            suggestion = suggestions.next(param.it_frames) or next(iter(suggestions), None)
+            if suggestion is not None and suggestion[0] < param.n_loaded_frames:
+                param.it_frames = suggestion[0]
+                param.update_image = True
 
-            if key == ord(keymap['exit']):
-                sys.exit(0)
+        if key == ord(keymap['save_labels']):
+            if not waiting_end:
+                with open(labels_file, 'w') as f:
+                    json.dump(spots.to_dict(), f, indent=2)
+                    log.info("File '{}' saved", labels_file)
+                saved_spots = spots.copy()
+
+        if key == ord(keymap['next_sequence']):
+            if not waiting_end and spots == saved_spots:
+                break
+            else:
+                log.warn('You have unsaved changes! Save before move to next sequence.')
+
+        if key == ord(keymap['exit']):
+            sys.exit(0)
 
 log.info('Exiting')
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import sys
+import socket
+import argparse
+import socketserver
+from queue import Queue
+from threading import Thread
+from six.moves import urllib
+from is_wire.core import Logger
+from utils import load_options
+from local_broker import LocalBroker, FrameReader, send_frame, DEFAULT_SOCKET
+
+log = Logger(name='LocalBroker')
+
+parser = argparse.ArgumentParser(
+    description="Serves a broker through a unix socket, used by channels of 'unix://' URIs")
+parser.add_argument(
+    '--socket',
+    '-s',
+    type=str,
+    help="Socket path. Defaults to the path of 'broker_uri' on options when it is a "
+    "'unix://' URI, or to '{}'".format(DEFAULT_SOCKET))
+args = parser.parse_args()
+
+if args.socket is None:
+    options = load_options(print_options=False)
+    url = urllib.parse.urlparse(options.broker_uri)
+    args.socket = url.path if url.scheme == 'unix' and url.path else DEFAULT_SOCKET
+
+broker = LocalBroker()
+
+
+class ClientInbox:
+    # deliveries are written by a thread of each client, so slow consumers don't block
+    # the clients publishing to them
+    def __init__(self, sock):
+        self._sock = sock
+        self._deliveries = Queue()
+        self._thread = Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, delivery):
+        self._deliveries.put(delivery)
+
+    def close(self):
+        self._deliveries.put(None)
+
+    def _write(self):
+        while True:
+            delivery = self._deliveries.get()
+            if delivery is None:
+                break
+            consumer_tag, key, (properties, body) = delivery
+            try:
+                send_frame(self._sock, {
+                    'tag': consumer_tag,
+                    'key': key,
+                    'properties': properties
+                }, body)
+            except OSError:
+                break
+
+
+class ClientHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        inbox = ClientInbox(self.request)
+        reader = FrameReader(self.request)
+        try:
+            while True:
+                header, body = reader.read()
+                op = header['op']
+                if op == 'publish':
+                    broker.publish(header['key'], (header['properties'], body))
+                elif op == 'declare':
+                    broker.declare(header['queue'], header['tag'], inbox)
+                elif op == 'bind':
+                    broker.bind(header['queue'], header['key'])
+                elif op == 'unbind':
+                    broker.unbind(header['queue'], header['key'])
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broker.remove(inbox)
+            inbox.close()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+if os.path.exists(args.socket):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(args.socket)
+        log.critical("There is a broker already listening on '{}'", args.socket)
+        sys.exit(-1)
+    except OSError:
+        os.remove(args.socket)
+    finally:
+        probe.close()
+
+server = Server(args.socket, ClientHandler)
+log.info("Listening on 'unix://{}'", args.socket)
+try:
+    server.serve_forever()
+finally:
+    os.remove(args.socket)
@@ -0,0 +1,255 @@
+import re
+import copy
+import json
+import time
+import queue
+import select
+import socket
+import struct
+from threading import Lock
+from six.moves import urllib
+from is_wire.core import Channel
+from is_wire.core.wire.conversion import WireV1
+
+FRAME_HEADER = struct.Struct('<II')
+DEFAULT_SOCKET = '/tmp/is-broker.sock'
+
+
+def topic_regex(binding):
+    # AMQP topic bindings, where '*' matches one word and '#' zero or more of them.
+    # Every word, including the first one, is matched with its leading dot.
+    parts = []
+    for word in binding.split('.'):
+        if word == '#':
+            parts.append(r'(?:\.[^.]+)*')
+        elif word == '*':
+            parts.append(r'\.[^.]+')
+        else:
+            parts.append(r'\.' + re.escape(word))
+    return re.compile('^{}$'.format(''.join(parts)))
+
+
+class LocalBroker:
+    """ Topic exchange routing published payloads to the inbox of every queue bound to the
+    routing key. Queues are removed along with the inbox which owns them. """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._queues = {}
+        self._bindings = {}
+        self._wildcards = {}
+
+    def declare(self, queue_name, consumer_tag, inbox):
+        with self._lock:
+            self._queues[queue_name] = (consumer_tag, inbox)
+
+    def bind(self, queue_name, key):
+        with self._lock:
+            if '*' in key or '#' in key:
+                regex, queues = self._wildcards.setdefault(key, (topic_regex(key), set()))
+                queues.add(queue_name)
+            else:
+                self._bindings.setdefault(key, set()).add(queue_name)
+
+    def unbind(self, queue_name, key):
+        with self._lock:
+            self._bindings.get(key, set()).discard(queue_name)
+            if key in self._wildcards:
+                self._wildcards[key][1].discard(queue_name)
+
+    def remove(self, inbox):
+        with self._lock:
+            for queue_name, (_, queue_inbox) in list(self._queues.items()):
+                if queue_inbox is inbox:
+                    del self._queues[queue_name]
+            for queues in self._bindings.values():
+                queues.intersection_update(self._queues)
+            for _, queues in self._wildcards.values():
+                queues.intersection_update(self._queues)
+
+    def publish(self, key, payload):
+        with self._lock:
+            names = set(self._bindings.get(key, ()))
+            for regex, queues in self._wildcards.values():
+                if regex.match('.' + key):
+                    names.update(queues)
+            targets = [self._queues[name] for name in names if name in self._queues]
+        for consumer_tag, inbox in targets:
+            inbox.put((consumer_tag, key, payload))
+
+
+BROKERS = {}
+BROKERS_LOCK = Lock()
+
+
+def inproc_broker(name):
+    with BROKERS_LOCK:
+        return BROKERS.setdefault(name, LocalBroker())
+
+
+class BrokerChannel:
+    """ Stands for the amqp channel used by is_wire Subscription. """
+
+    def __init__(self, declare, bind, unbind):
+        self._declare = declare
+        self._bind = bind
+        self._unbind = unbind
+
+    def queue_declare(self, queue, **kwargs):
+        self._declare(queue, None)
+
+    def queue_bind(self, queue, exchange, routing_key):
+        self._bind(queue, routing_key)
+
+    def queue_unbind(self, queue, exchange, routing_key):
+        self._unbind(queue, routing_key)
+
+    def basic_consume(self, queue, callback, consumer_tag, **kwargs):
+        self._declare(queue, consumer_tag)
+
+
+class InprocChannel(Channel):
+    """ is_wire Channel over a broker living in this process. Messages are handed over
+    without serialization, so only copies of their envelopes are made. """
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._inbox = queue.Queue()
+        self._channel = BrokerChannel(
+            declare=lambda queue_name, tag: broker.declare(queue_name, tag, self._inbox),
+            bind=broker.bind,
+            unbind=broker.unbind)
+        self._exchange = 'is'
+        self.subscriptions = []
+        self.amqp_message = None
+
+    def publish(self, message, topic=None):
+        if not message.has_topic() and not topic:
+            raise RuntimeError("Trying to publish message without topic")
+        self._broker.publish(message.topic if topic is None else topic, message)
+
+    def consume(self, timeout=None):
+        if timeout is not None:
+            assert timeout >= 0.0
+        while True:
+            try:
+                consumer_tag, key, message = self._inbox.get(timeout=timeout)
+            except queue.Empty:
+                raise socket.timeout('timed out')
+            if message.has_timeout() and message.deadline_exceeded():
+                continue
+            delivered = copy.copy(message)
+            delivered.metadata = dict(message.metadata)
+            delivered.topic = key
+            delivered.subscription_id = consumer_tag
+            return delivered
+
+    def close(self):
+        self._broker.remove(self._inbox)
+
+
+class AmqpMessage:
+    def __init__(self, body, key, consumer_tag, properties):
+        self.body = body
+        self.delivery_info = {'routing_key': key, 'consumer_tag': consumer_tag}
+        self.properties = properties
+
+
+def send_frame(sock, header, body=b''):
+    if not isinstance(body, bytes):
+        body = body.encode('latin')
+    header_data = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(header_data), len(body)) + header_data + body)
+
+
+class FrameReader:
+    """ Reads (header, body) frames from a socket, keeping partial frames between calls
+    which timed out. """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._buffer = bytearray()
+
+    def read(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if len(self._buffer) >= FRAME_HEADER.size:
+                header_size, body_size = FRAME_HEADER.unpack_from(self._buffer)
+                end = FRAME_HEADER.size + header_size + body_size
+                if len(self._buffer) >= end:
+                    header = json.loads(
+                        self._buffer[FRAME_HEADER.size:FRAME_HEADER.size +
+                                     header_size].decode('utf-8'))
+                    body = bytes(self._buffer[FRAME_HEADER.size + header_size:end])
+                    del self._buffer[:end]
+                    return header, body
+            if deadline is not None:
+                ready = select.select([self._sock], [], [], max(deadline - time.time(), 0.0))[0]
+                if len(ready) == 0:
+                    raise socket.timeout('timed out')
+            data = self._sock.recv(1 << 16)
+            if len(data) == 0:
+                raise ConnectionError('Broker connection closed')
+            self._buffer.extend(data)
+
+
+class UnixChannel(Channel):
+    """ is_wire Channel connected to the broker served by local-broker.py through a unix
+    socket, exchanging length prefixed frames of JSON headers and raw bodies. """
+
+    def __init__(self, path):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._reader = FrameReader(self._sock)
+        self._send_lock = Lock()
+        self._channel = BrokerChannel(self._declare, self._bind, self._unbind)
+        self._exchange = 'is'
+        self.subscriptions = []
+        self.amqp_message = None
+
+    def _send(self, header, body=b''):
+        with self._send_lock:
+            send_frame(self._sock, header, body)
+
+    def _declare(self, queue_name, consumer_tag):
+        self._send({'op': 'declare', 'queue': queue_name, 'tag': consumer_tag})
+
+    def _bind(self, queue_name, key):
+        self._send({'op': 'bind', 'queue': queue_name, 'key': key})
+
+    def _unbind(self, queue_name, key):
+        self._send({'op': 'unbind', 'queue': queue_name, 'key': key})
+
+    def publish(self, message, topic=None):
+        if not message.has_topic() and not topic:
+            raise RuntimeError("Trying to publish message without topic")
+        self._send({
+            'op': 'publish',
+            'key': message.topic if topic is None else topic,
+            'properties': WireV1.to_amqp_properties(message)
+        }, message.body)
+
+    def consume(self, timeout=None):
+        if timeout is not None:
+            assert timeout >= 0.0
+        while True:
+            header, body = self._reader.read(timeout)
+            message = WireV1.from_amqp_message(
+                AmqpMessage(body, header['key'], header['tag'], header['properties']))
+            if message.has_timeout() and message.deadline_exceeded():
+                continue
+            return message
+
+    def close(self):
+        self._sock.close()
+
+
+def make_channel(uri):
+    """ Channel for 'inproc://<name>' brokers inside this process, 'unix://<path>' ones
+    served by local-broker.py, or any other URI of an AMQP broker. """
+    url = urllib.parse.urlparse(uri)
+    if url.scheme == 'inproc':
+        return InprocChannel(inproc_broker(url.netloc + url.path))
+    if url.scheme == 'unix':
+        return UnixChannel(url.path or DEFAULT_SOCKET)
+    return Channel(uri)
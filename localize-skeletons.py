@@ -0,0 +1,147 @@
+import os
+import re
+import sys
+import time
+import argparse
+import datetime
+import numpy as np
+from collections import defaultdict
+from is_wire.core import Logger
+from google.protobuf.json_format import MessageToDict
+from utils import load_options, atomic_json_dump
+from skeletons_store import SkeletonsWriter, load_arrays, store_filename
+from triangulation import load_calibrations, localize_sequence, to_annotations, compare_skeletons
+
+LOCALIZATION_FILE = 'p{:03d}g{:02d}_3d.json'
+
+parser = argparse.ArgumentParser(
+    description='Localizes 3D skeletons of the dataset locally, without SkeletonsGrouper')
+parser.add_argument(
+    '--calibrations',
+    '-c',
+    type=str,
+    required=True,
+    help="Folder with the '<camera_id>.json' calibration of every camera")
+parser.add_argument(
+    '--reference', type=int, default=1000, help='Frame of reference of the localizations')
+parser.add_argument(
+    '--max-distance',
+    type=float,
+    default=50.0,
+    help='Maximum mean epipolar distance, in pixels, to match skeletons of two views')
+parser.add_argument(
+    '--min-views', type=int, default=2, help='Minimum views to localize a keypoint')
+parser.add_argument('--person', '-p', type=int, help='If set, only this person is localized')
+parser.add_argument('--gesture', '-g', type=int, help='If set, only this gesture is localized')
+parser.add_argument(
+    '--force', '-f', action='store_true', help='If set, overwrites existing localizations')
+parser.add_argument(
+    '--compare',
+    action='store_true',
+    help='If set, nothing is saved and results are compared against existing localizations')
+parser.add_argument(
+    '--columnar',
+    action='store_true',
+    help='If set, localizations are also saved as columnar stores next to the JSON files')
+args = parser.parse_args()
+
+log = Logger(name='LocalizeSkeletons')
+options = load_options(print_options=False)
+
+if not os.path.exists(options.folder):
+    log.critical("Folder '{}' doesn't exist", options.folder)
+    sys.exit(-1)
+
+cameras = [int(camera_cfg.id) for camera_cfg in options.cameras]
+models = load_calibrations(args.calibrations, cameras, args.reference)
+
+files = next(os.walk(options.folder))[2]  # only files from first folder level
+entries = defaultdict(set)
+for annotation_file in files:
+    matches = re.search(r'p([0-9]{3})g([0-9]{2})c([0-9]{2})_2d.(json|skl)$', annotation_file)
+    if matches is None:
+        continue
+    person_id, gesture_id = int(matches.group(1)), int(matches.group(2))
+    if args.person not in (None, person_id) or args.gesture not in (None, gesture_id):
+        continue
+    entries[(person_id, gesture_id)].add(int(matches.group(3)))
+
+n_frames_done, elapsed = 0, 0.0
+all_errors, all_same_count, all_compared = [], 0, 0
+for (person_id, gesture_id), camera_ids in sorted(entries.items()):
+    if not set(cameras).issubset(camera_ids):
+        log.warn("PERSON_ID: {:03d} GESTURE_ID: {:02d} | Can't find all detections file.",
+                 person_id, gesture_id)
+        continue
+    filepath = os.path.join(options.folder, LOCALIZATION_FILE.format(person_id, gesture_id))
+    has_localizations = os.path.exists(filepath) or os.path.exists(store_filename(filepath))
+    if args.compare and not has_localizations:
+        continue
+    if not args.compare and not args.force and has_localizations:
+        log.info('PERSON_ID: {:03d} GESTURE_ID: {:02d} | Already have localization file.',
+                 person_id, gesture_id)
+        continue
+
+    t0 = time.time()
+    skeletons = {
+        camera: load_arrays(
+            os.path.join(options.folder, 'p{:03d}g{:02d}c{:02d}_2d.json'.format(
+                person_id, gesture_id, camera)))
+        for camera in cameras
+    }
+    n_frames = [len(s['n_objects']) for s in skeletons.values()]
+    if not all(map(lambda x: x == n_frames[0], n_frames)):
+        log.warn("PERSON_ID: {:03d} GESTURE_ID: {:02d} | Annotations size inconsistent.",
+                 person_id, gesture_id)
+        continue
+    t1 = time.time()
+    localizations = localize_sequence(
+        models, skeletons, max_distance=args.max_distance, min_views=args.min_views)
+    t2 = time.time()
+    n_frames_done += n_frames[0]
+    elapsed += t2 - t1
+
+    if args.compare:
+        errors, same_count, compared = compare_skeletons(localizations, load_arrays(filepath))
+        all_errors.append(errors)
+        all_same_count += same_count
+        all_compared += compared
+        log.info(
+            'PERSON_ID: {:03d} GESTURE_ID: {:02d} | {} frames in {:.1f}ms (load {:.1f}ms) | '
+            'error mean={:.4f} p95={:.4f} | same skeletons count on {:.1f}% of frames',
+            person_id, gesture_id, n_frames[0], 1000.0 * (t2 - t1), 1000.0 * (t1 - t0),
+            errors.mean() if errors.size > 0 else float('nan'),
+            np.percentile(errors, 95) if errors.size > 0 else float('nan'),
+            100.0 * same_count / max(compared, 1))
+        continue
+
+    annotations = to_annotations(localizations, frame_id=args.reference)
+    output_localizations = {
+        'localizations': [
+            MessageToDict(
+                a, preserving_proto_field_name=True, including_default_value_fields=True)
+            for a in annotations
+        ],
+        'created_at':
+        datetime.datetime.now().isoformat()
+    }
+    atomic_json_dump(output_localizations, filepath, indent=2)
+    if args.columnar:
+        writer = SkeletonsWriter(key='localizations')
+        for pos, a in enumerate(annotations):
+            writer.add(pos, a)
+        writer.save(store_filename(filepath), created_at=output_localizations['created_at'])
+    log.info('PERSON_ID: {:03d} GESTURE_ID: {:02d} Done! {} frames in {:.1f}ms (load {:.1f}ms)',
+             person_id, gesture_id, n_frames[0], 1000.0 * (t2 - t1), 1000.0 * (t1 - t0))
+
+if n_frames_done > 0:
+    log.info('{} frames localized at {:.1f} frames/s', n_frames_done,
+             n_frames_done / max(elapsed, 1e-9))
+if len(all_errors) > 0:
+    errors = np.concatenate(all_errors)
+    log.info('Against saved localizations: {} keypoints, error mean={:.4f} median={:.4f} '
+             'p95={:.4f}, same skeletons count on {:.1f}% of frames', errors.size,
+             errors.mean() if errors.size > 0 else float('nan'),
+             np.median(errors) if errors.size > 0 else float('nan'),
+             np.percentile(errors, 95) if errors.size > 0 else float('nan'),
+             100.0 * all_same_count / max(all_compared, 1))
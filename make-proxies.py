@@ -0,0 +1,168 @@
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+from multiprocessing import cpu_count
+from subprocess import Popen, PIPE, DEVNULL
+from collections import defaultdict
+from is_wire.core import Logger
+from utils import load_options
+from mosaic import grid_shape, camera_resolutions
+from proxies import PROXY_FOLDER, proxy_filename, mosaic_proxy_filename
+
+# every frame is a keyframe, so any of them is decoded without decoding the ones before it
+CODECS = {
+    'mjpeg': '-c:v mjpeg -q:v 4',
+    'h264': '-c:v libx264 -preset veryfast -crf 20 -g 1 -pix_fmt yuv420p',
+}
+# each process uses a single thread, as many of them run at the same time
+FFMPEG = 'ffmpeg -y -nostdin -v error -threads 1'
+
+
+def tmp_filename(filename):
+    return '{}.tmp{}'.format(*os.path.splitext(filename))
+
+
+def proxy_command(video_file, output_file, scale, codec):
+    # widths and heights are kept even, as the encoders require
+    resize = 'scale=trunc(iw*{}/2)*2:-2'.format(scale)
+    return FFMPEG.split() + ['-i', video_file, '-an', '-vf', resize, '-threads', '1'] + \
+        CODECS[codec].split() + [output_file]
+
+
+def mosaic_command(video_files, output_file, tile_size, columns, codec):
+    # frames fit inside their tiles keeping the aspect ratio, as Mosaic does
+    tile_w, tile_h = tile_size
+    filters = [
+        '[{n}:v]scale={w}:{h}:force_original_aspect_ratio=decrease,'
+        'pad={w}:{h}:(ow-iw)/2:(oh-ih)/2[v{n}]'.format(n=n, w=tile_w, h=tile_h)
+        for n in range(len(video_files))
+    ]
+    if len(video_files) > 1:
+        layout = '|'.join('{}_{}'.format((n % columns) * tile_w, (n // columns) * tile_h)
+                          for n in range(len(video_files)))
+        filters.append('{}xstack=inputs={}:layout={}:fill=black[out]'.format(
+            ''.join('[v{}]'.format(n) for n in range(len(video_files))), len(video_files),
+            layout))
+    else:
+        filters[0] = filters[0].replace('[v0]', '[out]')
+    inputs = []
+    for video_file in video_files:
+        inputs += ['-i', video_file]
+    return FFMPEG.split() + inputs + ['-filter_complex', ';'.join(filters), '-map', '[out]',
+                                      '-an', '-threads', '1'] + \
+        CODECS[codec].split() + [output_file]
+
+
+def run_all(jobs, workers, log):
+    """ Runs 'jobs', a list of (command, output file), 'workers' at a time. Commands write
+    to the temporary file of their output, which is only moved to its place when the command
+    succeeds. Returns the number of failed jobs. """
+    pending, running, failed = list(reversed(jobs)), [], 0
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < workers:
+            command, output_file = pending.pop()
+            running.append((Popen(command, stdout=DEVNULL, stderr=PIPE), output_file))
+        time.sleep(0.05)
+        for job in list(running):
+            process, output_file = job
+            if process.poll() is None:
+                continue
+            running.remove(job)
+            errors = process.stderr.read().decode('utf-8').strip()
+            process.stderr.close()
+            if process.returncode == 0:
+                os.replace(tmp_filename(output_file), output_file)
+                log.info("'{}' done", output_file)
+            else:
+                failed += 1
+                log.warn("'{}' failed: {}", output_file, errors)
+                if os.path.exists(tmp_filename(output_file)):
+                    os.remove(tmp_filename(output_file))
+    return failed
+
+
+def is_up_to_date(output_file, inputs):
+    if not os.path.exists(output_file):
+        return False
+    return os.path.getmtime(output_file) >= max(os.path.getmtime(f) for f in inputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Makes small proxy videos where every frame is a keyframe, for each camera '
+        'video of the dataset folder and a mosaic of the cameras of each sequence')
+    parser.add_argument(
+        '--scale', type=float, default=0.5, help='Scale of proxies relative to the videos')
+    parser.add_argument(
+        '--codec', '-c', type=str, default='mjpeg', choices=sorted(CODECS), help='Proxies codec')
+    parser.add_argument(
+        '--workers', '-w', type=int, default=cpu_count(), help='ffmpeg processes at a time')
+    parser.add_argument(
+        '--no-mosaic', action='store_true', help='If set, mosaic proxies are not made')
+    parser.add_argument(
+        '--force', '-f', action='store_true', help='If set, makes even up to date proxies')
+    args = parser.parse_args()
+
+    log = Logger(name='MakeProxies')
+    options = load_options(print_options=False)
+    if not os.path.exists(options.folder):
+        log.critical("Folder '{}' doesn't exist", options.folder)
+        sys.exit(-1)
+    if shutil.which('ffmpeg') is None:
+        log.critical("Can't find ffmpeg")
+        sys.exit(-1)
+
+    sequences = defaultdict(dict)
+    for filename in sorted(next(os.walk(options.folder))[2]):  # only first folder level
+        matches = re.search(r'^p([0-9]{3})g([0-9]{2})c([0-9]{2}).mp4$', filename)
+        if matches is None:
+            continue
+        person_id, gesture_id, camera = map(int, matches.groups())
+        sequences[(person_id, gesture_id)][camera] = os.path.join(options.folder, filename)
+
+    if not os.path.exists(os.path.join(options.folder, PROXY_FOLDER)):
+        os.makedirs(os.path.join(options.folder, PROXY_FOLDER))
+
+    jobs = []
+    for _, videos in sorted(sequences.items()):
+        for _, video_file in sorted(videos.items()):
+            output_file = proxy_filename(video_file)
+            if args.force or not is_up_to_date(output_file, [video_file]):
+                command = proxy_command(video_file, tmp_filename(output_file), args.scale,
+                                        args.codec)
+                jobs.append((command, output_file))
+    log.info('Making {} camera proxies', len(jobs))
+    failed = run_all(jobs, args.workers, log)
+
+    if not args.no_mosaic:
+        # mosaics are made from the camera proxies, which are much faster to decode
+        jobs = []
+        for (person_id, gesture_id), videos in sorted(sequences.items()):
+            cameras = sorted(videos)
+            proxies = [proxy_filename(videos[camera]) for camera in cameras]
+            if not all(map(os.path.exists, proxies)):
+                continue
+            output_file = mosaic_proxy_filename(options.folder, person_id, gesture_id)
+            if not args.force and is_up_to_date(output_file, proxies):
+                continue
+            resolutions = camera_resolutions(options, cameras).values()
+            tile_size = [
+                2 * max(1, int(max(r[n] for r in resolutions) * args.scale) // 2)
+                for n in range(2)
+            ]
+            _, columns = grid_shape(len(cameras))
+            command = mosaic_command(proxies, tmp_filename(output_file), tile_size, columns,
+                                     args.codec)
+            jobs.append((command, output_file))
+        log.info('Making {} mosaic proxies', len(jobs))
+        failed += run_all(jobs, args.workers, log)
+
+    if failed > 0:
+        log.warn('{} proxies failed', failed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,189 @@
-from is_wire.core import Channel, Message, Logger
-from is_msgs.image_pb2 import Image
-from options_pb2 import DatasetCaptureOptions
-from google.protobuf.json_format import Parse
-import cv2
+import sys
 import time
+import argparse
+import numpy as np
+import cv2
+from random import random, gauss
+from collections import defaultdict
+from is_wire.core import Message, Logger, ContentType
+from is_msgs.image_pb2 import Image
+from local_broker import make_channel
+from utils import load_options
+
+DEFAULT_RESOLUTION = (1288, 728)
+
+parser = argparse.ArgumentParser(
+    description='Publishes synthetic frames on the camera topics at a steady rate')
+parser.add_argument(
+    '--cameras',
+    '-c',
+    type=int,
+    nargs='+',
+    help='Camera ids. Defaults to the cameras on options. A single number N means ids 0..N-1')
+parser.add_argument('--fps', '-f', type=float, default=30.0, help='Frames per second per camera')
+parser.add_argument(
+    '--resolution',
+    '-r',
+    type=int,
+    nargs=2,
+    metavar=('WIDTH', 'HEIGHT'),
+    help='Frames resolution. Defaults to the resolution of the first camera on options')
+parser.add_argument('--quality', '-q', type=int, default=80, help='JPEG quality, from 0 to 100')
+parser.add_argument(
+    '--target-kb',
+    type=float,
+    help='If set, the JPEG quality is searched to get frames of about this size')
+parser.add_argument(
+    '--images', '-i', type=str, nargs='+', help='Images to encode instead of synthetic ones')
+parser.add_argument(
+    '--frames',
+    type=int,
+    default=30,
+    help='Distinct frames pre-encoded per camera and published in a loop')
+parser.add_argument(
+    '--jitter-ms',
+    type=float,
+    default=0.0,
+    help='Standard deviation of a random delay added to each publication')
+parser.add_argument(
+    '--loss', type=float, default=0.0, help='Fraction of frames randomly not published')
+parser.add_argument(
+    '--duration', '-d', type=float, default=0.0, help='Seconds to run, forever if 0')
+parser.add_argument('--report-every', type=float, default=5.0, help='Seconds between rate reports')
+args = parser.parse_args()
+
+log = Logger(name='MockCameras')
+options = load_options(print_options=False)
+
+if args.cameras is None:
+    cameras = [camera.id for camera in options.cameras]
+elif len(args.cameras) == 1:
+    cameras = list(range(args.cameras[0]))
+else:
+    cameras = args.cameras
+
+if args.resolution is not None:
+    width, height = args.resolution
+elif len(options.cameras) > 0 and options.cameras[0].config.image.resolution.width > 0:
+    resolution = options.cameras[0].config.image.resolution
+    width, height = resolution.width, resolution.height
+else:
+    width, height = DEFAULT_RESOLUTION
+
+
+def synthetic_frame(camera, n):
+    # moving gradients plus noise, so JPEG sizes are closer to the ones of real scenes
+    x = np.linspace(0, 4 * np.pi, width, dtype=np.float32)
+    y = np.linspace(0, 4 * np.pi, height, dtype=np.float32)[:, None]
+    phase = 2 * np.pi * n / max(args.frames, 1) + camera
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    for channel in range(3):
+        wave = np.sin(x + phase + channel) * np.cos(y - phase + 2 * channel)
+        frame[:, :, channel] = (127.5 + 100 * wave).astype(np.uint8)
+    noise = np.random.randint(0, 40, (height, width, 1), dtype=np.uint8)
+    frame = cv2.add(frame, np.repeat(noise, 3, axis=2))
+    cv2.putText(frame, 'camera {} frame {}'.format(camera, n), (50, 100), cv2.FONT_HERSHEY_SIMPLEX,
+                2, (255, 255, 255), 3)
+    return frame
+
 
-cameras = [0, 1, 2, 3]
-n_samples = 91
-period_ms = 100
-drift_ms = 10
-log = Logger(name='Capture')
+def encode(frame, quality):
+    return cv2.imencode('.jpeg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
 
-with open('options.json', 'r') as f:
-    try:
-        options = Parse(f.read(), DatasetCaptureOptions())
-        log.info('Options:\n{}', options)
-    except Exception as ex:
-        log.critical('Unable to read \"options.json\". \n{}', ex)
 
-image_data = {}
+def search_quality(frame, target_bytes):
+    low, high = 1, 100
+    while low < high:
+        quality = (low + high + 1) // 2
+        if len(encode(frame, quality)) <= target_bytes:
+            low = quality
+        else:
+            high = quality - 1
+    return low
+
+
+sources = []
+if args.images is not None:
+    for filename in args.images:
+        image = cv2.imread(filename, cv2.IMREAD_COLOR)
+        if image is None:
+            log.critical("Unable to read image '{}'", filename)
+            sys.exit(-1)
+        sources.append(cv2.resize(image, (width, height)))
+
+log.info('Encoding {} frames for each of the {} cameras', args.frames, len(cameras))
+quality = args.quality
+bodies = {}
 for camera in cameras:
-    image = cv2.imread('{}.jpeg'.format(camera), cv2.IMREAD_COLOR)
-    image_data[camera] = cv2.imencode('.jpeg', image)[1].tobytes()
-
-channel = Channel(options.broker_uri)
-
-while True:
-    for sample in range(n_samples):
-        t0 = time.time()
-        log.info("Sample: {}", sample)
-        for camera in cameras:
-            filename = '/home/felippe/aaaaa/cam{}_{:04d}.jpeg'.format(
-                camera + 1, sample)
-            image = cv2.imread(filename, cv2.IMREAD_COLOR)
-            data = cv2.imencode('.jpeg', image)[1].tobytes()
-            pb_image = Image(data=data)
-            msg = Message(content=pb_image)
-            topic = 'CameraGateway.{}.Frame'.format(camera)
-            channel.publish(msg, topic=topic)
-            time.sleep(drift_ms / 1000.0)
-        tf = time.time()
-        dt = period_ms / 1000.0 - (tf - t0)
-        if dt > 0:
-            time.sleep(dt)
+    bodies[camera] = []
+    for n in range(args.frames):
+        if len(sources) > 0:
+            frame = sources[(camera * args.frames + n) % len(sources)]
+        else:
+            frame = synthetic_frame(camera, n)
+        if args.target_kb is not None and len(bodies) == 1 and n == 0:
+            quality = search_quality(frame, 1000 * args.target_kb)
+        # images are serialized once, so publishing doesn't copy them into new protobufs
+        bodies[camera].append(Image(data=encode(frame, quality)).SerializeToString())
+mean_kb = np.mean([len(body) for b in bodies.values() for body in b]) / 1000.0
+log.info('{}x{} frames, JPEG quality {}, {:.1f} KB per frame, {:.1f} MB/s in total', width, height,
+         quality, mean_kb,
+         mean_kb * args.fps * len(cameras) / 1000.0)
+
+channel = make_channel(options.broker_uri)
+topics = {camera: 'CameraGateway.{}.Frame'.format(camera) for camera in cameras}
+period = 1.0 / args.fps
+
+
+def report(elapsed, published, lost, skipped, lateness):
+    rates = ' '.join('{}:{:.1f}'.format(camera, published[camera] / elapsed) for camera in cameras)
+    log.info(
+        'Target {:.1f} fps | achieved {} | lost={} skipped ticks={} | '
+        'late mean={:.1f}ms max={:.1f}ms', args.fps, rates, sum(lost.values()), skipped,
+        1000.0 * np.mean(lateness) if len(lateness) > 0 else 0.0,
+        1000.0 * max(lateness) if len(lateness) > 0 else 0.0)
+
+
+# every tick has an absolute deadline from the start, so delays never accumulate
+started_at = time.time()
+reported_at = started_at
+tick = 0
+published, lost = defaultdict(int), defaultdict(int)
+skipped, lateness = 0, []
+while args.duration <= 0 or time.time() - started_at < args.duration:
+    deadline = started_at + tick * period
+    wait = deadline - time.time()
+    if wait > 0:
+        time.sleep(wait)
+    elif -wait > period:
+        # more than a period behind, ticks are dropped instead of publishing in bursts
+        missed = int(-wait / period)
+        skipped += missed
+        tick += missed
+        continue
+
+    offsets = sorted((abs(gauss(0.0, args.jitter_ms / 1000.0)), camera) for camera in cameras)
+    for offset, camera in offsets:
+        if random() < args.loss:
+            lost[camera] += 1
+            continue
+        wait = deadline + offset - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        message = Message(
+            content=bodies[camera][tick % args.frames], content_type=ContentType.PROTOBUF)
+        channel.publish(message, topic=topics[camera])
+        lateness.append(time.time() - deadline - offset)
+        published[camera] += 1
+    tick += 1
+
+    now = time.time()
+    if now - reported_at >= args.report_every:
+        report(now - reported_at, published, lost, skipped, lateness)
+        published, lost = defaultdict(int), defaultdict(int)
+        skipped, lateness = 0, []
+        reported_at = now
+
+if len(lateness) > 0:
+    report(time.time() - reported_at, published, lost, skipped, lateness)
+channel.close()
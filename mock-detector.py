@@ -1,30 +1,35 @@
-from is_wire.core import Channel, Message, Logger
-from is_wire.rpc import ServiceProvider, LogInterceptor
-from is_msgs.image_pb2 import Image, ObjectAnnotations, ObjectAnnotation
-from utils import load_options
-import time
+import argparse
 from random import randint
+from is_msgs.image_pb2 import Image
+from utils import load_options
+from mock_service import MockService, add_arguments
+from mock_skeletons import image_size, random_skeletons
 
-mean_time = 100 # milliseconds
-var_time = 20
+parser = argparse.ArgumentParser(description='Mocks SkeletonsDetector.Detect')
+add_arguments(parser)
+parser.add_argument(
+    '--topic', '-t', type=str, default='SkeletonsDetector.Detect', help='Topic to serve')
+parser.add_argument(
+    '--ms-per-mb',
+    type=float,
+    default=0.0,
+    help='Milliseconds added to the latency for each megabyte of image received')
+parser.add_argument(
+    '--max-skeletons', type=int, default=3, help='Maximum number of skeletons on each reply')
+args = parser.parse_args()
 
-def detect(image, ctx):
-    # simulate error
-    time.sleep(randint(mean_time - var_time, mean_time + var_time) / 1000.0)
-    reply = ObjectAnnotations(
-        frame_id=randint(0, 4), objects=[ObjectAnnotation()] * randint(1, 3))
-    return reply
 
-options = load_options(print_options=False)
+def detect(image):
+    width, height = image_size(image.data)
+    return random_skeletons(width, height, randint(0, args.max_skeletons))
 
-channel = Channel(options.broker_uri)
-provider = ServiceProvider(channel)
-provider.add_interceptor(LogInterceptor())
 
-provider.delegate(
-    topic='Skeletons.Detect',
-    function=detect,
-    request_type=Image,
-    reply_type=ObjectAnnotations)
+def payload_cost(image):
+    return args.ms_per_mb * len(image.data) / 1e6
+
+
+options = load_options(print_options=False)
 
-provider.run()
\ No newline at end of file
+service = MockService.from_args(args, options.broker_uri, name='MockDetector')
+service.delegate(topic=args.topic, function=detect, request_type=Image, cost=payload_cost)
+service.run()
@@ -0,0 +1,87 @@
+import argparse
+from random import random, gauss
+from is_msgs.image_pb2 import ObjectAnnotations, ObjectLabels
+from google.protobuf.struct_pb2 import Struct
+from google.protobuf.json_format import MessageToDict, ParseDict
+from utils import load_options
+from mock_service import MockService, add_arguments
+
+REFERENCE_FRAME = 1000
+FOCAL_LENGTH = 1000.0  # pixels
+MEAN_DEPTH = 3.0  # meters
+
+parser = argparse.ArgumentParser(
+    description='Mocks SkeletonsGrouper.Localize and SkeletonsGrouper.LocalizeBatch')
+add_arguments(parser)
+parser.add_argument(
+    '--item-ms',
+    type=float,
+    default=2.0,
+    help='Milliseconds added to the latency for each position of a batched request')
+parser.add_argument(
+    '--item-error-rate',
+    type=float,
+    default=0.0,
+    help='Fraction of the positions of batched requests replied with errors')
+parser.set_defaults(mean_ms=20.0, spread=5.0)
+args = parser.parse_args()
+
+
+def localize_annotations(annotations):
+    # back-projects the skeletons of the camera which sees most of them, at random depths
+    localizations = ObjectAnnotations(frame_id=REFERENCE_FRAME)
+    if len(annotations) == 0:
+        return localizations
+    camera = max(annotations, key=lambda x: len(x.get('objects', [])))
+    resolution = camera.get('resolution', {})
+    cx, cy = resolution.get('width', 1288) / 2.0, resolution.get('height', 728) / 2.0
+    for obj in camera.get('objects', []):
+        depth = max(gauss(MEAN_DEPTH, 0.5), 0.5)
+        skeleton = localizations.objects.add(
+            id=ObjectLabels.Value('HUMAN_SKELETON'), score=obj.get('score', 0.0))
+        for keypoint in obj.get('keypoints', []):
+            position = keypoint.get('position', {})
+            point = skeleton.keypoints.add(
+                id=int(keypoint.get('id', 0)), score=keypoint.get('score', 0.0))
+            z = depth + gauss(0.0, 0.05)
+            point.position.x = (position.get('x', 0.0) - cx) * z / FOCAL_LENGTH
+            point.position.y = (position.get('y', 0.0) - cy) * z / FOCAL_LENGTH
+            point.position.z = z
+    return localizations
+
+
+def localize(request):
+    return localize_annotations(MessageToDict(request).get('list', []))
+
+
+def localize_batch(request):
+    reply_items = []
+    for item in MessageToDict(request).get('batch', []):
+        if random() < args.item_error_rate:
+            reply_items.append({'pos': item['pos'], 'error': 'Mocked item error'})
+            continue
+        localizations = localize_annotations(item.get('list', []))
+        reply_items.append({
+            'pos':
+            item['pos'],
+            'localizations':
+            MessageToDict(localizations, preserving_proto_field_name=True)
+        })
+    return ParseDict({'batch': reply_items}, Struct())
+
+
+def batch_cost(request):
+    batch = request.fields['batch'].list_value.values if 'batch' in request.fields else []
+    return args.item_ms * len(batch)
+
+
+options = load_options(print_options=False)
+
+service = MockService.from_args(args, options.broker_uri, name='MockGrouper')
+service.delegate(topic='SkeletonsGrouper.Localize', function=localize, request_type=Struct)
+service.delegate(
+    topic='SkeletonsGrouper.LocalizeBatch',
+    function=localize_batch,
+    request_type=Struct,
+    cost=batch_cost)
+service.run()
@@ -0,0 +1,231 @@
+import sys
+import math
+import bisect
+import time
+import socket
+import random
+from collections import deque
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from is_wire.core import Subscription, Status, StatusCode, Logger
+from local_broker import make_channel
+
+LATENCY_DISTRIBUTIONS = ['constant', 'uniform', 'normal', 'exponential', 'lognormal']
+CONSUME_POLL_SEC = 0.1
+LATENCY_SAMPLES = 10000
+HISTOGRAM_EDGES_MS = [5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+HISTOGRAM_WIDTH = 50
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--concurrency', '-c', type=int, default=1, help='Requests served at the same time')
+    parser.add_argument(
+        '--latency',
+        '-l',
+        type=str,
+        default='normal',
+        choices=LATENCY_DISTRIBUTIONS,
+        help='Distribution of the time taken to serve a request')
+    parser.add_argument(
+        '--mean-ms', type=float, default=100.0, help='Mean time taken to serve a request')
+    parser.add_argument(
+        '--spread',
+        type=float,
+        default=20.0,
+        help='Standard deviation (ms) for normal, half range (ms) for uniform and '
+        'sigma of the underlying normal for lognormal latencies')
+    parser.add_argument(
+        '--error-rate', type=float, default=0.0, help='Fraction of requests replied with errors')
+    parser.add_argument(
+        '--drop-rate', type=float, default=0.0, help='Fraction of requests never replied')
+    parser.add_argument(
+        '--max-pending',
+        type=int,
+        default=0,
+        help='If positive, requests arriving with this many already waiting or in service are '
+        'rejected, as an overloaded service would do')
+    parser.add_argument(
+        '--report-every', type=float, default=5.0, help='Seconds between throughput reports')
+    parser.add_argument(
+        '--histogram',
+        action='store_true',
+        help='If set, reports also print a histogram of the latencies in service')
+
+
+def sample_latency(distribution, mean, spread):
+    if distribution == 'constant':
+        value = mean
+    elif distribution == 'uniform':
+        value = random.uniform(mean - spread, mean + spread)
+    elif distribution == 'normal':
+        value = random.gauss(mean, spread)
+    elif distribution == 'exponential':
+        value = random.expovariate(1.0 / mean) if mean > 0 else 0.0
+    elif distribution == 'lognormal':
+        # keeps the mean while 'spread' stretches the tail
+        value = random.lognormvariate(math.log(max(mean, 1e-6)) - spread**2 / 2.0, spread)
+    else:
+        raise ValueError("Unknown latency distribution '{}'".format(distribution))
+    return max(value, 0.0)
+
+
+class MockService:
+    """ Serves requests from a pool of 'concurrency' workers, replying after a latency drawn
+    from a distribution plus the optional cost of each request, and failing or dropping a
+    fraction of them. With 'max_pending', requests beyond that backlog are rejected right
+    away. Throughput and latency are reported every 'report_every' seconds. """
+
+    def __init__(self,
+                 broker_uri,
+                 concurrency=1,
+                 latency='normal',
+                 mean_ms=100.0,
+                 spread=20.0,
+                 error_rate=0.0,
+                 drop_rate=0.0,
+                 max_pending=0,
+                 report_every=5.0,
+                 histogram=False,
+                 name='MockService'):
+        self._consume_channel = make_channel(broker_uri)
+        # replies are published by the workers, on a connection of their own
+        self._publish_channel = make_channel(broker_uri)
+        self._publish_lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._concurrency = concurrency
+        self._latency = latency
+        self._mean_ms = mean_ms
+        self._spread = spread
+        self._error_rate = error_rate
+        self._drop_rate = drop_rate
+        self._max_pending = max_pending
+        self._report_every = report_every
+        self._histogram = histogram
+        self._log = Logger(name=name)
+        self._services = {}
+        self._lock = Lock()
+        self._pending = 0
+        self._counters = {'received': 0, 'replied': 0, 'errors': 0, 'dropped': 0, 'rejected': 0}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    @staticmethod
+    def from_args(args, broker_uri, name='MockService'):
+        return MockService(
+            broker_uri,
+            concurrency=args.concurrency,
+            latency=args.latency,
+            mean_ms=args.mean_ms,
+            spread=args.spread,
+            error_rate=args.error_rate,
+            drop_rate=args.drop_rate,
+            max_pending=args.max_pending,
+            report_every=args.report_every,
+            histogram=args.histogram,
+            name=name)
+
+    def delegate(self, topic, function, request_type, cost=None):
+        """ 'function(request)' returns the reply, or a Status on failures. 'cost(request)'
+        may return milliseconds added to the sampled latency. """
+        subscription = Subscription(self._consume_channel, name=topic)
+        self._services[subscription.id] = (topic, function, request_type, cost)
+
+    def _serve(self, message, received_at):
+        _, function, request_type, cost = self._services[message.subscription_id]
+        reply = message.create_reply()
+        try:
+            request = message.unpack(request_type)
+            delay_ms = sample_latency(self._latency, self._mean_ms, self._spread)
+            if cost is not None:
+                delay_ms += cost(request)
+            time.sleep(delay_ms / 1000.0)
+            result = function(request)
+            if random.random() < self._error_rate:
+                result = Status(StatusCode.INTERNAL_ERROR, 'Mocked error')
+        except Exception as ex:
+            result = Status(StatusCode.INTERNAL_ERROR, str(ex))
+        if isinstance(result, Status):
+            reply.status = result
+        else:
+            reply.pack(result)
+            reply.status = Status(StatusCode.OK)
+
+        dropped = random.random() < self._drop_rate
+        if not dropped:
+            with self._publish_lock:
+                self._publish_channel.publish(reply)
+        latency = time.time() - received_at
+        with self._lock:
+            self._pending -= 1
+            self._latencies.append(latency)
+            if dropped:
+                self._counters['dropped'] += 1
+            elif reply.status.ok():
+                self._counters['replied'] += 1
+            else:
+                self._counters['errors'] += 1
+
+    def _reject(self, message):
+        reply = message.create_reply()
+        reply.status = Status(StatusCode.FAILED_PRECONDITION, 'Mocked overload')
+        with self._publish_lock:
+            self._publish_channel.publish(reply)
+
+    def _print_histogram(self, latencies):
+        counts = [0] * (len(HISTOGRAM_EDGES_MS) + 1)
+        for latency in latencies:
+            counts[bisect.bisect_left(HISTOGRAM_EDGES_MS, 1000.0 * latency)] += 1
+        labels = ['<= {}ms'.format(edge) for edge in HISTOGRAM_EDGES_MS]
+        labels.append('> {}ms'.format(HISTOGRAM_EDGES_MS[-1]))
+        for label, count in zip(labels, counts):
+            bar = '#' * int(round(HISTOGRAM_WIDTH * count / len(latencies)))
+            print('{:>10} | {:<{}} {}'.format(label, bar, HISTOGRAM_WIDTH, count))
+        sys.stdout.flush()
+
+    def _report(self, elapsed, counters):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            self._latencies.clear()
+        if len(latencies) > 0:
+            latency_info = 'p50={:.1f}ms p95={:.1f}ms max={:.1f}ms'.format(
+                1000.0 * latencies[int(0.5 * (len(latencies) - 1))],
+                1000.0 * latencies[int(0.95 * (len(latencies) - 1))], 1000.0 * latencies[-1])
+        else:
+            latency_info = 'idle'
+        self._log.info(
+            '{:.1f} req/s | received={} replied={} errors={} dropped={} rejected={} '
+            'pending={} | in service {}', counters['received'] / elapsed, counters['received'],
+            counters['replied'], counters['errors'], counters['dropped'], counters['rejected'],
+            self._pending, latency_info)
+        if self._histogram and len(latencies) > 0:
+            self._print_histogram(latencies)
+
+    def run(self):
+        self._log.info('Serving {} with {} workers, {} latency of {:.1f}ms',
+                       ', '.join(t[0] for t in self._services.values()), self._concurrency,
+                       self._latency, self._mean_ms)
+        last_report = time.time()
+        while True:
+            try:
+                message = self._consume_channel.consume(timeout=CONSUME_POLL_SEC)
+                with self._lock:
+                    self._counters['received'] += 1
+                    rejected = self._max_pending > 0 and self._pending >= self._max_pending
+                    if rejected:
+                        self._counters['rejected'] += 1
+                    else:
+                        self._pending += 1
+                if rejected:
+                    self._reject(message)
+                else:
+                    self._executor.submit(self._serve, message, time.time())
+            except socket.timeout:
+                pass
+            now = time.time()
+            if now - last_report >= self._report_every:
+                with self._lock:
+                    counters = dict(self._counters)
+                    for key in self._counters:
+                        self._counters[key] = 0
+                self._report(now - last_report, counters)
+                last_report = now
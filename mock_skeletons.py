@@ -0,0 +1,36 @@
+import struct
+from random import gauss, uniform
+from is_msgs.image_pb2 import ObjectAnnotations, ObjectLabels
+from is_msgs.image_pb2 import HumanKeypoints as HKP
+
+DEFAULT_RESOLUTION = (1288, 728)
+
+
+def image_size(data):
+    # reads width and height from JPEG/PNG headers, without decoding the image
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack('>II', data[16:24])
+    pos = 2
+    while data[:2] == b'\xff\xd8' and pos + 9 < len(data):
+        marker, length = data[pos + 1], struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return DEFAULT_RESOLUTION
+
+
+def random_skeletons(width, height, n_skeletons):
+    """ ObjectAnnotations with 'n_skeletons' skeletons placed at random on an image of
+    'width' x 'height' pixels, with every keypoint inside it. """
+    annotations = ObjectAnnotations()
+    annotations.resolution.width, annotations.resolution.height = width, height
+    for _ in range(n_skeletons):
+        cx, cy, scale = uniform(0, width), uniform(0, height), uniform(0.1, 0.4) * height
+        skeleton = annotations.objects.add(
+            id=ObjectLabels.Value('HUMAN_SKELETON'), score=uniform(0.3, 1.0))
+        for keypoint_id in range(1, len(HKP.keys())):
+            keypoint = skeleton.keypoints.add(id=keypoint_id, score=uniform(0.1, 1.0))
+            keypoint.position.x = min(max(cx + gauss(0.0, scale / 2.0), 0), width - 1)
+            keypoint.position.y = min(max(cy + gauss(0.0, scale), 0), height - 1)
+    return annotations
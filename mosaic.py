@@ -0,0 +1,91 @@
+from math import ceil, sqrt
+import cv2
+import numpy as np
+
+DEFAULT_RESOLUTION = (1288, 728)
+
+
+def grid_shape(n_tiles, columns=None):
+    # as close to square as possible, with more columns than rows, e.g. 2x2, 2x3, 2x4
+    if columns is None:
+        rows = max(1, int(sqrt(n_tiles)))
+        columns = int(ceil(n_tiles / float(rows)))
+    return int(ceil(n_tiles / float(max(columns, 1)))), max(columns, 1)
+
+
+def camera_resolutions(options, cameras=None):
+    # cameras without a resolution on options take the one of the first camera having it
+    resolutions = {
+        int(camera.id): (camera.config.image.resolution.width,
+                         camera.config.image.resolution.height)
+        for camera in options.cameras
+    }
+    known = [r for _, r in sorted(resolutions.items()) if r[0] > 0 and r[1] > 0]
+    default = known[0] if len(known) > 0 else DEFAULT_RESOLUTION
+    cameras = sorted(resolutions) if cameras is None else sorted(cameras)
+    return {
+        camera: resolutions[camera]
+        if camera in resolutions and resolutions[camera] in known else default
+        for camera in cameras
+    }
+
+
+class Mosaic:
+    """ Places the frames of any number of cameras on a grid of tiles, ordered by camera id.
+    Tiles have the size of the largest camera resolution times 'scale', and each frame is
+    resized straight into its slot of the output image, keeping its aspect ratio. """
+
+    def __init__(self, resolutions, scale=1.0, columns=None):
+        self.cameras = sorted(resolutions)
+        rows, columns = grid_shape(len(self.cameras), columns)
+        self.tile_size = (max(1, max(int(w * scale) for w, _ in resolutions.values())),
+                          max(1, max(int(h * scale) for _, h in resolutions.values())))
+        tile_w, tile_h = self.tile_size
+        self.shape = (rows * tile_h, columns * tile_w, 3)
+        self._origins = {
+            camera: ((n % columns) * tile_w, (n // columns) * tile_h)
+            for n, camera in enumerate(self.cameras)
+        }
+        self._fits = {}
+        self._last_fits = {}
+        self.image = np.zeros(self.shape, dtype=np.uint8)
+
+    def _fit(self, camera, width, height):
+        key = (camera, width, height)
+        if key not in self._fits:
+            tile_w, tile_h = self.tile_size
+            scale = min(tile_w / float(width), tile_h / float(height))
+            w = min(tile_w, max(1, int(round(width * scale))))
+            h = min(tile_h, max(1, int(round(height * scale))))
+            x, y = self._origins[camera]
+            self._fits[key] = (x + (tile_w - w) // 2, y + (tile_h - h) // 2, w, h, scale)
+        return self._fits[key]
+
+    def compose(self, frames, out=None):
+        """ Draws 'frames', a dict of camera id to frame, on 'out' or on the mosaic image.
+        Returns a dict of camera id to (tile, scale), the view of the output image where
+        the frame was placed and the scale from frame coordinates to tile coordinates. """
+        out = self.image if out is None else out
+        tiles = {}
+        for camera in self.cameras:
+            frame = frames.get(camera)
+            if frame is None:
+                continue
+            height, width = frame.shape[:2]
+            fit = self._fit(camera, width, height)
+            x, y, w, h, scale = fit
+            if self._last_fits.get(camera, fit) != fit:
+                # letterbox borders of a frame with another size may be left on the tile
+                (tx, ty), (tile_w, tile_h) = self._origins[camera], self.tile_size
+                out[ty:ty + tile_h, tx:tx + tile_w] = 0
+            self._last_fits[camera] = fit
+            slot = out[y:y + h, x:x + w]
+            if (w, h) == (width, height):
+                np.copyto(slot, frame)
+            else:
+                # area interpolation is only fast when downscaling by integer factors
+                integer = width % w == 0 and height % h == 0
+                interpolation = cv2.INTER_AREA if integer else cv2.INTER_LINEAR
+                cv2.resize(frame, (w, h), dst=slot, interpolation=interpolation)
+            tiles[camera] = (slot, scale)
+        return tiles
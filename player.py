@@ -0,0 +1,157 @@
+import time
+import queue
+from collections import deque
+from threading import Thread, Lock, Event
+import cv2
+
+
+class Player:
+    """ Plays frames given by 'render(it)' at 'fps' times 'speed', rendering them ahead on a
+    background thread. Frames are scheduled by absolute deadlines from the moment playback
+    started, and the ones already late are skipped, so playback never drifts behind.
+    'load' is called by the same thread while it returns True, to decode frames ahead, and
+    'n_frames()' tells how many frames can be rendered. """
+
+    def __init__(self, render, n_frames, fps, load=None, speed=1.0, queue_size=8):
+        self._render = render
+        self._n_frames = n_frames
+        self._fps = fps if fps > 0 else 10.0
+        self._load = load
+        self.speed = speed
+        self.playing = False
+        self.position = 0
+        self._lock = Lock()
+        self._state_lock = Lock()
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._generation = 0
+        self._shown = deque(maxlen=30)
+        self.dropped = 0
+        self._wake = Event()
+        self._closed = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def render(self, it):
+        with self._lock:
+            return self._render(it)
+
+    def _period(self):
+        return 1.0 / (self._fps * self.speed)
+
+    def play(self, it=None):
+        with self._state_lock:
+            self.position = self.position if it is None else it
+            self._generation += 1
+            self._started_at, self._start = time.time(), self.position
+            self._next = self.position
+            self.playing = True
+            self._shown.clear()
+        self._wake.set()
+
+    def pause(self):
+        with self._state_lock:
+            self._generation += 1
+            self.playing = False
+        return self.position
+
+    def toggle(self):
+        if self.playing:
+            self.pause()
+        else:
+            self.play()
+
+    def set_speed(self, speed):
+        self.speed = max(speed, 1e-3)
+        if self.playing:
+            self.play()
+
+    def _deadline(self, it):
+        return self._started_at + (it - self._start) * self._period()
+
+    def _run(self):
+        loading = self._load is not None
+        while not self._closed:
+            if loading:
+                loading = bool(self._load())
+            with self._state_lock:
+                playing, generation = self.playing, self._generation
+                if playing:
+                    # frames which would already be late are not even rendered
+                    due = self._start + int((time.time() - self._started_at) / self._period())
+                    it = max(self._next, due)
+                    n_frames = self._n_frames()
+                    if it >= n_frames and not loading:
+                        # back to the first frame, keeping the deadlines absolute
+                        self._started_at = self._deadline(n_frames)
+                        self._start, it = 0, 0
+                    deadline = self._deadline(it)
+            if not playing:
+                if not loading:
+                    self._wake.wait(0.1)
+                    self._wake.clear()
+                continue
+            if it >= n_frames:
+                if not loading:
+                    time.sleep(0.001)
+                continue
+            image = self.render(it)
+            with self._state_lock:
+                if generation != self._generation:
+                    continue
+                self._next = it + 1
+            while not self._closed and generation == self._generation:
+                try:
+                    self._frames.put((generation, it, deadline, image), timeout=0.05)
+                    break
+                except queue.Full:
+                    pass
+
+    def poll(self):
+        """ Returns (it, image) when a frame is due, or None. Late frames are dropped when
+        there are newer ones waiting. """
+        while True:
+            try:
+                generation, it, deadline, image = self._frames.queue[0]
+            except IndexError:
+                return None
+            if generation != self._generation:
+                self._frames.get_nowait()
+                continue
+            now = time.time()
+            if deadline > now:
+                return None
+            self._frames.get_nowait()
+            if now - deadline > self._period() and self._frames.qsize() > 0:
+                self.dropped += 1
+                continue
+            self.position = it
+            self._shown.append(now)
+            return it, image
+
+    def wait_ms(self):
+        # time until the next frame is due, for cv2.waitKey
+        try:
+            deadline = self._frames.queue[0][2]
+        except IndexError:
+            return 1
+        return int(min(max(1000.0 * (deadline - time.time()), 1), 50))
+
+    def achieved_fps(self):
+        if len(self._shown) < 2:
+            return 0.0
+        return (len(self._shown) - 1) / max(self._shown[-1] - self._shown[0], 1e-9)
+
+    def draw_status(self, image):
+        text = '{:.1f} fps ({:.2g}x) dropped {}'.format(self.achieved_fps(), self.speed,
+                                                        self.dropped)
+        cv2.putText(image, text, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 3,
+                    cv2.LINE_AA)
+        cv2.putText(image, text, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1,
+                    cv2.LINE_AA)
+        return image
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
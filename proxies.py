@@ -0,0 +1,42 @@
+import os
+import cv2
+
+PROXY_FOLDER = 'proxies'
+
+
+def proxy_filename(video_file):
+    # 'folder/p001g01c00.mp4' -> 'folder/proxies/p001g01c00.mkv'
+    folder, filename = os.path.split(video_file)
+    return os.path.join(folder, PROXY_FOLDER, os.path.splitext(filename)[0] + '.mkv')
+
+
+def mosaic_proxy_filename(folder, person_id, gesture_id):
+    return os.path.join(folder, PROXY_FOLDER, 'p{:03d}g{:02d}_mosaic.mkv'.format(
+        person_id, gesture_id))
+
+
+def fresh_proxy(video_file):
+    # proxy of a video, if there is one up to date
+    filename = proxy_filename(video_file)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(video_file):
+        return filename
+    return None
+
+
+def frame_width(video_file):
+    return int(cv2.VideoCapture(video_file).get(cv2.CAP_PROP_FRAME_WIDTH))
+
+
+def proxy_videos(video_files):
+    """ Replaces the videos of a dict of camera id to video file by their proxies, when
+    they are up to date. Returns the videos and, for each camera, the scale from the
+    original frames to the ones loaded, used to draw annotations over them. """
+    files, scales = {}, {}
+    for camera, video_file in video_files.items():
+        proxy = fresh_proxy(video_file)
+        width = frame_width(video_file) if proxy is not None else 0
+        if width > 0:
+            files[camera], scales[camera] = proxy, frame_width(proxy) / float(width)
+        else:
+            files[camera], scales[camera] = video_file, 1.0
+    return files, scales
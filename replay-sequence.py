@@ -0,0 +1,160 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import datetime
+import cv2
+import numpy as np
+from is_wire.core import Message, Logger, ContentType
+from is_msgs.image_pb2 import Image
+from local_broker import make_channel
+from utils import load_options
+
+parser = argparse.ArgumentParser(
+    description='Republishes the frames of a recorded sequence on the camera topics')
+parser.add_argument('sequence', type=str, help="Sequence to replay, e.g. 'p001g01'")
+parser.add_argument(
+    '--speed',
+    '-s',
+    type=float,
+    default=1.0,
+    help='Replay speed relative to the recording. If 0, frames are published as fast as possible')
+parser.add_argument(
+    '--loop', '-l', type=int, default=1, help='Times the sequence is replayed, forever if 0')
+parser.add_argument(
+    '--cameras', '-c', type=int, nargs='+', help='Cameras to replay. Defaults to all on options')
+parser.add_argument(
+    '--quality', '-q', type=int, default=90, help='JPEG quality when frames come from videos')
+parser.add_argument(
+    '--report-every', type=float, default=5.0, help='Seconds between lag reports')
+args = parser.parse_args()
+
+log = Logger(name='ReplaySequence')
+options = load_options(print_options=False)
+
+matches = re.match(r'^p(\d{3})g(\d{2})$', args.sequence)
+if matches is None:
+    log.critical("Invalid sequence '{}', expected something like 'p001g01'", args.sequence)
+    sys.exit(-1)
+cameras = args.cameras or [camera.id for camera in options.cameras]
+frequencies = {camera.id: camera.config.sampling.frequency.value for camera in options.cameras}
+
+
+def load_frames(camera):
+    # original JPEG files are published as they are, videos need to be encoded again
+    folder = os.path.join(options.folder, args.sequence)
+    if os.path.isdir(folder):
+        pattern = re.compile(r'^c{:02d}s(\d+).jpeg$'.format(camera))
+        files = sorted(f for f in os.listdir(folder) if pattern.match(f))
+        frames = []
+        for filename in files:
+            with open(os.path.join(folder, filename), 'rb') as f:
+                frames.append(f.read())
+        return frames
+    video_file = os.path.join(options.folder, '{}c{:02d}.mp4'.format(args.sequence, camera))
+    if not os.path.exists(video_file):
+        return None
+    frames = []
+    video = cv2.VideoCapture(video_file)
+    while True:
+        ok, frame = video.read()
+        if not ok:
+            break
+        frames.append(
+            cv2.imencode('.jpeg', frame, [cv2.IMWRITE_JPEG_QUALITY, args.quality])[1].tobytes())
+    return frames
+
+
+def to_seconds(timestamp):
+    # isoformat() leaves microseconds out when they are zero
+    time_format = '%Y-%m-%dT%H:%M:%S.%f' if '.' in timestamp else '%Y-%m-%dT%H:%M:%S'
+    date = datetime.datetime.strptime(timestamp, time_format)
+    return (date - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def load_timestamps():
+    filename = os.path.join(options.folder, '{}_timestamps.json'.format(args.sequence))
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        timestamps = json.load(f)
+    return {
+        int(camera): [to_seconds(timestamp) for timestamp in values]
+        for camera, values in timestamps.items()
+    }
+
+
+log.info("Loading '{}'", args.sequence)
+bodies = {}
+for camera in cameras:
+    frames = load_frames(camera)
+    if frames is None or len(frames) == 0:
+        log.critical("Can't find frames of camera {} of '{}'", camera, args.sequence)
+        sys.exit(-1)
+    bodies[camera] = [Image(data=frame).SerializeToString() for frame in frames]
+
+timestamps = load_timestamps()
+if timestamps is None:
+    log.warn('No timestamps file, frames are scheduled by the sampling frequency on options')
+schedule = []
+for camera in cameras:
+    for n in range(len(bodies[camera])):
+        if timestamps is not None and camera in timestamps and n < len(timestamps[camera]):
+            at = timestamps[camera][n]
+        else:
+            at = n / frequencies.get(camera, 10.0)
+        schedule.append((at, camera, n))
+schedule.sort()
+recording_start = schedule[0][0]
+schedule = [(at - recording_start, camera, n) for at, camera, n in schedule]
+duration = schedule[-1][0]
+log.info('{} frames of {} cameras, {:.1f}s long, {:.1f} MB', len(schedule), len(cameras),
+         duration, sum(len(b) for frames in bodies.values() for b in frames) / 1e6)
+
+channel = make_channel(options.broker_uri)
+topics = {camera: 'CameraGateway.{}.Frame'.format(camera) for camera in cameras}
+
+
+def report(lags, elapsed):
+    lags = np.array(lags)
+    if args.speed <= 0:
+        log.info('{} frames at {:.1f} fps', lags.size, lags.size / max(elapsed, 1e-9))
+        return
+    log.info('{} frames at {:.1f} fps | lag behind schedule p50={:.1f}ms p95={:.1f}ms '
+             'max={:.1f}ms', lags.size, lags.size / max(elapsed, 1e-9),
+             1000.0 * np.percentile(lags, 50), 1000.0 * np.percentile(lags, 95),
+             1000.0 * lags.max())
+
+
+replay = 0
+all_lags, all_elapsed = [], 0.0
+while args.loop <= 0 or replay < args.loop:
+    # deadlines are absolute from the replay start, so lags never accumulate into drift
+    started_at = time.time()
+    reported_at, lags = started_at, []
+    for at, camera, n in schedule:
+        deadline = started_at + (at / args.speed if args.speed > 0 else 0.0)
+        wait = deadline - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        message = Message(content=bodies[camera][n], content_type=ContentType.PROTOBUF)
+        channel.publish(message, topic=topics[camera])
+        lags.append(max(time.time() - deadline, 0.0))
+
+        now = time.time()
+        if now - reported_at >= args.report_every:
+            report(lags, now - reported_at)
+            all_lags.extend(lags)
+            reported_at, lags = now, []
+    all_lags.extend(lags)
+    elapsed = time.time() - started_at
+    all_elapsed += elapsed
+    log.info('Replay {} took {:.2f}s for {:.2f}s scheduled ({:.1f}x speed)', replay + 1, elapsed,
+             duration / args.speed if args.speed > 0 else 0.0, duration / max(elapsed, 1e-9))
+    replay += 1
+
+if len(all_lags) > 0:
+    report(all_lags, all_elapsed)
+channel.close()
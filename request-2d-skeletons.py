@@ -3,27 +3,63 @@ import sys
 import cv2
 import json
 import time
-import socket
+import argparse
 import datetime
 from collections import defaultdict
-from enum import Enum
-from is_wire.core import Channel, Subscription, Message, Logger
+from is_wire.core import Logger
 from is_msgs.image_pb2 import ObjectAnnotations
-from utils import load_options, make_pb_image, FrameVideoFetcher
+from utils import load_options, make_pb_image, fit_frame, scale_annotations, atomic_json_dump
+from utils import FrameVideoFetcher
+from requester import AsyncRequester
+from results_cache import ResultsCache
+from skeletons_store import SkeletonsWriter, store_filename
+from work_queue import WorkQueue
 from google.protobuf.json_format import MessageToDict
 
-MIN_REQUESTS = 5
-MAX_REQUESTS = 10 
+MAX_REQUESTS = 10
 DEADLINE_SEC = 15.0
 
 
-class State(Enum):
-    MAKE_REQUESTS = 1
-    RECV_REPLIES = 2
-    CHECK_END_OF_VIDEO_AND_SAVE = 3
-    CHECK_FOR_TIMEOUTED_REQUESTS = 4
-    EXIT = 5
-
+parser = argparse.ArgumentParser(
+    description='Requests 2D skeletons detections for every pending video of the dataset')
+parser.add_argument(
+    '--topics',
+    '-t',
+    nargs='+',
+    default=['SkeletonsDetector.Detect'],
+    help='Detector topics to share the requests between')
+parser.add_argument(
+    '--size',
+    '-s',
+    type=int,
+    nargs=2,
+    metavar=('WIDTH', 'HEIGHT'),
+    help='If set, frames are downscaled to fit this size before being sent')
+parser.add_argument(
+    '--quality',
+    '-q',
+    type=float,
+    default=0.9,
+    help='JPEG quality, between 0.0 and 1.0, of the frames sent')
+parser.add_argument(
+    '--lease',
+    type=float,
+    default=60.0,
+    help='Seconds without heartbeat after which a claimed video can be taken by other workers')
+parser.add_argument(
+    '--cache', '-c', type=str, help='If set, detections are cached on this file and reused')
+parser.add_argument(
+    '--cache-size', type=float, default=1024.0, help='Maximum size of the cache in MB')
+parser.add_argument(
+    '--detector-version',
+    type=str,
+    default='',
+    help='Detector identity for cache entries. Defaults to the detector topics')
+parser.add_argument(
+    '--columnar',
+    action='store_true',
+    help='If set, annotations are also saved as columnar stores next to the JSON files')
+args = parser.parse_args()
 
 log = Logger(name='Request2dSkeletons')
 options = load_options(print_options=False)
@@ -32,6 +68,7 @@ if not os.path.exists(options.folder):
     log.critical("Folder '{}' doesn't exist", options.folder)
     sys.exit(-1)
 
+started_at = time.time()
 files = next(os.walk(options.folder))[2]  # only files from first folder level
 video_files = list(filter(lambda x: x.endswith('.mp4'), files))
 
@@ -62,109 +99,89 @@ if len(pending_videos) == 0:
     log.info("Exiting...")
     sys.exit(-1)
 
-channel = Channel(options.broker_uri)
-subscription = Subscription(channel)
-
-requests = {}
 annotations_received = defaultdict(dict)
-state = State.MAKE_REQUESTS
-frame_fetcher = FrameVideoFetcher(
-    video_files=pending_videos, base_folder=options.folder)
-
-while True:
-    if state == State.MAKE_REQUESTS:
-
-        state = State.RECV_REPLIES
-        if len(requests) < MIN_REQUESTS:
-            while len(requests) <= MAX_REQUESTS:
-                base_name, frame_id, frame = frame_fetcher.next()
-                if frame is None:
-                    if len(requests) == 0:
-                        state = State.EXIT
-                    break
-                pb_image = make_pb_image(frame)
-                msg = Message(content=pb_image, reply_to=subscription)
-                msg.timeout = DEADLINE_SEC
-                channel.publish(msg, topic='SkeletonsDetector.Detect')
-                requests[msg.correlation_id] = {
-                    'content': pb_image,
-                    'base_name': base_name,
-                    'frame_id': frame_id,
-                    'requested_at': time.time()
-                }
-        continue
-
-    elif state == State.RECV_REPLIES:
-
-        try:
-            msg = channel.consume(timeout=1.0)
-            if msg.status.ok():
-                annotations = msg.unpack(ObjectAnnotations)
-                cid = msg.correlation_id
-                if cid in requests:
-                    base_name = requests[cid]['base_name']
-                    frame_id = requests[cid]['frame_id']
-                    annotations_received[base_name][frame_id] = MessageToDict(
-                        annotations,
-                        preserving_proto_field_name=True,
-                        including_default_value_fields=True)
-                    del requests[cid]
-
-            state = State.CHECK_END_OF_VIDEO_AND_SAVE
-        except socket.timeout:
-            state = State.CHECK_FOR_TIMEOUTED_REQUESTS
-        continue
-
-    elif state == State.CHECK_END_OF_VIDEO_AND_SAVE:
-
-        for base_name in list(annotations_received.keys()):
-            annotations_dict = annotations_received[base_name]
-            if len(annotations_dict) == n_annotations[base_name]:
-                output_annotations = {
-                    'annotations':
-                    [x[1] for x in sorted(annotations_dict.items())],
-                    'created_at':
-                    datetime.datetime.now().isoformat()
-                }
-                filename = os.path.join(options.folder,
-                                        '{}_2d.json'.format(base_name))
-                with open(filename, 'w') as f:
-                    json.dump(output_annotations, f, indent=2)
-                del annotations_received[base_name]
-                log.info('{} has been saved.', filename)
-
-        state = State.CHECK_FOR_TIMEOUTED_REQUESTS
-        continue
-
-    elif state == State.CHECK_FOR_TIMEOUTED_REQUESTS:
-
-        new_requests = {}
-        for cid in list(requests.keys()):
-            request = requests[cid]
-            if (request['requested_at'] + DEADLINE_SEC) > time.time():
-                continue
-            msg = Message(content=request['content'], reply_to=subscription)
-            msg.timeout = DEADLINE_SEC
-            channel.publish(msg, topic='SkeletonsDetector.Detect')
-            new_requests[msg.correlation_id] = {
-                'content': request['content'],
-                'base_name': request['base_name'],
-                'frame_id': request['frame_id'],
-                'requested_at': time.time()
-            }
-            del requests[cid]
-            log.warn("Message '{}' timeouted. Sending another request.", cid)
-
-        requests.update(new_requests)
-        state = State.MAKE_REQUESTS
-        continue
-
-    elif state == State.EXIT:
-
-        log.info("Exiting...")
-        sys.exit(-1)
-
-    else:
-
-        state = State.MAKE_REQUESTS
-        continue
+annotations_writers = defaultdict(SkeletonsWriter)
+work_queue = WorkQueue(options.folder, lease_sec=args.lease)
+log.info("Worker '{}' sharing {} pending videos", work_queue.worker_id(), len(pending_videos))
+
+
+def claimed_videos():
+    for video_file in pending_videos:
+        base_name = video_file.split('.')[0]
+        if not work_queue.claim(base_name):
+            continue
+        # another worker may have finished it since the folder was scanned
+        annotation_path = os.path.join(options.folder, '{}_2d.json'.format(base_name))
+        if os.path.exists(annotation_path) and os.path.getmtime(annotation_path) > started_at:
+            work_queue.release(base_name)
+            continue
+        yield video_file
+
+
+frame_fetcher = FrameVideoFetcher(video_files=claimed_videos(), base_folder=options.folder)
+
+
+def make_requests():
+    while True:
+        base_name, frame_id, frame = frame_fetcher.next()
+        if frame is None:
+            break
+        resolution = (frame.shape[1], frame.shape[0])
+        fx, fy = 1.0, 1.0
+        if args.size is not None:
+            frame, fx, fy = fit_frame(frame, args.size)
+        pb_image = make_pb_image(frame, compression_level=args.quality)
+        yield (base_name, frame_id, fx, fy, resolution), pb_image
+
+
+def on_reply(key, annotations):
+    base_name, frame_id, fx, fy, resolution = key
+    # keypoints are always saved on the original video resolution
+    scale_annotations(annotations, fx, fy, resolution)
+    annotations_dict = annotations_received[base_name]
+    annotations_dict[frame_id] = MessageToDict(
+        annotations,
+        preserving_proto_field_name=True,
+        including_default_value_fields=True)
+    if args.columnar:
+        annotations_writers[base_name].add(frame_id, annotations)
+    if len(annotations_dict) < n_annotations[base_name]:
+        return
+
+    output_annotations = {
+        'annotations': [x[1] for x in sorted(annotations_dict.items())],
+        'created_at': datetime.datetime.now().isoformat()
+    }
+    filename = os.path.join(options.folder, '{}_2d.json'.format(base_name))
+    atomic_json_dump(output_annotations, filename, indent=2)
+    del annotations_received[base_name]
+    if args.columnar:
+        annotations_writers.pop(base_name).save(
+            store_filename(filename), created_at=output_annotations['created_at'])
+    work_queue.release(base_name)
+    log.info('{} has been saved.', filename)
+
+
+cache = None
+if args.cache is not None:
+    cache = ResultsCache(
+        filename=args.cache,
+        identity=args.detector_version or ','.join(sorted(args.topics)),
+        reply_type=ObjectAnnotations,
+        max_bytes=int(args.cache_size * 1e6))
+
+requester = AsyncRequester(
+    broker_uri=options.broker_uri,
+    topics=args.topics,
+    reply_type=ObjectAnnotations,
+    max_requests=MAX_REQUESTS,
+    deadline=DEADLINE_SEC,
+    cache=cache,
+    name='Request2dSkeletons')
+try:
+    requester.run(make_requests(), on_reply)
+finally:
+    work_queue.close()
+    if cache is not None:
+        cache.close()
+log.info("Exiting...")
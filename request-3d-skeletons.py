@@ -4,32 +4,46 @@ import sys
 import cv2
 import json
 import time
-import socket
+import argparse
 import datetime
 import numpy as np
 from collections import defaultdict
-from enum import Enum
-from is_wire.core import Channel, Subscription, Message, Logger, ContentType
+from is_wire.core import Logger, ContentType
 from is_msgs.image_pb2 import ObjectAnnotations
-from utils import load_options, AnnotationsFetcher
-from google.protobuf.json_format import MessageToDict
+from google.protobuf.struct_pb2 import Struct
+from utils import load_options, atomic_json_dump, AnnotationsFetcher
+from requester import AsyncRequester
+from work_queue import WorkQueue
+from skeletons_store import SkeletonsWriter, store_filename
+from journal import Journal
+from google.protobuf.json_format import MessageToDict, ParseDict
 
-from pprint import pprint
-
-MIN_REQUESTS = 50
 MAX_REQUESTS = 300
 DEADLINE_SEC = 5.0
 
 
-class State(Enum):
-    MAKE_REQUESTS = 1
-    RECV_REPLIES = 2
-    CHECK_END_OF_SEQUENCE_AND_SAVE = 3
-    CHECK_FOR_TIMEOUTED_REQUESTS = 4
-    EXIT = 5
-
-
 LOCALIZATION_FILE = 'p{:03d}g{:02d}_3d.json'
+JOURNAL_FILE = 'p{:03d}g{:02d}_3d.journal'
+
+parser = argparse.ArgumentParser(
+    description='Requests 3D localizations for every pending sequence of the dataset')
+parser.add_argument(
+    '--lease',
+    type=float,
+    default=60.0,
+    help='Seconds without heartbeat after which a claimed sequence can be taken by other workers')
+parser.add_argument(
+    '--batch',
+    '-b',
+    type=int,
+    default=1,
+    help='Positions of a sequence sent on each request. Values other than 1 use '
+    'SkeletonsGrouper.LocalizeBatch, with 0 sending whole sequences')
+parser.add_argument(
+    '--columnar',
+    action='store_true',
+    help='If set, localizations are also saved as columnar stores next to the JSON files')
+args = parser.parse_args()
 
 log = Logger(name='Request3dSkeletons')
 options = load_options(print_options=False)
@@ -37,14 +51,13 @@ options = load_options(print_options=False)
 if not os.path.exists(options.folder):
     log.critical("Folder '{}' doesn't exist", options.folder)
 
+started_at = time.time()
 files = next(os.walk(options.folder))[2]  # only files from first folder level
 annotation_files = list(filter(lambda x: x.endswith('_2d.json'), files))
 
 log.debug('Parsing Annotation Files')
 entries = defaultdict(lambda: defaultdict(list))
-n_annotations = defaultdict(lambda: defaultdict(dict))
-for annotation_file, n in zip(annotation_files, range(len(annotation_files))):
-
+for annotation_file in annotation_files:
     matches = re.search("p([0-9]{3})g([0-9]{2})c([0-9]{2})_2d.json", annotation_file)
     if matches is None:
         continue
@@ -53,15 +66,18 @@ for annotation_file, n in zip(annotation_files, range(len(annotation_files))):
     camera_id = int(matches.group(3))
     entries[person_id][gesture_id].append(camera_id)
 
-    annotation_path = os.path.join(options.folder, annotation_file)
-    with open(annotation_path, 'r') as f:
-        n = len(json.load(f)['annotations'])
-        n_annotations[person_id][gesture_id][camera_id] = n
-
 log.debug('Checking if detections files already exists')
 cameras = [int(camera_cfg.id) for camera_cfg in options.cameras]
+
+
+def detections_mtime(person_id, gesture_id):
+    return max(
+        os.path.getmtime(
+            os.path.join(options.folder, 'p{:03d}g{:02d}c{:02d}_2d.json'.format(
+                person_id, gesture_id, camera))) for camera in cameras)
+
+
 pending_localizations = []
-n_localizations = defaultdict(dict)
 for person_id, gestures in entries.items():
     for gesture_id, camera_ids in gestures.items():
         if set(camera_ids) != set(cameras):
@@ -69,154 +85,193 @@ for person_id, gestures in entries.items():
                      person_id, gesture_id)
             continue
 
-        n_an = list(n_annotations[person_id][gesture_id].values())
-        if not all(map(lambda x: x == n_an[0], n_an)):
-            log.warn("PERSON_ID: {:03d} GESTURE_ID: {:02d} | Annotations size inconsistent.",
+        # sizes of the annotations files are checked before any position is requested, so
+        # localizations are up to date when saved after every detections file
+        file = os.path.join(options.folder, LOCALIZATION_FILE.format(person_id, gesture_id))
+        if os.path.exists(file) and os.path.getmtime(file) >= detections_mtime(
+                person_id, gesture_id):
+            log.info('PERSON_ID: {:03d} GESTURE_ID: {:02d} | Already have localization file.',
                      person_id, gesture_id)
+            # left behind when a worker stopped between saving localizations and removing it
+            journal_path = os.path.join(options.folder, JOURNAL_FILE.format(person_id, gesture_id))
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
             continue
 
-        file = os.path.join(options.folder, LOCALIZATION_FILE.format(person_id, gesture_id))
-        if os.path.exists(file):
-            with open(file, 'r') as f:
-                n_loc = len(json.load(f)['localizations'])
-            if n_loc == n_an[0]:
-                log.info('PERSON_ID: {:03d} GESTURE_ID: {:02d} | Already have localization file.',
-                         person_id, gesture_id)
-                continue
-
-        n_localizations[person_id][gesture_id] = n_an[0]
-        pending_localizations.append({
-            'person_id': person_id,
-            'gesture_id': gesture_id,
-            'n_localizations': n_an[0]
-        })
+        pending_localizations.append({'person_id': person_id, 'gesture_id': gesture_id})
 
 if len(pending_localizations) == 0:
     log.info("Exiting...")
     sys.exit(0)
 
-channel = Channel(options.broker_uri)
-subscription = Subscription(channel)
+# replies are appended to a journal per sequence, so an interrupted sequence is resumed
+# by only requesting the positions missing on its journal
+journals = {}
+work_queue = WorkQueue(options.folder, lease_sec=args.lease)
+log.info("Worker '{}' sharing {} pending sequences", work_queue.worker_id(),
+         len(pending_localizations))
 
-requests = {}
-localizations_received = defaultdict(lambda: defaultdict(dict))
-state = State.MAKE_REQUESTS
-annotations_fetcher = AnnotationsFetcher(
-    pending_localizations=pending_localizations, cameras=cameras, base_folder=options.folder)
-
-while True:
-    if state == State.MAKE_REQUESTS:
-
-        state = State.RECV_REPLIES
-        if len(requests) < MIN_REQUESTS:
-            while len(requests) <= MAX_REQUESTS:
-                person_id, gesture_id, pos, annotations = annotations_fetcher.next()
-                if pos is None:
-                    if len(requests) == 0:
-                        state = State.EXIT
-                    break
-
-                msg = Message(reply_to=subscription, content_type=ContentType.JSON)
-                body = json.dumps({'list': annotations}).encode('utf-8')
-                msg.body = body
-                msg.timeout = DEADLINE_SEC
-                channel.publish(msg, topic='SkeletonsGrouper.Localize')
-                requests[msg.correlation_id] = {
-                    'body': body,
-                    'person_id': person_id,
-                    'gesture_id': gesture_id,
-                    'pos': pos,
-                    'requested_at': time.time()
-                }
-        continue
 
-    elif state == State.RECV_REPLIES:
-
-        try:
-            msg = channel.consume(timeout=1.0)
-            if msg.status.ok():
-                localizations = msg.unpack(ObjectAnnotations)
-                cid = msg.correlation_id
-                if cid in requests:
-                    person_id = requests[cid]['person_id']
-                    gesture_id = requests[cid]['gesture_id']
-                    pos = requests[cid]['pos']
-                    localizations_received[person_id][gesture_id][pos] = MessageToDict(
-                        localizations,
-                        preserving_proto_field_name=True,
-                        including_default_value_fields=True)
-                    del requests[cid]
-
-            state = State.CHECK_END_OF_SEQUENCE_AND_SAVE
-        except socket.timeout:
-            state = State.CHECK_FOR_TIMEOUTED_REQUESTS
-        continue
+def claimed_localizations():
+    for pending_localization in pending_localizations:
+        person_id = pending_localization['person_id']
+        gesture_id = pending_localization['gesture_id']
+        sequence = 'p{:03d}g{:02d}'.format(person_id, gesture_id)
+        if not work_queue.claim(sequence):
+            continue
+        # another worker may have finished it since the folder was scanned
+        filepath = os.path.join(options.folder, '{}_3d.json'.format(sequence))
+        if os.path.exists(filepath) and os.path.getmtime(filepath) > started_at:
+            work_queue.release(sequence)
+            continue
 
-    elif state == State.CHECK_END_OF_SEQUENCE_AND_SAVE:
-
-        done_sequences = []
-        for person_id, gestures in localizations_received.items():
-            for gesture_id, localizations_dict in gestures.items():
-                if len(localizations_dict) < n_localizations[person_id][gesture_id]:
-                    continue
-
-                output_localizations = {
-                    'localizations': [x[1] for x in sorted(localizations_dict.items())],
-                    'created_at': datetime.datetime.now().isoformat()
-                }
-                filename = 'p{:03d}g{:02d}_3d.json'.format(person_id, gesture_id)
-                filepath = os.path.join(options.folder, filename)
-                with open(filepath, 'w') as f:
-                    json.dump(output_localizations, f, indent=2)
-
-                done_sequences.append((person_id, gesture_id))
-
-                localizations_count = [
-                    len(l['objects']) for l in output_localizations['localizations']
-                ]
-                count_dict = map(lambda x: list(map(str, x)),
-                                 np.unique(localizations_count, return_counts=True))
-                count_info = json.dumps(dict(zip(*count_dict))).replace('"', '')
-                log.info('PERSON_ID: {:03d} GESTURE_ID: {:02d} Done! {}', person_id, gesture_id,
-                         count_info)
-
-        for person_id, gesture_id in done_sequences:
-            del localizations_received[person_id][gesture_id]
-
-        state = State.CHECK_FOR_TIMEOUTED_REQUESTS
-        continue
+        journal_path = os.path.join(options.folder, JOURNAL_FILE.format(person_id, gesture_id))
+        if os.path.exists(journal_path) and \
+                os.path.getmtime(journal_path) < detections_mtime(person_id, gesture_id):
+            os.remove(journal_path)
+        journal = Journal(journal_path)
+        positions = set(entry['pos'] for entry in journal.entries())
+        if len(positions) > 0:
+            log.info('PERSON_ID: {:03d} GESTURE_ID: {:02d} | Resuming with {} localizations',
+                     person_id, gesture_id, len(positions))
+        journals[(person_id, gesture_id)] = {'journal': journal, 'positions': positions}
+        pending_localization['skip'] = frozenset(positions)
+        yield pending_localization
 
-    elif state == State.CHECK_FOR_TIMEOUTED_REQUESTS:
 
-        new_requests = {}
-        for cid in list(requests.keys()):
-            request = requests[cid]
-            if (request['requested_at'] + DEADLINE_SEC) > time.time():
+annotations_fetcher = AnnotationsFetcher(
+    pending_localizations=claimed_localizations(),
+    cameras=cameras,
+    base_folder=options.folder,
+    max_frames=2 * MAX_REQUESTS)
+
+
+def save_localizations(person_id, gesture_id):
+    journal = journals.pop((person_id, gesture_id))['journal']
+    localizations_dict = {}
+    for entry in journal.entries():
+        localizations_dict[entry['pos']] = entry['localizations']
+    n_localizations = annotations_fetcher.size(person_id, gesture_id)
+    output_localizations = {
+        'localizations': [localizations_dict[pos] for pos in range(n_localizations)],
+        'created_at': datetime.datetime.now().isoformat()
+    }
+    filename = LOCALIZATION_FILE.format(person_id, gesture_id)
+    filepath = os.path.join(options.folder, filename)
+    atomic_json_dump(output_localizations, filepath, indent=2)
+    if args.columnar:
+        writer = SkeletonsWriter(key='localizations')
+        for pos, localizations in enumerate(output_localizations['localizations']):
+            writer.add(pos, ParseDict(localizations, ObjectAnnotations()))
+        writer.save(store_filename(filepath), created_at=output_localizations['created_at'])
+    journal.remove()
+    work_queue.release('p{:03d}g{:02d}'.format(person_id, gesture_id))
+
+    localizations_count = [len(l['objects']) for l in output_localizations['localizations']]
+    count_dict = map(lambda x: list(map(str, x)),
+                     np.unique(localizations_count, return_counts=True))
+    count_info = json.dumps(dict(zip(*count_dict))).replace('"', '')
+    log.info('PERSON_ID: {:03d} GESTURE_ID: {:02d} Done! {}', person_id, gesture_id, count_info)
+
+
+def make_batch(items):
+    return b'{"batch":[' + b','.join(
+        b'{"pos":' + str(pos).encode('utf-8') + b',"list":' + annotations + b'}'
+        for pos, annotations in items) + b']}'
+
+
+def make_requests():
+    requested = set()
+    items = []
+    while True:
+        person_id, gesture_id, pos, annotations = annotations_fetcher.next()
+        if person_id is None:
+            break
+        if pos is not None:
+            requested.add((person_id, gesture_id))
+            if args.batch == 1:
+                yield (person_id, gesture_id, pos), b'{"list":' + annotations + b'}'
                 continue
-            msg = Message(reply_to=subscription, content_type=ContentType.JSON)
-            msg.body = request['body']
-            msg.timeout = DEADLINE_SEC
-            channel.publish(msg, topic='SkeletonsGrouper.Localize')
-            new_requests[msg.correlation_id] = {
-                'body': request['body'],
-                'person_id': request['gesture_id'],
-                'gesture_id': request['gesture_id'],
-                'pos': request['pos'],
-                'requested_at': time.time()
-            }
-            del requests[cid]
-            log.warn("Message '{}' timeouted. Sending another request.", cid)
-
-        requests.update(new_requests)
-        state = State.MAKE_REQUESTS
-        continue
-
-    elif state == State.EXIT:
-
-        log.info("Exiting...")
-        sys.exit(-1)
-
-    else:
-
-        state = State.MAKE_REQUESTS
-        continue
+            items.append((pos, annotations))
+            if len(items) == args.batch:
+                yield (person_id, gesture_id, tuple(items)), make_batch(items)
+                items = []
+        elif len(items) > 0:
+            yield (person_id, gesture_id, tuple(items)), make_batch(items)
+            items = []
+        elif (person_id, gesture_id) not in requested:
+            # nothing to request, so on_reply finishes it on the event loop like the others
+            yield (person_id, gesture_id, None), None
+
+
+def finish_unrequested(person_id, gesture_id):
+    if annotations_fetcher.size(person_id, gesture_id) is None:
+        log.warn("PERSON_ID: {:03d} GESTURE_ID: {:02d} | Annotations size inconsistent.",
+                 person_id, gesture_id)
+        # none of its positions was requested, so its journal has nothing to keep
+        journals.pop((person_id, gesture_id))['journal'].remove()
+        work_queue.release('p{:03d}g{:02d}'.format(person_id, gesture_id))
+        return
+    # every position was already on the journal, only compacting it is missing
+    save_localizations(person_id, gesture_id)
+
+
+def add_localizations(person_id, gesture_id, pos, localizations):
+    sequence = journals[(person_id, gesture_id)]
+    sequence['journal'].append({
+        'pos':
+        pos,
+        'localizations':
+        MessageToDict(
+            localizations, preserving_proto_field_name=True, including_default_value_fields=True)
+    })
+    sequence['positions'].add(pos)
+    n_localizations = annotations_fetcher.size(person_id, gesture_id)
+    if n_localizations is None or len(sequence['positions']) < n_localizations:
+        return
+    save_localizations(person_id, gesture_id)
+
+
+def on_reply(key, reply):
+    person_id, gesture_id, pos = key
+    if reply is None:
+        finish_unrequested(person_id, gesture_id)
+        return
+    if args.batch == 1:
+        add_localizations(person_id, gesture_id, pos, reply)
+        return
+
+    # items of a batch fail independently, so only the failed ones are requested again
+    replied = {}
+    for item in MessageToDict(reply).get('batch', []):
+        replied[int(item['pos'])] = item
+    failed = []
+    for pos, annotations in key[2]:
+        item = replied.get(pos, {})
+        if 'localizations' not in item:
+            failed.append((pos, annotations))
+            continue
+        add_localizations(person_id, gesture_id, pos,
+                          ParseDict(item['localizations'], ObjectAnnotations()))
+    if len(failed) > 0:
+        log.warn('PERSON_ID: {:03d} GESTURE_ID: {:02d} | {} of {} positions failed ({}). '
+                 'Sending another request.', person_id, gesture_id, len(failed), len(key[2]),
+                 replied.get(failed[0][0], {}).get('error', 'missing on reply'))
+        requester.retry((person_id, gesture_id, tuple(failed)), make_batch(failed))
+
+
+requester = AsyncRequester(
+    broker_uri=options.broker_uri,
+    topics='SkeletonsGrouper.Localize' if args.batch == 1 else 'SkeletonsGrouper.LocalizeBatch',
+    reply_type=ObjectAnnotations if args.batch == 1 else Struct,
+    content_type=ContentType.JSON,
+    max_requests=MAX_REQUESTS,
+    deadline=DEADLINE_SEC,
+    name='Request3dSkeletons')
+try:
+    requester.run(make_requests(), on_reply)
+finally:
+    for sequence in list(journals.values()):
+        sequence['journal'].close()
+    work_queue.close()
+log.info("Exiting...")
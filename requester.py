@@ -0,0 +1,286 @@
+import time
+import socket
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event
+from is_wire.core import Subscription, Message, Logger
+from local_broker import make_channel
+
+CONSUME_POLL_SEC = 0.1
+RTT_SMOOTHING = 0.2
+RTT_SAMPLES = 1000
+PENALTY_HALF_LIFE_SEC = 5.0
+
+
+class EndpointsRouter:
+    def __init__(self, topics, deadline):
+        self._deadline = deadline
+        self._endpoints = OrderedDict()
+        for topic in topics:
+            self._endpoints[topic] = {
+                'outstanding': 0,
+                'rtt': None,
+                'penalty': 0.0,
+                'penalized_at': 0.0,
+                'sent': 0,
+                'replies': 0,
+                'errors': 0,
+                'timeouts': 0,
+                'rtts': deque(maxlen=RTT_SAMPLES)
+            }
+
+    def _penalty(self, endpoint, now):
+        half_lives = (now - endpoint['penalized_at']) / PENALTY_HALF_LIFE_SEC
+        return endpoint['penalty'] * 0.5**half_lives
+
+    def choose(self):
+        # endpoints without replies yet are scored with the best known latency so they get tried
+        known = [e['rtt'] for e in self._endpoints.values() if e['rtt'] is not None]
+        default_rtt = min(known) if len(known) > 0 else 0.0
+        now = time.time()
+
+        def cost(item):
+            endpoint = item[1]
+            rtt = default_rtt if endpoint['rtt'] is None else endpoint['rtt']
+            rtt += self._penalty(endpoint, now)
+            return ((endpoint['outstanding'] + 1) * rtt, endpoint['outstanding'])
+
+        return min(self._endpoints.items(), key=cost)[0]
+
+    def _update_rtt(self, endpoint, rtt):
+        if endpoint['rtt'] is None:
+            endpoint['rtt'] = rtt
+        else:
+            endpoint['rtt'] += RTT_SMOOTHING * (rtt - endpoint['rtt'])
+
+    def sent(self, topic):
+        endpoint = self._endpoints[topic]
+        endpoint['outstanding'] += 1
+        endpoint['sent'] += 1
+
+    def replied(self, topic, rtt):
+        endpoint = self._endpoints[topic]
+        endpoint['outstanding'] -= 1
+        endpoint['replies'] += 1
+        endpoint['rtts'].append(rtt)
+        self._update_rtt(endpoint, rtt)
+
+    def _penalize(self, endpoint):
+        # failures add a full deadline to the latency, pushing traffic to healthier endpoints.
+        # It halves every PENALTY_HALF_LIFE_SEC, so an endpoint gets traffic again once the
+        # others are busy enough, and stays out while its new requests keep failing.
+        now = time.time()
+        endpoint['penalty'] = self._penalty(endpoint, now) + self._deadline
+        endpoint['penalized_at'] = now
+
+    def failed(self, topic):
+        endpoint = self._endpoints[topic]
+        endpoint['outstanding'] -= 1
+        endpoint['errors'] += 1
+        self._penalize(endpoint)
+
+    def timeouted(self, topic):
+        endpoint = self._endpoints[topic]
+        endpoint['outstanding'] -= 1
+        endpoint['timeouts'] += 1
+        self._penalize(endpoint)
+
+    def report(self, log):
+        for topic, endpoint in self._endpoints.items():
+            sent = max(endpoint['sent'], 1)
+            rtts = sorted(endpoint['rtts'])
+            if len(rtts) > 0:
+                rtt_info = 'mean={:.1f}ms p50={:.1f}ms p95={:.1f}ms'.format(
+                    1000.0 * sum(rtts) / len(rtts), 1000.0 * rtts[int(0.5 * (len(rtts) - 1))],
+                    1000.0 * rtts[int(0.95 * (len(rtts) - 1))])
+            else:
+                rtt_info = 'no replies'
+            log.info('{} | sent={} replies={} errors={} ({:.1f}%) timeouts={} ({:.1f}%) | RTT {}',
+                     topic, endpoint['sent'], endpoint['replies'], endpoint['errors'],
+                     100.0 * endpoint['errors'] / sent, endpoint['timeouts'],
+                     100.0 * endpoint['timeouts'] / sent, rtt_info)
+
+
+class AsyncRequester:
+    def __init__(self,
+                 broker_uri,
+                 topics,
+                 reply_type,
+                 content_type=None,
+                 max_requests=10,
+                 deadline=15.0,
+                 cache=None,
+                 name='AsyncRequester'):
+        self._broker_uri = broker_uri
+        self._router = EndpointsRouter(
+            [topics] if isinstance(topics, str) else topics, deadline=deadline)
+        self._reply_type = reply_type
+        self._content_type = content_type
+        self._max_requests = max_requests
+        self._deadline = deadline
+        self._cache = cache
+        self._log = Logger(name=name)
+        self._requests = OrderedDict()
+        self._stop = Event()
+
+    def run(self, requests, on_reply):
+        """ Publishes every (key, content) pair yielded by 'requests' keeping at most
+        'max_requests' of them in flight, re-sending the ones that time out or fail.
+        Each request goes to the topic with the lowest latency-weighted outstanding count,
+        unless a cache is given and already has its reply.
+        'on_reply(key, reply)' is called once per key with the unpacked reply, or with None
+        for a None content, which is not published, to finish on the event loop work that
+        doesn't need a request. """
+        # replies are consumed on a dedicated connection owned by a thread, so
+        # publishing never waits for the broker to deliver anything.
+        self._publish_channel = make_channel(self._broker_uri)
+        self._consume_channel = make_channel(self._broker_uri)
+        self._subscription = Subscription(self._consume_channel)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._run(loop, requests, on_reply))
+        finally:
+            loop.close()
+            self._publish_channel.close()
+            self._consume_channel.close()
+        self._router.report(self._log)
+        if self._cache is not None:
+            self._cache.report(self._log)
+
+    async def _run(self, loop, requests, on_reply):
+        self._window = asyncio.Semaphore(self._max_requests)
+        self._has_requests = asyncio.Event()
+        self._done = asyncio.Event()
+        self._exhausted = False
+        replies = asyncio.Queue()
+
+        self._stop.clear()
+        consumer_thread = Thread(target=self._consume, args=(loop, replies))
+        consumer_thread.daemon = True
+        consumer_thread.start()
+
+        source_executor = ThreadPoolExecutor(max_workers=1)
+        done = loop.create_task(self._done.wait())
+        tasks = [
+            loop.create_task(self._produce(loop, source_executor, requests, on_reply)),
+            loop.create_task(self._receive(replies, on_reply)),
+            loop.create_task(self._expire()),
+        ]
+        try:
+            pending = set(tasks + [done])
+            while not done.done():
+                finished, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    if task is not done and task.exception() is not None:
+                        raise task.exception()
+        finally:
+            for task in tasks + [done]:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._stop.set()
+            consumer_thread.join()
+            source_executor.shutdown(wait=False)
+
+    def _consume(self, loop, replies):
+        while not self._stop.is_set():
+            try:
+                msg = self._consume_channel.consume(timeout=CONSUME_POLL_SEC)
+            except socket.timeout:
+                continue
+            loop.call_soon_threadsafe(replies.put_nowait, msg)
+
+    def _publish(self, key, content):
+        msg = Message(
+            content=content, reply_to=self._subscription, content_type=self._content_type)
+        msg.timeout = self._deadline
+        topic = self._router.choose()
+        self._publish_channel.publish(msg, topic=topic)
+        self._router.sent(topic)
+        self._requests[msg.correlation_id] = {
+            'key': key,
+            'content': content,
+            'topic': topic,
+            'requested_at': time.time()
+        }
+        self._has_requests.set()
+
+    def retry(self, key, content):
+        """ Publishes a request again from 'on_reply', e.g. with the items that failed on a
+        partially successful reply. It takes the place of the request being replied. """
+        self._publish(key, content)
+        self._retried = True
+
+    def _deliver(self, on_reply, key, reply):
+        self._retried = False
+        on_reply(key, reply)
+        if not self._retried:
+            self._window.release()
+
+    def _check_done(self):
+        if self._exhausted and len(self._requests) == 0:
+            self._done.set()
+
+    def _next_request(self, requests):
+        request = next(requests, None)
+        if request is None:
+            return None
+        key, content = request
+        reply = None if self._cache is None or content is None else self._cache.get(content)
+        return key, content, reply
+
+    async def _produce(self, loop, source_executor, requests, on_reply):
+        # the source may decode videos or read files, so it runs off the event loop
+        requests = iter(requests)
+        while True:
+            await self._window.acquire()
+            request = await loop.run_in_executor(source_executor, self._next_request, requests)
+            if request is None:
+                break
+            key, content, reply = request
+            if content is None or reply is not None:
+                self._deliver(on_reply, key, reply)
+                continue
+            self._publish(key, content)
+        self._exhausted = True
+        self._check_done()
+
+    async def _receive(self, replies, on_reply):
+        while True:
+            msg = await replies.get()
+            request = self._requests.pop(msg.correlation_id, None)
+            if request is None:
+                continue
+            if not msg.status.ok():
+                self._router.failed(request['topic'])
+                self._log.warn("Message '{}' failed: {}. Sending another request.",
+                               msg.correlation_id, msg.status.why)
+                self._publish(request['key'], request['content'])
+                continue
+            self._router.replied(request['topic'], time.time() - request['requested_at'])
+            reply = msg.unpack(self._reply_type)
+            if self._cache is not None:
+                self._cache.put(request['content'], reply)
+            self._deliver(on_reply, request['key'], reply)
+            self._check_done()
+
+    async def _expire(self):
+        while True:
+            if len(self._requests) == 0:
+                self._has_requests.clear()
+                await self._has_requests.wait()
+                continue
+            # requests are kept in publishing order, so only the oldest one can expire
+            cid, request = next(iter(self._requests.items()))
+            wait = request['requested_at'] + self._deadline - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            del self._requests[cid]
+            self._router.timeouted(request['topic'])
+            self._log.warn("Message '{}' timeouted on '{}'. Sending another request.", cid,
+                           request['topic'])
+            self._publish(request['key'], request['content'])
@@ -0,0 +1,93 @@
+import os
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+
+COMMIT_EVERY = 100
+EVICT_TO_RATIO = 0.9
+
+
+class ResultsCache:
+    """ Replies of a service stored by a hash of the request content plus the service
+    identity (name/version). Least recently used entries are evicted once the stored
+    replies exceed 'max_bytes'. """
+
+    def __init__(self, filename, identity, reply_type, max_bytes=1 << 30):
+        folder = os.path.dirname(os.path.abspath(filename))
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self._identity = identity.encode('utf-8')
+        self._reply_type = reply_type
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self._db = sqlite3.connect(filename, timeout=30.0, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                         '(key BLOB PRIMARY KEY, value BLOB, size INTEGER, used_at REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)')
+        self._db.commit()
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        self._uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, content):
+        data = content if isinstance(content, bytes) else content.SerializeToString()
+        return hashlib.sha256(self._identity + b'\0' + data).digest()
+
+    def _maybe_commit(self):
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def get(self, content):
+        key = self._key(content)
+        with self._lock:
+            row = self._db.execute('SELECT value FROM results WHERE key=?', (key, )).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE results SET used_at=? WHERE key=?', (time.time(), key))
+            self._maybe_commit()
+        reply = self._reply_type()
+        reply.ParseFromString(row[0])
+        return reply
+
+    def put(self, content, reply):
+        key = self._key(content)
+        value = reply.SerializeToString()
+        with self._lock:
+            row = self._db.execute('SELECT size FROM results WHERE key=?', (key, )).fetchone()
+            if row is not None:
+                self._size -= row[0]
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                             (key, value, len(value), time.time()))
+            self._size += len(value)
+            if self._size > self._max_bytes:
+                self._evict()
+            self._maybe_commit()
+
+    def _evict(self):
+        rows = self._db.execute('SELECT key, size FROM results ORDER BY used_at')
+        evicted = []
+        for key, size in rows:
+            if self._size <= EVICT_TO_RATIO * self._max_bytes:
+                break
+            evicted.append((key, ))
+            self._size -= size
+        self._db.executemany('DELETE FROM results WHERE key=?', evicted)
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def report(self, log):
+        lookups = max(self.hits + self.misses, 1)
+        log.info('Cache | hits={} ({:.1f}%) misses={} ({:.1f}%) | {:.1f} MB stored', self.hits,
+                 100.0 * self.hits / lookups, self.misses, 100.0 * self.misses / lookups,
+                 self._size / 1e6)
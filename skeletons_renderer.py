@@ -0,0 +1,254 @@
+import cv2
+import numpy as np
+from itertools import permutations
+from is_msgs.image_pb2 import HumanKeypoints as HKP
+from skeletons_store import load_arrays
+
+SHIFT = 4
+COLORS = list(permutations([0, 255, 85, 170], 3))
+LINKS = [(HKP.Value('HEAD'), HKP.Value('NECK')), (HKP.Value('NECK'), HKP.Value('CHEST')),
+         (HKP.Value('CHEST'), HKP.Value('RIGHT_HIP')), (HKP.Value('CHEST'), HKP.Value('LEFT_HIP')),
+         (HKP.Value('NECK'), HKP.Value('LEFT_SHOULDER')),
+         (HKP.Value('LEFT_SHOULDER'), HKP.Value('LEFT_ELBOW')),
+         (HKP.Value('LEFT_ELBOW'), HKP.Value('LEFT_WRIST')),
+         (HKP.Value('NECK'), HKP.Value('LEFT_HIP')), (HKP.Value('LEFT_HIP'),
+                                                      HKP.Value('LEFT_KNEE')),
+         (HKP.Value('LEFT_KNEE'), HKP.Value('LEFT_ANKLE')),
+         (HKP.Value('NECK'), HKP.Value('RIGHT_SHOULDER')),
+         (HKP.Value('RIGHT_SHOULDER'), HKP.Value('RIGHT_ELBOW')),
+         (HKP.Value('RIGHT_ELBOW'), HKP.Value('RIGHT_WRIST')),
+         (HKP.Value('NECK'), HKP.Value('RIGHT_HIP')),
+         (HKP.Value('RIGHT_HIP'), HKP.Value('RIGHT_KNEE')),
+         (HKP.Value('RIGHT_KNEE'), HKP.Value('RIGHT_ANKLE')),
+         (HKP.Value('NOSE'), HKP.Value('LEFT_EYE')), (HKP.Value('LEFT_EYE'),
+                                                      HKP.Value('LEFT_EAR')),
+         (HKP.Value('NOSE'), HKP.Value('RIGHT_EYE')),
+         (HKP.Value('RIGHT_EYE'), HKP.Value('RIGHT_EAR'))]
+
+
+class SkeletonsRenderer:
+    """ Draws the 2D skeletons of a sequence from keypoint arrays converted once, when the
+    renderer is created. Each link is drawn for every skeleton of a frame with a single
+    cv2.polylines call, so the drawing cost doesn't grow with calls per person. """
+
+    def __init__(self, json_filename, links=LINKS, colors=COLORS, thickness=4, radius=4):
+        arrays = load_arrays(json_filename)
+        self._n_objects = arrays['n_objects']
+        self._keypoints = arrays['keypoints'][..., :2]
+        self._valid = arrays['valid']
+        n_keypoints = self._keypoints.shape[2] if self._keypoints.ndim == 4 else 0
+        links = [(begin, end) for begin, end in links if begin < n_keypoints and end < n_keypoints]
+        self._begins = np.array([begin for begin, _ in links], dtype=np.int64)
+        self._ends = np.array([end for _, end in links], dtype=np.int64)
+        self._colors = [tuple(map(int, color)) for color in colors[:len(links)]]
+        self._thickness = thickness
+        self._radius = radius
+
+    def __len__(self):
+        return self._n_objects.shape[0]
+
+    def draw(self, image, it, scale=1.0):
+        """ Draws the skeletons of frame 'it' on 'image', which can be the frame itself or
+        a view of it resized by 'scale'. """
+        if it >= len(self):
+            return image
+        n = int(self._n_objects[it])
+        if n == 0:
+            return image
+        # fixed point coordinates keep the sub-pixel precision of downscaled views
+        points = np.round(self._keypoints[it, :n] * (scale * (1 << SHIFT))).astype(np.int32)
+        valid = self._valid[it, :n]
+        thickness = max(1, int(round(self._thickness * scale)))
+        linked = valid[:, self._begins] & valid[:, self._ends]
+        segments = np.stack([points[:, self._begins], points[:, self._ends]], axis=2)
+        for link, color in enumerate(self._colors):
+            lines = segments[linked[:, link], link]
+            if lines.shape[0] > 0:
+                cv2.polylines(image, lines, False, color, thickness, cv2.LINE_8, SHIFT)
+        # zero length lines are drawn as filled circles with the line thickness as diameter
+        joints = points[valid][:, None, :].repeat(2, axis=1)
+        if joints.shape[0] > 0:
+            diameter = max(1, int(round(2 * self._radius * scale)))
+            cv2.polylines(image, joints, False, (255, 255, 255), diameter, cv2.LINE_8, SHIFT)
+        return image
+
+
+def load_renderers(json_files, **kwargs):
+    return {
+        cam_id: SkeletonsRenderer(filename, **kwargs)
+        for cam_id, filename in json_files.items()
+    }
+
+
+def render_skeletons(tiles, renderers, it, frame_scales=None):
+    # 'tiles' as returned by Mosaic.compose, a dict of camera id to (image, scale), and
+    # 'frame_scales' the scale of the frames relative to the annotations, e.g. of proxies
+    for cam_id, (image, scale) in tiles.items():
+        if frame_scales is not None:
+            scale *= frame_scales[cam_id]
+        renderers[cam_id].draw(image, it, scale)
+
+
+class SkeletonsView3D:
+    """ Draws the 3D skeletons of a sequence seen by a fixed virtual camera, looking at the
+    center of the axes box from the 'azim' and 'elev' angles in degrees. The box panes,
+    grid and ticks are drawn once into a background, and the keypoints of every frame are
+    projected when the view is created, so drawing a frame is a copy plus the links. """
+
+    BOX_ASPECT = (4.0, 4.0, 3.0)
+    DISTANCE = 10.0
+    PANE_COLOR = (240, 240, 240)
+    GRID_COLOR = (205, 205, 205)
+    TEXT_COLOR = (60, 60, 60)
+
+    def __init__(self,
+                 json_filename,
+                 size=(500, 500),
+                 azim=28,
+                 elev=32,
+                 limits=((-1.5, 1.5), (-1.5, 1.5), (-0.25, 1.5)),
+                 ticks=None,
+                 links=LINKS,
+                 colors=COLORS,
+                 thickness=3):
+        arrays = load_arrays(json_filename)
+        self._n_objects = arrays['n_objects']
+        self._keypoints = arrays['keypoints']
+        self._valid = arrays['valid']
+        n_keypoints = self._keypoints.shape[2] if self._keypoints.ndim == 4 else 0
+        links = [(begin, end) for begin, end in links if begin < n_keypoints and end < n_keypoints]
+        self._begins = np.array([begin for begin, _ in links], dtype=np.int64)
+        self._ends = np.array([end for _, end in links], dtype=np.int64)
+        self._colors = [tuple(map(int, color)) for color in colors[:len(links)]]
+        self._thickness = thickness
+        self._size = tuple(size)
+        self._limits = np.array(limits, dtype=np.float64)
+        if ticks is None:
+            ticks = [
+                np.arange(np.ceil(low / 0.5) * 0.5 + 0.0, high + 1e-6, 0.5) for low, high in limits
+            ]
+        self._ticks = ticks
+        self._image = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        self.set_view(azim, elev)
+
+    def __len__(self):
+        return self._n_objects.shape[0]
+
+    def set_view(self, azim, elev):
+        a, e = np.radians(azim), np.radians(elev)
+        self._eye = np.array([np.cos(e) * np.cos(a), np.cos(e) * np.sin(a), np.sin(e)])
+        self._right = np.array([-np.sin(a), np.cos(a), 0.0])
+        self._up = np.cross(self._eye, self._right)
+        self._fit()
+        self._background = self._draw_background()
+        # fixed point projections of every keypoint of the sequence
+        if self._keypoints.size > 0:
+            projected = self._project(self._keypoints[..., :3])
+            self._points = np.round(projected * (1 << SHIFT)).astype(np.int32)
+        else:
+            self._points = np.zeros(self._keypoints.shape[:-1] + (2, ), dtype=np.int32)
+
+    def _normalize(self, points):
+        low, high = self._limits[:, 0], self._limits[:, 1]
+        aspect = np.array(self.BOX_ASPECT) / max(self.BOX_ASPECT)
+        return ((np.asarray(points, dtype=np.float64) - low) / (high - low) - 0.5) * aspect
+
+    def _camera(self, points):
+        normalized = self._normalize(points)
+        depth = normalized.dot(self._eye)
+        perspective = self.DISTANCE / (self.DISTANCE - depth)
+        u = normalized.dot(self._right) * perspective
+        v = -normalized.dot(self._up) * perspective
+        return np.stack([u, v], axis=-1)
+
+    def _fit(self):
+        # box corners fill the view, leaving a margin for ticks and axes labels
+        self._scale, self._offset = 1.0, np.zeros(2)
+        corners = self._camera(self._corners())
+        low, high = corners.min(axis=0), corners.max(axis=0)
+        margin = 0.15 * np.array(self._size)
+        self._scale = ((np.array(self._size) - 2 * margin) / (high - low)).min()
+        self._offset = np.array(self._size) / 2.0 - self._scale * (low + high) / 2.0
+
+    def _project(self, points):
+        return self._camera(points) * self._scale + self._offset
+
+    def _corners(self):
+        return np.array([[x, y, z] for x in self._limits[0] for y in self._limits[1]
+                         for z in self._limits[2]])
+
+    def _line(self, image, begin, end, color, thickness=1):
+        points = np.round(self._project(np.array([begin, end])) * (1 << SHIFT)).astype(np.int32)
+        cv2.polylines(image, [points], False, color, thickness, cv2.LINE_AA, SHIFT)
+
+    def _text(self, image, text, position, direction, distance, scale=0.4):
+        (w, h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)
+        x, y = self._project(position) + direction * distance
+        cv2.putText(image, text, (int(x - w / 2), int(y + h / 2)), cv2.FONT_HERSHEY_SIMPLEX, scale,
+                    self.TEXT_COLOR, 1, cv2.LINE_AA)
+
+    def _draw_background(self):
+        image = np.full_like(self._image, 255)
+        limits = self._limits
+        # panes far from the camera, where grid lines are drawn
+        back = [limits[axis, 0] if self._eye[axis] >= 0 else limits[axis, 1] for axis in range(3)]
+        front = [limits[axis, 1] if self._eye[axis] >= 0 else limits[axis, 0] for axis in range(3)]
+        for axis in range(3):
+            others = [other for other in range(3) if other != axis]
+            corners = []
+            for i, j in [(0, 0), (0, 1), (1, 1), (1, 0)]:
+                corner = [0.0, 0.0, 0.0]
+                corner[axis] = back[axis]
+                corner[others[0]], corner[others[1]] = limits[others[0], i], limits[others[1], j]
+                corners.append(corner)
+            polygon = np.round(self._project(np.array(corners)) * (1 << SHIFT)).astype(np.int32)
+            cv2.fillPoly(image, [polygon], self.PANE_COLOR, cv2.LINE_AA, SHIFT)
+            for n, other in enumerate(others):
+                third = others[1 - n]
+                for tick in self._ticks[other]:
+                    begin, end = [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]
+                    begin[axis] = end[axis] = back[axis]
+                    begin[other] = end[other] = tick
+                    begin[third], end[third] = limits[third]
+                    self._line(image, begin, end, self.GRID_COLOR)
+            cv2.polylines(image, [polygon], True, self.GRID_COLOR, 1, cv2.LINE_AA, SHIFT)
+
+        # ticks of x and y on the floor edges next to the camera, z on the left vertical edge
+        center = self._project(limits.mean(axis=1))
+        floor = back[2]
+        edges = []
+        for axis, other in [(0, 1), (1, 0)]:
+            begin, end = [0.0, 0.0, floor], [0.0, 0.0, floor]
+            begin[other] = end[other] = front[other]
+            begin[axis], end[axis] = limits[axis]
+            edges.append((axis, begin, end))
+        verticals = [[back[0], front[1], 0.0], [front[0], back[1], 0.0]]
+        x, y, _ = min(verticals, key=lambda corner: self._project(corner)[0])
+        edges.append((2, [x, y, limits[2, 0]], [x, y, limits[2, 1]]))
+        for axis, begin, end in edges:
+            middle = (np.array(begin) + np.array(end)) / 2.0
+            direction = self._project(middle) - center
+            direction /= max(np.linalg.norm(direction), 1e-9)
+            for tick in self._ticks[axis]:
+                position = list(middle)
+                position[axis] = tick
+                self._text(image, '{:.1f}'.format(tick), position, direction, 14)
+            self._text(image, 'XYZ' [axis], middle, direction, 36, scale=0.5)
+        return image
+
+    def draw(self, it, out=None):
+        """ Draws frame 'it' into 'out', or into a buffer reused by the next calls. """
+        image = self._image if out is None else out
+        np.copyto(image, self._background)
+        if it >= len(self):
+            return image
+        n = int(self._n_objects[it])
+        points = self._points[it, :n]
+        valid = self._valid[it, :n]
+        linked = valid[:, self._begins] & valid[:, self._ends]
+        segments = np.stack([points[:, self._begins], points[:, self._ends]], axis=2)
+        for link, color in enumerate(self._colors):
+            lines = segments[linked[:, link], link]
+            if lines.shape[0] > 0:
+                cv2.polylines(image, lines, False, color, self._thickness, cv2.LINE_AA, SHIFT)
+        return image
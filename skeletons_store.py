@@ -0,0 +1,238 @@
+import os
+import json
+import struct
+import socket
+import numpy as np
+from is_msgs.image_pb2 import ObjectAnnotations
+from is_msgs.image_pb2 import HumanKeypoints as HKP
+from google.protobuf.json_format import ParseDict, MessageToDict
+
+MAGIC = b'SKLSTORE'
+VERSION = 1
+ALIGNMENT = 64
+N_KEYPOINTS = len(HKP.keys())
+
+
+def store_filename(json_filename):
+    # 'p001g01c00_2d.json' -> 'p001g01c00_2d.skl'
+    return os.path.splitext(json_filename)[0] + '.skl'
+
+
+class SkeletonsWriter:
+    """ Accumulates one ObjectAnnotations per frame and saves them as a columnar store:
+    per-frame arrays of shape (frames, max_objects, n_keypoints, dims) plus scores,
+    validity masks and object counts. """
+
+    def __init__(self, key='annotations'):
+        self._key = key
+        self._frames = {}
+
+    def add(self, pos, annotations):
+        self._frames[pos] = annotations
+
+    def __len__(self):
+        return len(self._frames)
+
+    def arrays(self):
+        frames = [x[1] for x in sorted(self._frames.items())]
+        n_frames = len(frames)
+        n_objects = np.array([len(f.objects) for f in frames], dtype=np.int32)
+        max_objects = int(n_objects.max()) if n_frames > 0 else 0
+        max_vertices, n_keypoints, dims = 0, N_KEYPOINTS, 2
+        labels = []
+        for frame in frames:
+            for obj in frame.objects:
+                max_vertices = max(max_vertices, len(obj.region.vertices))
+                if obj.label not in labels:
+                    labels.append(obj.label)
+                for keypoint in obj.keypoints:
+                    n_keypoints = max(n_keypoints, keypoint.id + 1)
+                    if keypoint.position.z != 0.0:
+                        dims = 3
+                for vertex in obj.region.vertices:
+                    if vertex.z != 0.0:
+                        dims = 3
+        if self._key == 'localizations':
+            dims = 3
+
+        shape = (n_frames, max_objects)
+        arrays = {
+            'n_objects': n_objects,
+            'frame_ids': np.zeros(n_frames, dtype=np.int64),
+            'resolutions': np.zeros((n_frames, 2), dtype=np.int32),
+            'has_resolution': np.zeros(n_frames, dtype=np.bool_),
+            'object_ids': np.zeros(shape, dtype=np.int64),
+            'object_labels': np.zeros(shape, dtype=np.int16),
+            'object_scores': np.zeros(shape, dtype=np.float32),
+            'has_region': np.zeros(shape, dtype=np.bool_),
+            'n_vertices': np.zeros(shape, dtype=np.int16),
+            'regions': np.zeros(shape + (max_vertices, dims), dtype=np.float32),
+            'keypoints': np.zeros(shape + (n_keypoints, dims), dtype=np.float32),
+            'scores': np.zeros(shape + (n_keypoints, ), dtype=np.float32),
+            'valid': np.zeros(shape + (n_keypoints, ), dtype=np.bool_),
+            'has_position': np.zeros(shape + (n_keypoints, ), dtype=np.bool_),
+            'ranks': np.zeros(shape + (n_keypoints, ), dtype=np.int16),
+        }
+        for it, frame in enumerate(frames):
+            arrays['frame_ids'][it] = frame.frame_id
+            arrays['has_resolution'][it] = frame.HasField('resolution')
+            arrays['resolutions'][it] = (frame.resolution.width, frame.resolution.height)
+            for n, obj in enumerate(frame.objects):
+                arrays['object_ids'][it, n] = obj.id
+                arrays['object_labels'][it, n] = labels.index(obj.label)
+                arrays['object_scores'][it, n] = obj.score
+                arrays['has_region'][it, n] = obj.HasField('region')
+                arrays['n_vertices'][it, n] = len(obj.region.vertices)
+                for v, vertex in enumerate(obj.region.vertices):
+                    arrays['regions'][it, n, v] = (vertex.x, vertex.y, vertex.z)[:dims]
+                for rank, keypoint in enumerate(obj.keypoints):
+                    k = keypoint.id
+                    if arrays['valid'][it, n, k]:
+                        raise ValueError('Keypoint {} repeated on object {} of frame {}'.format(
+                            k, n, it))
+                    arrays['valid'][it, n, k] = True
+                    arrays['ranks'][it, n, k] = rank
+                    arrays['scores'][it, n, k] = keypoint.score
+                    arrays['has_position'][it, n, k] = keypoint.HasField('position')
+                    position = keypoint.position
+                    arrays['keypoints'][it, n, k] = (position.x, position.y, position.z)[:dims]
+        return arrays, labels
+
+    def save(self, filename, created_at=''):
+        arrays, labels = self.arrays()
+        header = {
+            'version': VERSION,
+            'key': self._key,
+            'created_at': created_at,
+            'labels': labels,
+            'arrays': {}
+        }
+        offset = 0
+        for name, array in sorted(arrays.items()):
+            header['arrays'][name] = {
+                'dtype': array.dtype.str,
+                'shape': list(array.shape),
+                'offset': offset
+            }
+            offset += (array.nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        header_data = json.dumps(header).encode('utf-8')
+        data_offset = len(MAGIC) + 8 + len(header_data)
+        data_offset = (data_offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+        tmp_filename = '{}.{}.{}.tmp'.format(filename, socket.gethostname(), os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header_data)))
+            f.write(header_data)
+            for name, array in sorted(arrays.items()):
+                f.seek(data_offset + header['arrays'][name]['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_offset + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+
+
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'{}' is not a skeletons store".format(filename))
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    data_offset = len(MAGIC) + 8 + header_size
+    header['data_offset'] = (data_offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    return header
+
+
+class SkeletonsStore:
+    """ Memory mapped reader of the files saved by SkeletonsWriter. Arrays are only paged
+    in when accessed, so getting any frame costs the same regardless of the file size. """
+
+    def __init__(self, filename):
+        header = read_header(filename)
+        self.key = header['key']
+        self.created_at = header['created_at']
+        self.labels = header['labels']
+        self.arrays = {}
+        for name, info in header['arrays'].items():
+            shape = tuple(info['shape'])
+            if int(np.prod(shape)) == 0:
+                self.arrays[name] = np.zeros(shape, dtype=np.dtype(info['dtype']))
+                continue
+            self.arrays[name] = np.memmap(
+                filename,
+                dtype=np.dtype(info['dtype']),
+                mode='r',
+                offset=header['data_offset'] + info['offset'],
+                shape=shape)
+        self.dims = self.arrays['keypoints'].shape[-1]
+
+    def __len__(self):
+        return self.arrays['n_objects'].shape[0]
+
+    def __getitem__(self, it):
+        n = int(self.arrays['n_objects'][it])
+        return {
+            'keypoints': self.arrays['keypoints'][it, :n],
+            'scores': self.arrays['scores'][it, :n],
+            'valid': self.arrays['valid'][it, :n],
+        }
+
+    def annotations(self, it):
+        a = self.arrays
+        pb = ObjectAnnotations(frame_id=int(a['frame_ids'][it]))
+        if a['has_resolution'][it]:
+            pb.resolution.width = int(a['resolutions'][it, 0])
+            pb.resolution.height = int(a['resolutions'][it, 1])
+        for n in range(int(a['n_objects'][it])):
+            obj = pb.objects.add(
+                label=self.labels[a['object_labels'][it, n]],
+                id=int(a['object_ids'][it, n]),
+                score=float(a['object_scores'][it, n]))
+            if a['has_region'][it, n]:
+                obj.region.SetInParent()
+            for vertex in a['regions'][it, n, :a['n_vertices'][it, n]]:
+                obj.region.vertices.add(**dict(zip('xyz', map(float, vertex))))
+            ids = np.where(a['valid'][it, n])[0]
+            for k in ids[np.argsort(a['ranks'][it, n, ids], kind='stable')]:
+                keypoint = obj.keypoints.add(id=int(k), score=float(a['scores'][it, n, k]))
+                # assigning any coordinate would mark the position as present
+                if not a['has_position'][it, n, k]:
+                    continue
+                keypoint.position.SetInParent()
+                for axis, value in zip('xyz', a['keypoints'][it, n, k]):
+                    setattr(keypoint.position, axis, float(value))
+        return pb
+
+    def to_dict(self, it):
+        return MessageToDict(
+            self.annotations(it),
+            preserving_proto_field_name=True,
+            including_default_value_fields=True)
+
+
+def from_json(filename):
+    with open(filename, 'r') as f:
+        data = json.load(f)
+    key = 'localizations' if 'localizations' in data else 'annotations'
+    writer = SkeletonsWriter(key=key)
+    for pos, annotations in enumerate(data[key]):
+        writer.add(pos, ParseDict(annotations, ObjectAnnotations()))
+    return writer, data
+
+
+def fresh_store(json_filename):
+    # columnar store of a JSON file, if there is one up to date
+    filename = store_filename(json_filename)
+    if os.path.exists(filename) and (not os.path.exists(json_filename) or
+                                     os.path.getmtime(filename) >= os.path.getmtime(json_filename)):
+        return filename
+    return None
+
+
+def load_arrays(json_filename):
+    filename = fresh_store(json_filename)
+    if filename is not None:
+        return SkeletonsStore(filename).arrays
+    writer, _ = from_json(json_filename)
+    return writer.arrays()[0]
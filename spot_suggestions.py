@@ -0,0 +1,85 @@
+import numpy as np
+from is_msgs.image_pb2 import HumanKeypoints as HKP
+from skeletons_store import load_arrays
+from spots import Spots
+
+ARM_JOINTS = [
+    HKP.Value('LEFT_WRIST'),
+    HKP.Value('RIGHT_WRIST'),
+    HKP.Value('LEFT_ELBOW'),
+    HKP.Value('RIGHT_ELBOW')
+]
+
+
+def motion_energy(keypoints, valid, joints=ARM_JOINTS, max_distance=0.5):
+    """ Sum of the squared displacements of 'joints' since the previous frame, of the person
+    moving the most on each frame. People are matched to the closest one of the previous
+    frame by the mean position of their joints, up to 'max_distance'. """
+    positions, valid = keypoints[:, :, joints], valid[:, :, joints]
+    n_frames, n_objects = valid.shape[:2]
+    energy = np.zeros(n_frames)
+    if n_frames < 2 or n_objects == 0:
+        return energy
+    counts = valid.sum(axis=2)
+    centers = (positions * valid[..., None]).sum(axis=2) / np.maximum(counts, 1)[..., None]
+    distances = np.linalg.norm(centers[1:, :, None] - centers[:-1, None, :], axis=-1)
+    distances = np.where(counts[:-1, None, :] > 0, distances, np.inf)
+    matches = distances.argmin(axis=2)
+    rows = np.arange(n_frames - 1)[:, None]
+    moved = valid[1:] & valid[:-1][rows, matches] & \
+        (distances.min(axis=2) <= max_distance)[..., None]
+    displacements = ((positions[1:] - positions[:-1][rows, matches])**2).sum(axis=-1)
+    energy[1:] = (displacements * moved).sum(axis=2).max(axis=1)
+    return energy
+
+
+def hysteresis(signal, low, high, min_length=2, max_gap=0):
+    """ Intervals where 'signal' stays above 'low' and goes above 'high' at least once, as
+    inclusive (begin, end) frames, with at least 'min_length' frames. Intervals apart by up
+    to 'max_gap' frames are merged into one. """
+    above = np.concatenate(([0], signal > low, [0])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(above))
+    begins, ends = edges[::2], edges[1::2]
+    if begins.size == 0:
+        return []
+    # each run is followed by frames below 'low', which can't change its peak
+    peaks = np.maximum.reduceat(signal, begins)
+    begins, ends = begins[peaks > high], ends[peaks > high]
+    if begins.size == 0:
+        return []
+    first = np.concatenate(([True], begins[1:] - ends[:-1] > max_gap))
+    last = np.concatenate((first[1:], [True]))
+    begins, ends = begins[first], ends[last]
+    keep = ends - begins >= max(min_length, 2)
+    return list(zip(begins[keep].tolist(), (ends[keep] - 1).tolist()))
+
+
+def suggest_spots(keypoints,
+                  valid,
+                  smoothing=5,
+                  low=0.15,
+                  high=0.4,
+                  min_length=5,
+                  max_hold=30):
+    """ Candidate gesture spots, where the arms move. Thresholds are fractions of the range
+    between the energy of the sequence at rest and at its peaks. As the energy drops while
+    a pose is held, movements apart by up to 'max_hold' frames make a single spot, e.g.
+    raising the arms, holding them up and lowering them. """
+    energy = motion_energy(keypoints, valid)
+    if energy.size == 0:
+        return []
+    smoothing = min(smoothing, energy.size)
+    if smoothing > 1:
+        energy = np.convolve(energy, np.ones(smoothing) / smoothing, mode='same')
+    rest, peak = np.percentile(energy, [10, 98])
+    if peak <= rest:
+        return []
+    return hysteresis(energy, rest + low * (peak - rest), rest + high * (peak - rest),
+                      min_length, max_hold)
+
+
+def load_suggestions(json_filename, n_samples, **kwargs):
+    # 'json_filename' of 3D localizations, e.g. 'p001g01_3d.json'
+    arrays = load_arrays(json_filename)
+    spots = suggest_spots(arrays['keypoints'], arrays['valid'], **kwargs)
+    return Spots(n_samples, [(begin, end) for begin, end in spots if end < n_samples])
@@ -0,0 +1,116 @@
+from bisect import bisect_left, bisect_right
+import numpy as np
+
+# per frame labels, as on the labeling timeline
+NO_GESTURE, BEGIN, END, GESTURE, PENDING_BEGIN = 0, 1, -1, 3, 2
+
+
+class Spots:
+    """ Gesture spots of a sequence of 'n_samples' frames, as sorted lists of inclusive
+    [begin, end] intervals which never overlap. Lookups bisect the begins, so finding the
+    spot enclosing a frame, or the ones next to it, takes O(log n). """
+
+    def __init__(self, n_samples, spots=()):
+        self.n_samples = int(n_samples)
+        self._begins, self._ends = [], []
+        for begin, end in sorted(spots):
+            self.add(begin, end)
+
+    def __len__(self):
+        return len(self._begins)
+
+    def __iter__(self):
+        return zip(self._begins, self._ends)
+
+    def __eq__(self, other):
+        return isinstance(other, Spots) and self.n_samples == other.n_samples and \
+            self._begins == other._begins and self._ends == other._ends
+
+    def __ne__(self, other):
+        return not self == other
+
+    def copy(self):
+        return Spots(self.n_samples, self)
+
+    def _index(self, it):
+        # index of the last spot beginning at or before 'it'
+        return bisect_right(self._begins, it) - 1
+
+    def enclosing(self, it):
+        n = self._index(it)
+        if n >= 0 and self._ends[n] >= it:
+            return self._begins[n], self._ends[n]
+        return None
+
+    def next(self, it):
+        """ First spot beginning after 'it'. """
+        n = self._index(it) + 1
+        return (self._begins[n], self._ends[n]) if n < len(self._begins) else None
+
+    def previous(self, it):
+        """ Last spot ending before 'it'. """
+        n = bisect_left(self._ends, it) - 1
+        return (self._begins[n], self._ends[n]) if n >= 0 else None
+
+    def overlaps(self, begin, end):
+        n = self._index(end)
+        return n >= 0 and self._ends[n] >= begin
+
+    def add(self, begin, end):
+        begin, end = int(begin), int(end)
+        if not 0 <= begin < end < self.n_samples:
+            raise ValueError('Invalid spot [{}, {}] on {} frames'.format(
+                begin, end, self.n_samples))
+        if self.overlaps(begin, end):
+            raise ValueError('Spot [{}, {}] overlaps another one'.format(begin, end))
+        n = self._index(begin) + 1
+        self._begins.insert(n, begin)
+        self._ends.insert(n, end)
+
+    def remove(self, it):
+        """ Removes and returns the spot enclosing 'it', if any. """
+        n = self._index(it)
+        if n < 0 or self._ends[n] < it:
+            return None
+        return self._begins.pop(n), self._ends.pop(n)
+
+    @classmethod
+    def from_dict(cls, labels_dict):
+        spots = [(label['begin'], label['end']) for label in labels_dict['labels']]
+        return cls(labels_dict['n_samples'], spots)
+
+    def to_dict(self):
+        return {
+            'n_samples': self.n_samples,
+            'labels': [{
+                'begin': begin,
+                'end': end
+            } for begin, end in self]
+        }
+
+    @classmethod
+    def from_array(cls, labels):
+        """ Spots of a per frame labels array, or none at all when its begins and ends
+        don't pair up. """
+        spots = cls(len(labels))
+        begins = np.flatnonzero(labels == BEGIN)
+        ends = np.flatnonzero(labels == END)
+        if begins.size != ends.size or np.any(ends - begins < 1) or \
+                np.any(begins[1:] <= ends[:-1]):
+            return spots
+        spots._begins, spots._ends = begins.tolist(), ends.tolist()
+        return spots
+
+    def to_array(self):
+        labels = np.zeros(self.n_samples, dtype=np.int8)
+        if len(self) == 0:
+            return labels
+        begins, ends = np.array(self._begins), np.array(self._ends)
+        # frames inside spots have more begins than ends up to them
+        steps = np.zeros(self.n_samples + 1, dtype=np.int32)
+        steps[begins] += 1
+        steps[ends + 1] -= 1
+        labels[np.cumsum(steps[:-1]) > 0] = GESTURE
+        labels[begins] = BEGIN
+        labels[ends] = END
+        return labels
@@ -0,0 +1,14 @@
+from is_msgs.image_pb2 import ObjectAnnotations, ObjectLabels
+from mock_skeletons import random_skeletons
+
+
+def test_skeletons_round_trip():
+    annotations = random_skeletons(640, 480, 3)
+    parsed = ObjectAnnotations()
+    parsed.ParseFromString(annotations.SerializeToString())
+    assert parsed == annotations
+    assert len(parsed.objects) == 3
+    for skeleton in parsed.objects:
+        assert skeleton.id == ObjectLabels.Value('HUMAN_SKELETON')
+        for keypoint in skeleton.keypoints:
+            assert 0 <= keypoint.position.x < 640 and 0 <= keypoint.position.y < 480
@@ -0,0 +1,28 @@
+import requester
+from requester import EndpointsRouter, PENALTY_HALF_LIFE_SEC
+
+
+def send(router, n_requests):
+    topics = []
+    for _ in range(n_requests):
+        topic = router.choose()
+        router.sent(topic)
+        topics.append(topic)
+    return topics
+
+
+def test_failed_endpoint_gets_traffic_again(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(requester.time, 'time', lambda: now[0])
+    router = EndpointsRouter(['a', 'b'], deadline=15.0)
+    for topic in send(router, 2):
+        router.replied(topic, 0.01)
+    router.sent('a')
+    router.failed('a')
+
+    assert send(router, 10) == ['b'] * 10
+    for _ in range(10):
+        router.replied('b', 0.01)
+
+    now[0] += 12 * PENALTY_HALF_LIFE_SEC
+    assert 'a' in send(router, 10)
@@ -0,0 +1,32 @@
+import numpy as np
+from spot_suggestions import ARM_JOINTS, suggest_spots
+
+
+def gestures(n_gestures=1, rest=40, raising=10, hold=20, lowering=10):
+    # arms raised, held up and lowered, with rest between gestures
+    gesture = np.concatenate(
+        (np.linspace(0, 1, raising), np.ones(hold), np.linspace(1, 0, lowering), np.zeros(rest)))
+    pose = np.concatenate([np.zeros(rest)] + [gesture] * n_gestures)
+    keypoints = np.random.RandomState(0).normal(0, 0.002, (pose.size, 1, 20, 3))
+    keypoints[:, 0, ARM_JOINTS, 2] += 0.5 * pose[:, None]
+    return keypoints, np.ones(keypoints.shape[:3], dtype=bool)
+
+
+def test_held_pose_is_a_single_spot():
+    spots = suggest_spots(*gestures())
+    assert len(spots) == 1
+    begin, end = spots[0]
+    assert begin <= 40 and end >= 79
+
+
+def test_gestures_apart_are_not_merged():
+    spots = suggest_spots(*gestures(n_gestures=3))
+    assert len(spots) == 3
+    for n, (begin, end) in enumerate(spots):
+        assert begin <= 40 + 80 * n and end >= 79 + 80 * n
+
+
+def test_sequences_shorter_than_smoothing():
+    assert suggest_spots(np.zeros((0, 0, 20, 3)), np.zeros((0, 0, 20), dtype=bool)) == []
+    keypoints, valid = gestures()
+    assert suggest_spots(keypoints[:3], valid[:3]) == []
@@ -0,0 +1,70 @@
+import numpy as np
+
+# labels are 0 (no gesture), 2 (begin waiting for its end), 1 (begin), 3 (gesture) and -1 (end).
+# When many frames fall on the same column the label with highest priority is drawn, so begins
+# and ends stay visible on long sequences. Both tables are indexed by label + 1.
+PRIORITIES = np.array([4, 0, 3, 2, 1], dtype=np.uint8)
+COLORS = np.array(
+    [(0, 0, 0), (127, 127, 127), (0, 255, 0), (255, 0, 0), (0, 0, 255)], dtype=np.uint8)
+CURSOR_COLOR = (0, 255, 255)
+NOT_LOADED_COLOR = (255, 255, 255)
+SUGGESTION_COLOR = (255, 0, 255)
+
+
+class Timeline:
+    """ Bar of 'width' x 'height' pixels with the labels of every frame of a sequence. The
+    labels are rasterized once into a cached strip, and 'update' only redraws the columns of
+    frames whose labels changed, so drawing is a copy of the strip plus a few overlays.
+    Suggested spots are marked on the top rows of the bar. """
+
+    def __init__(self, labels, width, height):
+        self._labels = np.array(labels, dtype=np.int8)
+        self._width = width
+        n_frames = max(self._labels.size, 1)
+        # first frame of each column, repeated when there are more columns than frames
+        self._first = (np.arange(width) * n_frames) // width
+        self._strip = np.zeros((height, width, 3), dtype=np.uint8)
+        self._marks_h = max(1, height // 4)
+        self._marked_columns = np.zeros(0, dtype=np.int64)
+        if self._labels.size > 0:
+            self._rasterize(0, width)
+
+    def _columns(self, begin, end):
+        # columns showing any frame in [begin, end)
+        c0 = int(np.searchsorted(self._first, begin, 'left'))
+        if c0 == self._width or self._first[c0] > begin:
+            c0 -= 1
+        return max(c0, 0), int(np.searchsorted(self._first, end, 'left'))
+
+    def _rasterize(self, c0, c1):
+        first = self._first[c0:c1]
+        end = self._first[c1] if c1 < self._width else self._labels.size
+        end = max(end, first[-1] + 1)
+        priorities = PRIORITIES[self._labels[first[0]:end] + 1]
+        self._strip[:, c0:c1] = COLORS[np.maximum.reduceat(priorities, first - first[0])]
+
+    def update(self, labels):
+        """ Redraws the columns of the frames whose labels differ from the last ones drawn. """
+        changed = np.flatnonzero(self._labels != labels)
+        if changed.size == 0:
+            return
+        begin, end = changed[0], changed[-1] + 1
+        self._labels[begin:end] = labels[begin:end]
+        self._rasterize(*self._columns(begin, end))
+
+    def set_suggestions(self, suggestions):
+        # 'suggestions' as Spots, over the same frames as the labels
+        if self._labels.size == 0:
+            return
+        suggested = (suggestions.to_array() != 0).astype(np.uint8)
+        self._marked_columns = np.flatnonzero(np.maximum.reduceat(suggested, self._first))
+
+    def draw(self, out, position=None, n_loaded_frames=None):
+        np.copyto(out, self._strip)
+        out[:self._marks_h, self._marked_columns] = SUGGESTION_COLOR
+        if position is not None:
+            x0, x1 = self._columns(position, position + 1)
+            out[:, x0:x1] = CURSOR_COLOR
+        if n_loaded_frames is not None and n_loaded_frames < self._labels.size:
+            out[:, self._columns(n_loaded_frames, self._labels.size)[0]:] = NOT_LOADED_COLOR
+        return out
@@ -0,0 +1,241 @@
+import os
+import cv2
+import numpy as np
+from is_msgs.camera_pb2 import CameraCalibration
+from is_msgs.image_pb2 import ObjectAnnotations, ObjectLabels
+from google.protobuf.json_format import Parse
+
+REFERENCE_FRAME = 1000
+MIN_COMMON_KEYPOINTS = 3
+
+
+def tensor_to_array(tensor):
+    shape = [dim.size for dim in tensor.shape.dims]
+    values = tensor.doubles if len(tensor.doubles) > 0 else tensor.floats
+    return np.array(values, dtype=np.float64).reshape(shape)
+
+
+class CameraModel:
+    def __init__(self, calibration, reference=REFERENCE_FRAME):
+        self.id = calibration.id
+        self.intrinsic = tensor_to_array(calibration.intrinsic)
+        self.distortion = tensor_to_array(calibration.distortion).ravel()
+        extrinsic = None
+        for tf in calibration.extrinsic:
+            if getattr(tf, 'from') == reference and tf.to == calibration.id:
+                extrinsic = tensor_to_array(tf.tf)
+            elif getattr(tf, 'from') == calibration.id and tf.to == reference:
+                extrinsic = np.linalg.inv(tensor_to_array(tf.tf))
+        if extrinsic is None:
+            raise ValueError('Calibration of camera {} has no transformation to frame {}'.format(
+                calibration.id, reference))
+        # projects points from the reference frame into undistorted pixel coordinates
+        self.projection = np.dot(self.intrinsic, extrinsic[:3, :])
+
+    def undistort(self, points):
+        if self.distortion.size == 0 or not np.any(self.distortion):
+            return points.astype(np.float64)
+        shape = points.shape
+        undistorted = cv2.undistortPoints(
+            points.reshape(-1, 1, 2).astype(np.float64),
+            self.intrinsic,
+            self.distortion,
+            P=self.intrinsic)
+        return undistorted.reshape(shape)
+
+
+def load_calibrations(folder, cameras, reference=REFERENCE_FRAME):
+    models = {}
+    for camera in cameras:
+        filename = os.path.join(folder, '{}.json'.format(camera))
+        with open(filename, 'r') as f:
+            models[camera] = CameraModel(Parse(f.read(), CameraCalibration()), reference)
+    return models
+
+
+def fundamental_matrix(p0, p1):
+    # F such as x1' F x0 = 0, from the center of camera 0 seen by camera 1
+    center = np.linalg.svd(p0)[2][-1]
+    epipole = np.dot(p1, center)
+    skew = np.array([[0, -epipole[2], epipole[1]], [epipole[2], 0, -epipole[0]],
+                     [-epipole[1], epipole[0], 0]])
+    return np.dot(skew, np.dot(p1, np.linalg.pinv(p0)))
+
+
+def epipolar_costs(points0, valid0, points1, valid1, fundamental):
+    """ Mean symmetric epipolar distance, in pixels, between every pair of skeletons of two
+    views over all frames: (frames, objects0, K, 2) x (frames, objects1, K, 2) ->
+    (frames, objects0, objects1). Pairs sharing few keypoints cost infinity. """
+    h0 = np.concatenate([points0, np.ones(points0.shape[:-1] + (1, ))], axis=-1)
+    h1 = np.concatenate([points1, np.ones(points1.shape[:-1] + (1, ))], axis=-1)
+    lines1 = np.dot(h0, fundamental.T)  # epipolar lines on view 1
+    lines0 = np.dot(h1, fundamental)  # epipolar lines on view 0
+    residuals = np.abs(np.einsum('faki,fbki->fabk', lines1, h1))
+    norm1 = np.linalg.norm(lines1[..., :2], axis=-1)[:, :, None, :]
+    norm0 = np.linalg.norm(lines0[..., :2], axis=-1)[:, None, :, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = 0.5 * residuals * (1.0 / norm1 + 1.0 / norm0)
+    common = valid0[:, :, None, :] & valid1[:, None, :, :]
+    n_common = common.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        costs = np.where(common, distances, 0.0).sum(axis=-1) / n_common
+    costs[n_common < MIN_COMMON_KEYPOINTS] = np.inf
+    return costs
+
+
+def group_skeletons(costs, n_objects, max_distance):
+    """ Greedily joins skeletons of different views, cheapest pairs first, never putting
+    two skeletons of the same view on a group. Returns, per frame, a list of groups
+    as {view: object} dicts. 'costs' maps (view0, view1) to epipolar_costs output. """
+    n_frames = len(next(iter(n_objects.values())))
+    groups = []
+    for it in range(n_frames):
+        edges = []
+        for (v0, v1), cost in costs.items():
+            c = cost[it, :n_objects[v0][it], :n_objects[v1][it]]
+            for a, b in zip(*np.where(c < max_distance)):
+                edges.append((c[a, b], v0, int(a), v1, int(b)))
+        edges.sort()
+        node_group = {}
+        frame_groups = []
+        for _, v0, a, v1, b in edges:
+            g0, g1 = node_group.get((v0, a)), node_group.get((v1, b))
+            if g0 is None and g1 is None:
+                frame_groups.append({v0: a, v1: b})
+                node_group[(v0, a)] = node_group[(v1, b)] = len(frame_groups) - 1
+            elif g1 is None and v1 not in frame_groups[g0]:
+                frame_groups[g0][v1] = b
+                node_group[(v1, b)] = g0
+            elif g0 is None and v0 not in frame_groups[g1]:
+                frame_groups[g1][v0] = a
+                node_group[(v0, a)] = g1
+            elif g0 is not None and g1 is not None and g0 != g1 and \
+                    not set(frame_groups[g0]) & set(frame_groups[g1]):
+                frame_groups[g0].update(frame_groups[g1])
+                for node in frame_groups[g1].items():
+                    node_group[node] = g0
+                frame_groups[g1] = {}
+        groups.append([g for g in frame_groups if len(g) > 0])
+    return groups
+
+
+def triangulate(points, weights, projections):
+    """ Batched linear (DLT) triangulation. points: (..., views, 2) undistorted pixels,
+    weights: (..., views), zero for missing observations, projections: (views, 3, 4).
+    Returns (..., 3) positions. """
+    x = points[..., 0, None] * projections[:, 2, :] - projections[:, 0, :]
+    y = points[..., 1, None] * projections[:, 2, :] - projections[:, 1, :]
+    rows = np.stack([x, y], axis=-2)  # (..., views, 2, 4)
+    norms = np.linalg.norm(rows, axis=-1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    rows = rows / norms * weights[..., None, None]
+    a = rows.reshape(rows.shape[:-3] + (2 * rows.shape[-3], 4))
+    homogeneous = np.linalg.svd(a)[2][..., -1, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return homogeneous[..., :3] / homogeneous[..., 3:]
+
+
+def localize_sequence(models, skeletons, max_distance=50.0, min_views=2):
+    """ skeletons: {camera: arrays as loaded by skeletons_store.load_arrays} of the same
+    sequence. Returns arrays of 3D skeletons on the calibration reference frame. """
+    cameras = sorted(skeletons.keys())
+    n_keypoints = max(skeletons[c]['keypoints'].shape[2] for c in cameras)
+    points, valid, scores, n_objects = {}, {}, {}, {}
+    for camera in cameras:
+        arrays = skeletons[camera]
+        shape = arrays['keypoints'].shape
+        points[camera] = np.zeros(shape[:2] + (n_keypoints, 2))
+        points[camera][:, :, :shape[2]] = models[camera].undistort(
+            np.asarray(arrays['keypoints'][..., :2]))
+        valid[camera] = np.zeros(shape[:2] + (n_keypoints, ), dtype=np.bool_)
+        valid[camera][:, :, :shape[2]] = arrays['valid']
+        scores[camera] = np.zeros(shape[:2] + (n_keypoints, ), dtype=np.float32)
+        scores[camera][:, :, :shape[2]] = arrays['scores']
+        n_objects[camera] = np.asarray(arrays['n_objects'])
+
+    costs = {}
+    for n, v0 in enumerate(cameras):
+        for v1 in cameras[n + 1:]:
+            fundamental = fundamental_matrix(models[v0].projection, models[v1].projection)
+            costs[(v0, v1)] = epipolar_costs(points[v0], valid[v0], points[v1], valid[v1],
+                                             fundamental)
+    groups = group_skeletons(costs, n_objects, max_distance)
+
+    n_frames = len(groups)
+    max_groups = max([len(g) for g in groups] + [0])
+    g_points = np.zeros((n_frames, max_groups, n_keypoints, len(cameras), 2))
+    g_weights = np.zeros((n_frames, max_groups, n_keypoints, len(cameras)))
+    g_scores = np.zeros((n_frames, max_groups, n_keypoints, len(cameras)), dtype=np.float32)
+    for it, frame_groups in enumerate(groups):
+        for g, group in enumerate(frame_groups):
+            for v, camera in enumerate(cameras):
+                if camera not in group:
+                    continue
+                obj = group[camera]
+                g_points[it, g, :, v] = points[camera][it, obj]
+                g_weights[it, g, :, v] = valid[camera][it, obj]
+                g_scores[it, g, :, v] = scores[camera][it, obj]
+
+    projections = np.stack([models[camera].projection for camera in cameras])
+    positions = triangulate(g_points, g_weights, projections)
+    n_views = (g_weights > 0).sum(axis=-1)
+    keypoints_valid = (n_views >= min_views) & np.all(np.isfinite(positions), axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keypoint_scores = np.where(keypoints_valid,
+                                   (g_scores * (g_weights > 0)).sum(axis=-1) / n_views, 0.0)
+
+    return {
+        'keypoints': np.where(keypoints_valid[..., None], positions, 0.0).astype(np.float32),
+        'scores': keypoint_scores.astype(np.float32),
+        'valid': keypoints_valid,
+        'n_objects': np.array([len(g) for g in groups], dtype=np.int32),
+    }
+
+
+def to_annotations(skeletons, frame_id=REFERENCE_FRAME):
+    localizations = []
+    for it in range(len(skeletons['n_objects'])):
+        pb = ObjectAnnotations(frame_id=frame_id)
+        for n in range(skeletons['n_objects'][it]):
+            ids = np.where(skeletons['valid'][it, n])[0]
+            if ids.size == 0:
+                continue
+            obj = pb.objects.add(
+                id=ObjectLabels.Value('HUMAN_SKELETON'),
+                score=float(skeletons['scores'][it, n, ids].mean()))
+            for k in ids:
+                keypoint = obj.keypoints.add(id=int(k), score=float(skeletons['scores'][it, n, k]))
+                x, y, z = map(float, skeletons['keypoints'][it, n, k])
+                keypoint.position.x, keypoint.position.y, keypoint.position.z = x, y, z
+        localizations.append(pb)
+    return localizations
+
+
+def compare_skeletons(skeletons, reference):
+    """ Matches skeletons of each frame to the closest reference ones and returns per joint
+    errors of the matched pairs plus how many frames have the same number of skeletons. """
+    errors = []
+    same_count = 0
+    n_frames = min(len(skeletons['n_objects']), len(reference['n_objects']))
+    for it in range(n_frames):
+        n0, n1 = int(skeletons['n_objects'][it]), int(reference['n_objects'][it])
+        same_count += n0 == n1
+        if n0 == 0 or n1 == 0:
+            continue
+        k = min(skeletons['keypoints'].shape[2], reference['keypoints'].shape[2])
+        p0, v0 = skeletons['keypoints'][it, :n0, :k], skeletons['valid'][it, :n0, :k]
+        p1, v1 = reference['keypoints'][it, :n1, :k], reference['valid'][it, :n1, :k]
+        distances = np.linalg.norm(p0[:, None] - p1[None, :], axis=-1)
+        common = v0[:, None] & v1[None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(common, distances, 0.0).sum(axis=-1) / common.sum(axis=-1)
+        mean[~np.isfinite(mean)] = np.inf
+        used0, used1 = set(), set()
+        for a, b in zip(*np.unravel_index(np.argsort(mean, axis=None), mean.shape)):
+            if a in used0 or b in used1 or not np.isfinite(mean[a, b]):
+                continue
+            used0.add(a)
+            used1.add(b)
+            errors.append(distances[a, b][common[a, b]])
+    errors = np.concatenate(errors) if len(errors) > 0 else np.zeros(0)
+    return errors, same_count, n_frames
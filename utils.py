@@ -1,12 +1,19 @@
 import os
+import re
 import sys
 import cv2
 import json
+import queue
+import socket
 import numpy as np
+from threading import Thread
+from itertools import zip_longest
 from options_pb2 import DatasetCaptureOptions
 from google.protobuf.json_format import Parse
 from is_wire.core import Logger
 from is_msgs.image_pb2 import Image
+from skeletons_store import SkeletonsStore, fresh_store
+from spots import Spots
 
 
 def load_options(print_options=True):
@@ -22,6 +29,16 @@ def load_options(print_options=True):
             sys.exit(-1)
 
 
+def atomic_json_dump(obj, filename, **kwargs):
+    # readers never see partially written files, even if many writers share the folder
+    tmp_filename = '{}.{}.{}.tmp'.format(filename, socket.gethostname(), os.getpid())
+    with open(tmp_filename, 'w') as f:
+        json.dump(obj, f, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
 def make_pb_image(input_image, encode_format='.jpeg', compression_level=0.9):
     if isinstance(input_image, np.ndarray):
         if encode_format == '.jpeg':
@@ -38,28 +55,37 @@ def make_pb_image(input_image, encode_format='.jpeg', compression_level=0.9):
         return Image()
 
 
+def fit_frame(frame, size):
+    # downscales 'frame' to fit into size=(width, height) keeping its aspect ratio,
+    # returns the factors that map coordinates of the new frame back to the original one
+    height, width = frame.shape[:2]
+    ratio = min(size[0] / width, size[1] / height)
+    if ratio >= 1.0:
+        return frame, 1.0, 1.0
+    dsize = (max(1, int(round(ratio * width))), max(1, int(round(ratio * height))))
+    resized = cv2.resize(frame, dsize=dsize, interpolation=cv2.INTER_AREA)
+    return resized, width / dsize[0], height / dsize[1]
+
+
+def scale_annotations(annotations, fx, fy, resolution=None):
+    for obj in annotations.objects:
+        for vertex in obj.region.vertices:
+            vertex.x *= fx
+            vertex.y *= fy
+        for keypoint in obj.keypoints:
+            keypoint.position.x *= fx
+            keypoint.position.y *= fy
+    if resolution is not None:
+        annotations.resolution.width, annotations.resolution.height = resolution
+    return annotations
+
+
 def to_labels_array(labels_dict):
-    labels = np.zeros(labels_dict['n_samples'])
-    for label in labels_dict['labels']:
-        begin, end = label['begin'], label['end']
-        labels[begin] = 1
-        labels[end] = -1
-        labels[begin + 1:end] = 3
-    return labels
+    return Spots.from_dict(labels_dict).to_array()
 
 
 def to_labels_dict(labels_array):
-    labels = {'n_samples': labels_array.size, 'labels': []}
-    begins = np.where(labels_array == 1)[0]
-    ends = np.where(labels_array == -1)[0]
-    if (begins.size != ends.size) and begins.size > 0 and ends.size > 0:
-        return labels
-    diff = ends - begins
-    if np.any(diff < 1):
-        return labels
-    for begin, end in zip(begins.tolist(), ends.tolist()):
-        labels['labels'].append({'begin': begin, 'end': end})
-    return labels
+    return Spots.from_array(labels_array).to_dict()
 
 
 class FrameVideoFetcher:
@@ -86,50 +112,173 @@ class FrameVideoFetcher:
 
         n_next_frame = int(self._video_cap.get(cv2.CAP_PROP_POS_FRAMES))
         _, frame = self._video_cap.read()
+        return self._current_video_base, n_next_frame, frame
+
+
+WHITESPACE = re.compile(r'\s*')
+
+
+class JsonChunksReader:
+    def __init__(self, f, chunk_size=1 << 16):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+
+    def _fill(self):
+        data = self._f.read(self._chunk_size)
+        if len(data) == 0:
+            return False
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError("Expecting one of '{}' at '{}'".format(chars, self._f.name))
+        self._pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # a number could have been cut at the end of the buffer
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def iter_json_array(filename, key, chunk_size=1 << 16):
+    """ Yields the items of the array 'key' of the JSON object saved on 'filename' one at a
+    time, so only a chunk of the file is kept in memory. """
+    with open(filename, 'r') as f:
+        reader = JsonChunksReader(f, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            raise KeyError(key)
+        while True:
+            name = reader.value()
+            reader.expect(':')
+            if name == key:
+                reader.expect('[')
+                if reader.peek() == ']':
+                    return
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        return
+            reader.value()
+            if reader.expect(',}') == '}':
+                raise KeyError(key)
 
 
 class AnnotationsFetcher:
-    def __init__(self, pending_localizations, cameras, base_folder, fix_frame_id=True):
+    """ Streams the 2D annotations of the pending sequences frame aligned over all cameras.
+    A background thread reads them ahead, going on to the next sequences, while keeping at
+    most 'max_frames' frames queued. Each frame comes as a JSON encoded list with the
+    annotations of every camera, joined from fragments serialized once when read. Frames of
+    a sequence are only served once its files are known to have the same size, which the
+    headers of columnar stores tell upfront; otherwise the sequence is read whole first.
+    Positions on the optional 'skip' set of a pending sequence are read but not served. """
+
+    def __init__(self,
+                 pending_localizations,
+                 cameras,
+                 base_folder,
+                 fix_frame_id=True,
+                 max_frames=1000):
         self._pending_localizations = pending_localizations
         self._cameras = cameras
         self._base_folder = base_folder
         self._fix_frame_id = fix_frame_id
-        self._localizations_it = iter(self._pending_localizations)
-        self._annotation_pos = 0
-        self._n_annotations = 0
-        self._fwd_annotations = True
-        self._current_annotations = {}
-        self._current_person_id = None
-        self._current_gesture_id = None
+        self._frames = queue.Queue(maxsize=max_frames)
+        self._sizes = {}
+        self._thread = Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def size(self, person_id, gesture_id):
+        # known before the first frame of the sequence is served
+        return self._sizes.get((person_id, gesture_id))
+
+    def _camera_frames(self, person_id, gesture_id, camera):
+        # frames of a camera and their count, which is only known beforehand from a store
+        filename = 'p{:03d}g{:02d}c{:02d}_2d.json'.format(person_id, gesture_id, camera)
+        filepath = os.path.join(self._base_folder, filename)
+        store_path = fresh_store(filepath)
+        if store_path is not None:
+            store = SkeletonsStore(store_path)
+            return len(store), (store.to_dict(it) for it in range(len(store)))
+        return None, iter_json_array(filepath, 'annotations')
+
+    def _serialize(self, annotations):
+        fragments = []
+        for camera, annotation in zip(self._cameras, annotations):
+            if self._fix_frame_id:
+                annotation['frame_id'] = camera
+            fragments.append(json.dumps(annotation, separators=(',', ':')).encode('utf-8'))
+        return b'[' + b','.join(fragments) + b']'
+
+    def _align(self, person_id, gesture_id, frames, skip, put):
+        # frames of every camera put together, returning their count or None if it differs
+        n_frames = 0
+        for annotations in zip_longest(*frames):
+            if None in annotations:
+                return None
+            if n_frames not in skip:
+                put((person_id, gesture_id, n_frames, self._serialize(annotations)))
+            n_frames += 1
+        return n_frames
+
+    def _read(self):
+        try:
+            for pending_localization in self._pending_localizations:
+                person_id = pending_localization['person_id']
+                gesture_id = pending_localization['gesture_id']
+                skip = pending_localization.get('skip', ())
+                sizes, frames = zip(*[
+                    self._camera_frames(person_id, gesture_id, camera)
+                    for camera in self._cameras
+                ])
+                if None not in sizes:
+                    if len(set(sizes)) == 1:
+                        self._sizes[(person_id, gesture_id)] = sizes[0]
+                        self._align(person_id, gesture_id, frames, skip, self._frames.put)
+                else:
+                    # sizes are only known once the files are read, so frames are held until then
+                    held = []
+                    n_frames = self._align(person_id, gesture_id, frames, skip, held.append)
+                    if n_frames is not None:
+                        self._sizes[(person_id, gesture_id)] = n_frames
+                        for frame in held:
+                            self._frames.put(frame)
+                self._frames.put((person_id, gesture_id, None, None))
+            self._frames.put((None, None, None, None))
+        except Exception as ex:
+            self._frames.put(ex)
 
     def next(self):
-        if self._fwd_annotations:
-            try:
-                pending_localization = next(self._localizations_it)
-                self._current_person_id = pending_localization['person_id']
-                self._current_gesture_id = pending_localization['gesture_id']
-                self._n_annotations = pending_localization['n_localizations']
-                for camera in self._cameras:
-                    filename = 'p{:03d}g{:02d}c{:02d}_2d.json'.format(
-                        self._current_person_id, self._current_gesture_id, camera)
-                    filepath = os.path.join(self._base_folder, filename)
-                    with open(filepath, 'r') as f:
-                        annotations = json.load(f)['annotations']
-                        if self._fix_frame_id:
-                            for annotation in annotations:
-                                annotation['frame_id'] = camera
-                        self._current_annotations[camera] = annotations
-
-                self._annotation_pos = 0
-                self._fwd_annotations = False
-            except StopIteration:
-                return None, None, None, None
-
-        annotations = [
-            self._current_annotations[camera][self._annotation_pos] for camera in self._cameras
-        ]
-        pos = self._annotation_pos
-
-        self._annotation_pos += 1
-        self._fwd_annotations = self._annotation_pos == self._n_annotations
-        return self._current_person_id, self._current_gesture_id, pos, annotations
+        """ Returns (person_id, gesture_id, pos, annotations) of the next frame. Each
+        sequence ends with 'pos' and 'annotations' as None, with a None size() when its
+        annotations files have different sizes. Everything is None after the last one. """
+        frame = self._frames.get()
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
@@ -1,5 +1,6 @@
 import os
 import cv2
+from threading import Thread, Event
 
 class VideoLoader:
     def __init__(self, filename=None):
@@ -42,7 +43,7 @@ class VideoLoader:
 
 
 class MultipleVideoLoader:
-    def __init__(self, filenames, folder='.'):
+    def __init__(self, filenames, folder='.', scale=1.0):
         assert (type(filenames) == dict)
         assert (len(filenames) > 0)
         self._filenames = {
@@ -63,6 +64,8 @@ class MultipleVideoLoader:
             raise Exception('Videos with different number of frames')
         self._n_frames = next(iter(n_frames))
         self._frames = {src: [] for src in self._video_captures.keys()}
+        self._scale = scale
+        self._n_bytes = 0
 
     def n_frames(self):
         return self._n_frames
@@ -70,6 +73,9 @@ class MultipleVideoLoader:
     def n_loaded_frames(self):
         return len(next(iter(self._frames.values())))
 
+    def loaded_bytes(self):
+        return self._n_bytes
+
     def fps(self):
         return {
             src: vc.get(cv2.CAP_PROP_FPS)
@@ -78,6 +84,7 @@ class MultipleVideoLoader:
     def release_memory(self):
         for src in self._frames.keys():
             del self._frames[src][:]
+        self._n_bytes = 0
 
     def load_next(self):
         next_frame_ids = [
@@ -90,6 +97,10 @@ class MultipleVideoLoader:
         frames = {}
         for src, vc in self._video_captures.items():
             _, frame = vc.read()
+            if frame is not None and self._scale != 1.0:
+                frame = cv2.resize(
+                    frame, None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+            self._n_bytes += frame.nbytes if frame is not None else 0
             self._frames[src].append(frame)
 
         return self.n_loaded_frames()
@@ -105,3 +116,37 @@ class MultipleVideoLoader:
             src: video_frames[index]
             for src, video_frames in self._frames.items()
         }
+
+
+class VideoPrefetcher:
+    """ Loads the frames of a MultipleVideoLoader on a background thread, until all of them
+    are loaded or they take 'max_bytes' of memory. 'get' stops the thread and hands the
+    loader over, so the remaining frames are loaded by the caller with 'load_next'. """
+
+    def __init__(self, filenames, folder='.', scale=1.0, max_bytes=1 << 30):
+        self._args = (filenames, folder, scale)
+        self._max_bytes = max_bytes
+        self._loader = None
+        self._error = None
+        self._stop = Event()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._loader = MultipleVideoLoader(*self._args)
+        except Exception as ex:
+            self._error = ex
+            return
+        loader = self._loader
+        while not self._stop.is_set() and loader.n_loaded_frames() < loader.n_frames() \
+                and loader.loaded_bytes() < self._max_bytes:
+            loader.load_next()
+
+    def get(self):
+        self._stop.set()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._loader
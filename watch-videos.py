@@ -9,71 +9,15 @@ import numpy as np
 from utils import load_options
 from utils import to_labels_array, to_labels_dict
 from video_loader import MultipleVideoLoader
+from proxies import proxy_videos
+from skeletons_renderer import load_renderers, render_skeletons
+from mosaic import Mosaic, camera_resolutions
+from player import Player
 from is_wire.core import Logger
 from collections import defaultdict, OrderedDict
 
-from is_msgs.image_pb2 import ObjectAnnotations
-from is_msgs.image_pb2 import HumanKeypoints as HKP
-from google.protobuf.json_format import ParseDict
-from itertools import permutations
-
-colors = list(permutations([0, 255, 85, 170], 3))
-links = [(HKP.Value('HEAD'), HKP.Value('NECK')),
-        (HKP.Value('NECK'), HKP.Value('CHEST')),
-        (HKP.Value('CHEST'), HKP.Value('RIGHT_HIP')),
-        (HKP.Value('CHEST'), HKP.Value('LEFT_HIP')),
-        (HKP.Value('NECK'), HKP.Value('LEFT_SHOULDER')),
-        (HKP.Value('LEFT_SHOULDER'), HKP.Value('LEFT_ELBOW')),
-        (HKP.Value('LEFT_ELBOW'), HKP.Value('LEFT_WRIST')),
-        (HKP.Value('NECK'), HKP.Value('LEFT_HIP')),
-        (HKP.Value('LEFT_HIP'), HKP.Value('LEFT_KNEE')),
-        (HKP.Value('LEFT_KNEE'), HKP.Value('LEFT_ANKLE')),
-        (HKP.Value('NECK'), HKP.Value('RIGHT_SHOULDER')),
-        (HKP.Value('RIGHT_SHOULDER'), HKP.Value('RIGHT_ELBOW')),
-        (HKP.Value('RIGHT_ELBOW'), HKP.Value('RIGHT_WRIST')),
-        (HKP.Value('NECK'), HKP.Value('RIGHT_HIP')),
-        (HKP.Value('RIGHT_HIP'), HKP.Value('RIGHT_KNEE')),
-        (HKP.Value('RIGHT_KNEE'), HKP.Value('RIGHT_ANKLE')),
-        (HKP.Value('NOSE'), HKP.Value('LEFT_EYE')),
-        (HKP.Value('LEFT_EYE'), HKP.Value('LEFT_EAR')),
-        (HKP.Value('NOSE'), HKP.Value('RIGHT_EYE')),
-        (HKP.Value('RIGHT_EYE'), HKP.Value('RIGHT_EAR'))]
-
-def render_skeletons(images, annotations, it, colors, links):
-    for cam_id, image in images.items():
-        skeletons = ParseDict(annotations[cam_id][it], ObjectAnnotations())
-        for ob in skeletons.objects:
-            parts = {}
-            for part in ob.keypoints:
-                parts[part.id] = (int(part.position.x), int(part.position.y))
-            for link_parts, color in zip(links, colors):
-                begin, end = link_parts
-                if begin in parts and end in parts:
-                    cv2.line(
-                        image,
-                        parts[begin],
-                        parts[end],
-                        color=color,
-                        thickness=4)
-            for _, center in parts.items():
-                cv2.circle(
-                    image,
-                    center=center,
-                    radius=4,
-                    color=(255, 255, 255),
-                    thickness=-1)
-
-
-def place_images(output_image, images, x_offset=0, y_offset=0):
-    w, h = images[0].shape[1], images[0].shape[0]
-    output_image[0 + y_offset:h + y_offset, 0 + x_offset:w +
-                 x_offset, :] = images[0]
-    output_image[0 + y_offset:h + y_offset, w + x_offset:2 * w +
-                 x_offset, :] = images[1]
-    output_image[h + y_offset:2 * h + y_offset, 0 + x_offset:w +
-                 x_offset, :] = images[2]
-    output_image[h + y_offset:2 * h + y_offset, w + x_offset:2 * w +
-                 x_offset, :] = images[3]
+
+DISPLAY_SCALE = 0.5
 
 
 log = Logger(name='WatchVideos')
@@ -95,6 +39,8 @@ parser.add_argument(
     '--person', '-p', type=int, required=True, help='ID to identity person')
 parser.add_argument(
     '--gesture', '-g', type=int, required=True, help='ID to identity gesture')
+parser.add_argument(
+    '--speed', '-s', type=float, default=1.0, help='Playback speed relative to the recording')
 args = parser.parse_args()
 
 person_id = args.person
@@ -129,36 +75,67 @@ if not all(
         'Missing one of video or annotations files from PERSON_ID {} and GESTURE_ID {}',
         person_id, gesture_id)
 
-size = (2 * options.cameras[0].config.image.resolution.height,
-        2 * options.cameras[0].config.image.resolution.width, 3)
-full_image = np.zeros(size, dtype=np.uint8)
+mosaic = Mosaic(camera_resolutions(options, cameras), scale=DISPLAY_SCALE)
 
+# proxies made by make-proxies.py are used when up to date, as they load much faster
+video_files, frame_scales = proxy_videos(video_files)
 video_loader = MultipleVideoLoader(video_files)
-# load annotations
-annotations = {}
-for cam_id, filename in json_files.items():
-    with open(filename, 'r') as f:
-        annotations[cam_id] = json.load(f)['annotations']
+# annotations are converted to keypoint arrays once, when the renderers are created
+renderers = load_renderers(json_files)
+
+
+def render(it):
+    frames = video_loader[it]
+    if frames is None:
+        return None
+    render_skeletons(mosaic.compose(frames), renderers, it, frame_scales)
+    return mosaic.image.copy()
+
+
+# frames are decoded and rendered ahead by the player thread, at the recorded rate
+player = Player(
+    render,
+    n_frames=video_loader.n_loaded_frames,
+    fps=min(video_loader.fps().values()),
+    load=lambda: video_loader.load_next() < video_loader.n_frames(),
+    speed=args.speed)
 
 update_image = True
 it_frames = 0
 while True:
-    if video_loader.n_loaded_frames() < video_loader.n_frames():
-        update_image = True
-    n_loaded_frames = video_loader.load_next()
-
-    if update_image:
-        frames = video_loader[it_frames]
-        if frames is not None:
-            render_skeletons(frames, annotations, it_frames, colors, links)
-            frames_list = [frames[cam] for cam in sorted(frames.keys())]
-            place_images(full_image, frames_list)
-        cv2.imshow('', cv2.resize(full_image, dsize=(0, 0), fx=0.5, fy=0.5))
-        update_image = False
-
-    key = cv2.waitKey(1)
+    if player.playing:
+        shown = player.poll()
+        if shown is not None:
+            it_frames, image = shown
+            cv2.imshow('', player.draw_status(image))
+    elif update_image:
+        image = player.render(it_frames)
+        # frames not loaded yet are rendered again on the next loop
+        update_image = image is None
+        if image is not None:
+            cv2.imshow('', image)
+
+    key = cv2.waitKey(player.wait_ms() if player.playing else 1)
     if key == -1:
         continue
+    n_loaded_frames = video_loader.n_loaded_frames()
+
+    if key == ord(keymap['play_pause']):
+        if player.playing:
+            it_frames = player.pause()
+            update_image = True
+        else:
+            player.play(it_frames)
+        continue
+
+    if key == ord(keymap['speed_up']) or key == ord(keymap['speed_down']):
+        player.set_speed(player.speed * (2.0 if key == ord(keymap['speed_up']) else 0.5))
+        log.info('Playback speed {:.2g}x', player.speed)
+        continue
+
+    # stepping through frames pauses the playback
+    if player.playing:
+        it_frames = player.pause()
 
     if key == ord(keymap['next_frames']):
         it_frames += keymap['big_step']
@@ -0,0 +1,116 @@
+import os
+import time
+import socket
+from threading import Thread, Event, Lock
+from is_wire.core import Logger
+
+LEASES_FOLDER = '.leases'
+
+
+class WorkQueue:
+    """ Lease based claims over items of a shared folder. A lease is a file created with
+    O_EXCL and kept alive by touching it, so leases of crashed workers expire after
+    'lease_sec' and may then be claimed by any other worker. """
+
+    def __init__(self, folder, lease_sec=60.0, worker_id=None):
+        self._folder = os.path.join(folder, LEASES_FOLDER)
+        if not os.path.exists(self._folder):
+            os.makedirs(self._folder, exist_ok=True)
+        self._lease_sec = lease_sec
+        self._worker_id = worker_id or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self._log = Logger(name='WorkQueue')
+        self._leases = set()
+        self._lock = Lock()
+        self._stop = Event()
+        self._heartbeat_thread = Thread(target=self._heartbeat)
+        self._heartbeat_thread.daemon = True
+        self._heartbeat_thread.start()
+
+    def worker_id(self):
+        return self._worker_id
+
+    def _path(self, item):
+        return os.path.join(self._folder, '{}.lease'.format(item))
+
+    def _create(self, path):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(self._worker_id)
+        return True
+
+    def _owner(self, path):
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _is_stale(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) > self._lease_sec
+        except FileNotFoundError:
+            return False
+
+    def _break(self, path):
+        # renaming is atomic, so only one of the workers racing for an expired lease moves it
+        broken = '{}.{}.broken'.format(path, self._worker_id.replace(os.sep, '_'))
+        try:
+            os.rename(path, broken)
+        except FileNotFoundError:
+            return
+        if not self._is_stale(broken):
+            # the lease was renewed or re-created between the check and the rename
+            try:
+                os.link(broken, path)
+            except FileExistsError:
+                pass
+        os.remove(broken)
+
+    def claim(self, item):
+        path = self._path(item)
+        with self._lock:
+            if item in self._leases:
+                return True
+            if not self._create(path):
+                if not self._is_stale(path):
+                    return False
+                self._log.warn("Lease of '{}' held by '{}' expired, taking over.", item,
+                               self._owner(path))
+                self._break(path)
+                if not self._create(path):
+                    return False
+            self._leases.add(item)
+            return True
+
+    def release(self, item):
+        with self._lock:
+            if item not in self._leases:
+                return
+            self._leases.remove(item)
+            path = self._path(item)
+            if self._owner(path) == self._worker_id:
+                os.remove(path)
+
+    def close(self):
+        self._stop.set()
+        self._heartbeat_thread.join()
+        for item in list(self._leases):
+            self.release(item)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self._lease_sec / 3.0):
+            with self._lock:
+                for item in list(self._leases):
+                    path = self._path(item)
+                    if self._owner(path) == self._worker_id:
+                        try:
+                            os.utime(path, None)
+                            continue
+                        except OSError:
+                            # broken by another worker since its owner was read
+                            pass
+                    self._log.warn("Lease of '{}' was lost.", item)
+                    self._leases.remove(item)